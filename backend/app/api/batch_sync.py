@@ -4,169 +4,263 @@
 """
 
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import case, update
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
 from datetime import datetime
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import SessionLocal, get_db
+from app.core.deps import get_current_user
 from app.models import models
 from app.schemas import schemas
-from app.utils.progressive_sync import ProgressiveSyncService
+from app.crud import changes as changes_crud
+from app.crud import rollup as rollup_crud
+from app.crud import sync_job as sync_job_crud
+from app.crud import todo as todo_crud
+from app.api.websocket import manager
+from app.api.offline_sync import (
+    coerce_field_value, field_value_text, is_concurrent_change, next_field_version
+)
+from app.utils.progressive_sync import AdaptiveBatchController, ProgressiveSyncService, SyncCheckpoint, SyncProgress
+from app.utils.sync_job_worker import SyncJobWorkerPool
+from app.utils.timestamp_service import hlc_clock
 import asyncio
+import json
+import time
 
 router = APIRouter(prefix="/batch-sync", tags=["批量同步"])
 
-# 全局同步服务实例
-sync_services = {}
-
-@router.get("/status/{user_id}")
-async def get_sync_status(user_id: int):
-    """获取用户同步状态"""
-    service = sync_services.get(user_id)
-    if not service:
+@router.get("/status")
+async def get_sync_status(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """获取当前用户最近一次批量同步任务的状态（任意进程均可读取）"""
+    job = sync_job_crud.get_latest_job(db, current_user.id)
+    if not job:
         return {
             "status": "idle",
             "message": "没有正在进行的同步"
         }
-    
-    progress = service.get_current_progress()
-    if not progress:
-        return {
-            "status": "idle",
-            "message": "同步服务已初始化但未开始"
-        }
-    
-    return {
-        "status": "syncing" if service.is_syncing else "completed",
-        "progress": {
-            "total_items": progress.total_items,
-            "completed_items": progress.completed_items,
-            "current_batch": progress.current_batch,
-            "total_batches": progress.total_batches,
-            "percentage": round(progress.percentage, 2),
-            "speed": round(progress.speed, 2) if progress.speed else None,
-            "estimated_time": round(progress.estimated_time, 0) if progress.estimated_time else None
-        }
-    }
+    return serialize_job(job)
+
+@router.get("/jobs/{job_id}")
+async def get_sync_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """获取指定批量同步任务的状态"""
+    job = sync_job_crud.get_job(db, job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="未找到同步任务")
+    return serialize_job(job)
 
 @router.post("/start")
 async def start_batch_sync(
     sync_request: schemas.BatchSyncRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
 ):
-    """开始批量同步"""
-    user_id = sync_request.user_id
+    """开始批量同步：写入任务队列，由工作者池认领执行"""
+    user_id = current_user.id
+    batch_size = sync_request.batch_size or 50
     
     # 检查是否已有同步在进行
-    if user_id in sync_services and sync_services[user_id].is_syncing:
+    if sync_job_crud.get_active_job(db, user_id):
         raise HTTPException(
             status_code=409,
             detail="该用户已有同步任务正在进行"
         )
     
-    # 获取需要同步的数据
-    pending_data = await get_pending_sync_data(db, user_id, sync_request.last_sync_time)
-    
-    if not pending_data:
+    # 上一次任务被取消或中断时从检查点续传，只处理检查点之后剩余的操作
+    resumable = sync_job_crud.get_resumable_job(db, user_id)
+    after_id = resumable.checkpoint_operation_id if resumable else None
+    only_ids = sync_job_crud.get_retry_item_ids(resumable) if resumable else None
+    pending_count = count_pending_sync_data(db, user_id, after_id, only_ids)
+    if not pending_count:
         return {
             "status": "completed",
             "message": "没有需要同步的数据",
             "items_processed": 0
         }
     
-    # 创建同步服务
-    service = ProgressiveSyncService(batch_size=sync_request.batch_size or 50)
-    sync_services[user_id] = service
-    
-    # 启动异步同步任务
-    asyncio.create_task(
-        perform_batch_sync(service, user_id, pending_data, db)
-    )
+    if resumable:
+        job = sync_job_crud.requeue_job(db, resumable, resumable.checkpoint_items + pending_count)
+    else:
+        job = sync_job_crud.create_job(db, user_id, batch_size, pending_count)
+    if job is None:
+        raise HTTPException(
+            status_code=409,
+            detail="该用户已有同步任务正在进行"
+        )
+    worker_pool.notify()
     
     return {
-        "status": "started",
-        "message": f"开始同步 {len(pending_data)} 项数据",
-        "total_items": len(pending_data),
-        "batch_size": sync_request.batch_size or 50
+        "status": "queued",
+        "job_id": job.id,
+        "resumed": resumable is not None,
+        "resume_from_batch": job.checkpoint_batch,
+        "message": f"开始同步 {pending_count} 项数据",
+        "total_items": job.total_items,
+        "batch_size": job.batch_size
     }
 
-@router.post("/cancel/{user_id}")
-async def cancel_sync(user_id: int):
-    """取消同步"""
-    service = sync_services.get(user_id)
-    if not service:
+@router.post("/cancel")
+async def cancel_sync(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """取消同步：排队中的任务立即取消，运行中的任务由执行它的工作者在下次续约时停止"""
+    job = sync_job_crud.get_active_job(db, current_user.id)
+    if not job:
         raise HTTPException(status_code=404, detail="未找到同步任务")
     
-    service.cancel_sync()
-    
-    # 清理服务实例
-    if user_id in sync_services:
-        del sync_services[user_id]
-    
-    return {"message": "同步已取消"}
+    job = sync_job_crud.request_cancel(db, job)
+    return {"message": "同步已取消" if job.status == "cancelled" else "已请求取消同步", "job_id": job.id}
 
-@router.get("/items/{user_id}")
+@router.get("/items", response_model=schemas.SyncItemPage)
 async def get_sync_items(
-    user_id: int,
+    job_id: Optional[int] = Query(None, description="任务ID，默认为最近一次任务"),
     batch_id: Optional[int] = Query(None),
-    status: Optional[str] = Query(None),
-    page: int = Query(1, ge=1),
-    size: int = Query(20, ge=1, le=100)
+    status: Optional[str] = Query(None, description="synced, conflicted, error"),
+    cursor: Optional[int] = Query(None, ge=0, description="上一页返回的 next_cursor"),
+    size: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """获取同步项目详情（键集分页）"""
+    job = _get_job_or_latest(db, current_user.id, job_id)
+    if job is None:
+        return {"job_id": None, "items": [], "next_cursor": None}
+    items, next_cursor = sync_job_crud.list_items(db, job.id, status, batch_id, cursor, size)
+    return {"job_id": job.id, "items": items, "next_cursor": next_cursor}
+
+@router.get("/errors", response_model=schemas.SyncErrorPage)
+async def get_sync_errors(
+    job_id: Optional[int] = Query(None, description="任务ID，默认为最近一次任务"),
+    error_type: Optional[str] = Query(None),
+    cursor: Optional[int] = Query(None, ge=0, description="上一页返回的 next_cursor"),
+    size: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
 ):
-    """获取同步项目详情"""
-    # 这里应该从数据库或缓存中获取具体的同步项目信息
-    # 简化实现，返回模拟数据
+    """获取同步错误（键集分页）"""
+    job = _get_job_or_latest(db, current_user.id, job_id)
+    if job is None:
+        return {"job_id": None, "errors": [], "next_cursor": None}
+    errors, next_cursor = sync_job_crud.list_errors(db, job.id, error_type, cursor, size)
+    return {"job_id": job.id, "errors": errors, "next_cursor": next_cursor}
+
+@router.post("/retry")
+async def retry_failed_items(
+    retry_request: schemas.BatchSyncRetryRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """只重试任务中处理失败的项目（可以指定其中一部分），作为新任务排队"""
+    if sync_job_crud.get_active_job(db, current_user.id):
+        raise HTTPException(status_code=409, detail="该用户已有同步任务正在进行")
+    
+    source = _get_job_or_latest(db, current_user.id, retry_request.job_id)
+    if source is None:
+        raise HTTPException(status_code=404, detail="未找到同步任务")
     
-    items = []
-    total_items = 0
+    item_ids = sync_job_crud.get_failed_item_ids(db, source.id, retry_request.item_ids)
+    if not item_ids:
+        return {
+            "status": "completed",
+            "message": "没有需要重试的项目",
+            "items_processed": 0
+        }
     
-    # 实际应用中应该查询具体的同步记录
-    # 例如：查询离线操作表中该用户的相关记录
+    job = sync_job_crud.create_retry_job(
+        db, current_user.id, retry_request.batch_size or source.batch_size, item_ids
+    )
+    if job is None:
+        raise HTTPException(status_code=409, detail="该用户已有同步任务正在进行")
+    worker_pool.notify()
     
     return {
-        "items": items,
-        "pagination": {
-            "page": page,
-            "size": size,
-            "total": total_items,
-            "pages": (total_items + size - 1) // size
-        }
+        "status": "queued",
+        "job_id": job.id,
+        "retry_of": source.id,
+        "message": f"重试 {len(item_ids)} 项数据",
+        "total_items": len(item_ids),
+        "batch_size": job.batch_size
     }
 
-@router.get("/errors/{user_id}")
-async def get_sync_errors(user_id: int):
-    """获取同步错误"""
-    # 查询该用户的同步错误记录
-    # 实际应用中应该查询错误日志表
-    
-    errors = [
-        {
-            "id": 1,
-            "item_id": 100,
-            "error_type": "conflict",
-            "message": "数据冲突，需要手动解决",
-            "timestamp": "2024-01-01T10:30:00",
-            "details": {
-                "server_value": "服务器版本",
-                "client_value": "客户端版本"
-            }
+# 辅助函数
+def _get_job_or_latest(db: Session, user_id: int, job_id: Optional[int]) -> Optional[models.BatchSyncJob]:
+    if job_id is None:
+        return sync_job_crud.get_latest_job(db, user_id)
+    job = sync_job_crud.get_job(db, job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="未找到同步任务")
+    return job
+
+def serialize_job(job: models.BatchSyncJob) -> dict:
+    percentage = (job.completed_items / job.total_items * 100) if job.total_items else 0.0
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "retry": job.retry_item_ids is not None,
+        "cancel_requested": job.cancel_requested,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "error": job.error,
+        "progress": {
+            "total_items": job.total_items,
+            "completed_items": job.completed_items,
+            "current_batch": job.current_batch,
+            "total_batches": job.total_batches,
+            "percentage": round(percentage, 2),
+            "speed": round(job.speed, 2) if job.speed else None,
+            "estimated_time": round(job.estimated_time, 0) if job.estimated_time else None,
+            "batch_size": job.current_batch_size or job.batch_size,
+            "concurrency": job.concurrency
         }
-    ]
-    
-    return {"errors": errors}
+    }
 
-# 辅助函数
-async def get_pending_sync_data(db: Session, user_id: int, last_sync_time: Optional[datetime]) -> List[dict]:
-    """获取待同步的数据"""
-    # 查询离线操作记录
+def _pending_operations_query(
+    db: Session,
+    user_id: int,
+    after_id: Optional[int] = None,
+    only_ids: Optional[List[int]] = None
+):
+    # 待应用的离线操作由 sync_status 精确标识，不依赖客户端时间戳过滤（会受时钟偏差影响而漏掉操作）
     query = db.query(models.OfflineOperation).filter(
         models.OfflineOperation.user_id == user_id,
         models.OfflineOperation.sync_status == "pending"
     )
-    
-    if last_sync_time:
-        query = query.filter(models.OfflineOperation.timestamp > last_sync_time)
-    
-    operations = query.order_by(models.OfflineOperation.timestamp).all()
+    if after_id is not None:
+        query = query.filter(models.OfflineOperation.id > after_id)
+    if only_ids is not None:
+        query = query.filter(models.OfflineOperation.id.in_(only_ids))
+    return query
+
+def count_pending_sync_data(
+    db: Session,
+    user_id: int,
+    after_id: Optional[int] = None,
+    only_ids: Optional[List[int]] = None
+) -> int:
+    return _pending_operations_query(db, user_id, after_id, only_ids).count()
+
+def get_pending_sync_data(
+    db: Session,
+    user_id: int,
+    after_id: Optional[int] = None,
+    only_ids: Optional[List[int]] = None
+) -> List[dict]:
+    """
+    获取待同步的数据，按主键顺序扫描；after_id 为检查点，只返回其后的操作，
+    only_ids 为选择性重试时限定的操作
+    """
+    operations = _pending_operations_query(db, user_id, after_id, only_ids).order_by(models.OfflineOperation.id).all()
     
     # 转换为同步数据格式
     sync_data = []
@@ -187,79 +281,452 @@ async def get_pending_sync_data(db: Session, user_id: int, last_sync_time: Optio
     
     return sync_data
 
-async def perform_batch_sync(service: ProgressiveSyncService, user_id: int, data: List[dict], db: Session):
-    """执行批量同步"""
+def load_pending_sync_data(
+    user_id: int,
+    after_id: Optional[int] = None,
+    only_ids: Optional[List[int]] = None
+) -> List[dict]:
+    db = SessionLocal()
+    try:
+        return get_pending_sync_data(db, user_id, after_id, only_ids)
+    finally:
+        db.close()
+
+async def perform_batch_sync(
+    service: ProgressiveSyncService,
+    user_id: int,
+    data: List[dict],
+    job: Optional[models.BatchSyncJob] = None,
+    worker_id: Optional[str] = None
+):
+    """
+    执行批量同步，批次失败通过服务的错误监听器报告。
+    传入任务时从任务的检查点继续，并在每批应用的同一事务中推进检查点
+    """
+    resume_from = SyncCheckpoint(
+        batch_id=job.checkpoint_batch,
+        completed_items=job.checkpoint_items,
+        last_item_id=job.checkpoint_operation_id
+    ) if job else None
+    state = {
+        "batch": resume_from.batch_id if resume_from else 0,
+        "items": resume_from.completed_items if resume_from else 0,
+        "contiguous": True,
+    }
     
-    async def process_item(item: dict):
-        """处理单个项目"""
+    async def process_batch(items: List[dict]):
+        """整批应用离线操作，数据库操作放到线程中执行，不阻塞事件循环；返回冲突或未能应用的操作数"""
+        state["batch"] += 1
+        operations = [item for item in items if item["type"] == "operation"]
+        operation_ids = [item["id"] for item in operations]
+        checkpoint = ledger = None
+        if job:
+            ledger = (job.id, state["batch"], {item["id"]: item["todo_id"] for item in operations})
+            if state["contiguous"]:
+                checkpoint = (job.id, worker_id, state["batch"], state["items"] + len(items), items[-1]["id"])
         try:
-            # 根据项目类型执行相应的同步操作
-            if item["type"] == "operation":
-                await apply_operation(item, db, user_id)
-            # 可以添加其他类型的处理
-            
+            result = await asyncio.to_thread(apply_batch_in_session, user_id, operation_ids, checkpoint, ledger)
         except Exception as e:
-            # 记录错误但不中断整个同步
-            print(f"处理项目 {item['id']} 时出错: {e}")
+            # 失败批次之后的批次不再推进检查点，续传时从失败处重新开始
+            state["contiguous"] = False
+            if ledger:
+                await asyncio.to_thread(record_batch_failure, user_id, ledger, str(e))
             raise
+        state["items"] += len(items)
+        # 逐项的冲突和错误计入控制器的错误率，而不只是整批异常
+        return result["conflicted"]
     
+    await service.sync_large_dataset(data, process_batch_func=process_batch, resume_from=resume_from)
+
+def build_batch_controller(batch_size: int) -> AdaptiveBatchController:
+    """按配置的上下限创建自适应批次控制器，初始批次大小取请求中的值"""
+    return AdaptiveBatchController(
+        batch_size=batch_size,
+        min_batch_size=settings.BATCH_SYNC_MIN_BATCH_SIZE,
+        max_batch_size=settings.BATCH_SYNC_MAX_BATCH_SIZE,
+        max_concurrency=settings.BATCH_SYNC_MAX_CONCURRENCY,
+        target_latency=settings.BATCH_SYNC_TARGET_BATCH_LATENCY,
+        max_error_rate=settings.BATCH_SYNC_MAX_ERROR_RATE,
+    )
+
+def serialize_progress(progress: SyncProgress) -> dict:
+    return {
+        "total_items": progress.total_items,
+        "completed_items": progress.completed_items,
+        "current_batch": progress.current_batch,
+        "total_batches": progress.total_batches,
+        "percentage": round(progress.percentage, 2),
+        "speed": round(progress.speed, 2) if progress.speed else None,
+        "estimated_time": round(progress.estimated_time, 0) if progress.estimated_time else None,
+        "batch_size": progress.batch_size,
+        "concurrency": progress.concurrency
+    }
+
+def progress_publisher(job_id: int, user_id: int, interval: Optional[float] = None) -> Callable[[SyncProgress], None]:
+    """
+    创建进度监听器：把进度推送到该用户在本进程的WebSocket连接，
+    每个任务最多每 interval 秒推送一次，最后一批完成时总会推送
+    """
+    interval = settings.BATCH_SYNC_PROGRESS_INTERVAL if interval is None else interval
+    last_sent = {"at": None}
+    
+    def on_progress(progress: SyncProgress):
+        now = time.monotonic()
+        finished = progress.completed_items == progress.total_items
+        if not finished and last_sent["at"] is not None and now - last_sent["at"] < interval:
+            return
+        if user_id not in manager.active_connections:
+            return
+        last_sent["at"] = now
+        _send_in_background({
+            "type": "batch_sync_progress",
+            "job_id": job_id,
+            "status": "running",
+            "progress": serialize_progress(progress),
+            "timestamp": datetime.utcnow().isoformat()
+        }, user_id)
+    
+    return on_progress
+
+# 后台发送任务的引用，避免任务在完成前被回收
+_pending_sends = set()
+
+def _send_in_background(message: dict, user_id: int):
+    task = asyncio.get_running_loop().create_task(manager.send_personal_message(message, user_id))
+    _pending_sends.add(task)
+    task.add_done_callback(_pending_sends.discard)
+
+class JobProgressRelay:
+    """
+    把其他进程执行的任务进度转发给连接在本进程的用户：
+    只在有WebSocket连接时按推送间隔查询这些用户在上次查询之后有更新的任务。
+    本进程执行的任务由 progress_publisher 直接推送，任务结束的消息统一由转发器发出
+    """
+    
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    
+    async def _run(self):
+        interval = self.interval if self.interval is not None else settings.BATCH_SYNC_PROGRESS_INTERVAL
+        since = datetime.utcnow()
+        while True:
+            await asyncio.sleep(interval)
+            user_ids = list(manager.active_connections)
+            if not user_ids:
+                since = datetime.utcnow()
+                continue
+            polled_at = datetime.utcnow()
+            try:
+                jobs = await asyncio.to_thread(_load_updated_jobs, user_ids, since)
+            except Exception as e:
+                print(f"读取批量同步进度失败: {e}")
+                continue
+            since = polled_at
+            for job in jobs:
+                if job.status == "running" and (job.lease_owner or "").startswith(worker_pool.pool_id):
+                    continue
+                message = serialize_job(job)
+                message["type"] = "batch_sync_finished" if job.status in sync_job_crud.FINISHED_STATUSES else "batch_sync_progress"
+                message["timestamp"] = datetime.utcnow().isoformat()
+                await manager.send_personal_message(jsonable_encoder(message), job.user_id)
+
+def _load_updated_jobs(user_ids: List[int], since: datetime) -> List[models.BatchSyncJob]:
+    db = SessionLocal()
     try:
-        await service.sync_large_dataset(data, process_item, delay_between_batches=0.1)
-        
-        # 同步完成后清理服务实例
-        if user_id in sync_services:
-            del sync_services[user_id]
-            
-    except Exception as e:
-        print(f"批量同步失败: {e}")
-        # 记录错误日志
-        if user_id in sync_services:
-            del sync_services[user_id]
+        return sync_job_crud.get_jobs_updated_since(db, user_ids, since)
+    finally:
+        db.close()
 
-async def apply_operation(operation: dict, db: Session, user_id: int):
-    """应用单个操作"""
-    # 这里实现具体的操作应用逻辑
-    # 类似于之前的离线同步处理
-    
-    # 例如：
-    # if operation["operation_type"] == "UPDATE":
-    #     todo = db.query(models.Todo).filter(
-    #         models.Todo.id == operation["todo_id"],
-    #         models.Todo.user_id == user_id
-    #     ).first()
-    #     
-    #     if todo and hasattr(todo, operation["field_name"]):
-    #         setattr(todo, operation["field_name"], operation["new_value"])
-    #         todo.updated_at = datetime.utcnow()
-    #         db.commit()
-    
-    # 模拟处理时间
-    await asyncio.sleep(0.01)  # 10ms
+def _job_heartbeat(job_id: int, worker_id: str, progress) -> Optional[bool]:
+    db = SessionLocal()
+    try:
+        return sync_job_crud.heartbeat(db, job_id, worker_id, progress)
+    finally:
+        db.close()
 
-# Schema定义
-from pydantic import BaseModel
-from typing import Optional
-from datetime import datetime
+def _finish_job(job_id: int, worker_id: str, status: str, progress, error: Optional[str]) -> bool:
+    db = SessionLocal()
+    try:
+        return sync_job_crud.finish_job(db, job_id, worker_id, status, progress, error)
+    finally:
+        db.close()
 
-class BatchSyncRequest(BaseModel):
-    user_id: int
-    last_sync_time: Optional[datetime] = None
-    batch_size: Optional[int] = 50
-    include_tasks: bool = True
-    include_comments: bool = True
-    include_assignments: bool = True
+async def run_sync_job(job: models.BatchSyncJob, worker_id: str):
+    """
+    工作者执行一个已认领的任务：定期续约并写回进度，
+    续约时发现取消请求或租约丢失就停止。被重新认领或续传的任务从检查点之后继续，
+    已应用的批次不会重复执行
+    """
+    data = await asyncio.to_thread(
+        load_pending_sync_data, job.user_id, job.checkpoint_operation_id, sync_job_crud.get_retry_item_ids(job)
+    )
+    service = ProgressiveSyncService(controller=build_batch_controller(job.batch_size))
+    errors: List[str] = []
+    service.add_error_listener(errors.append)
+    state = {"cancelled": False, "lease_lost": False}
+    
+    service.add_progress_listener(progress_publisher(job.id, job.user_id))
+    
+    async def keep_lease():
+        # 续约同时写回进度，间隔不超过推送间隔，其他进程转发的进度因此足够新
+        interval = max(min(settings.BATCH_SYNC_LEASE_SECONDS / 3, settings.BATCH_SYNC_PROGRESS_INTERVAL), 0.1)
+        while True:
+            await asyncio.sleep(interval)
+            result = await asyncio.to_thread(
+                _job_heartbeat, job.id, worker_id, service.get_current_progress()
+            )
+            if result is None:
+                state["lease_lost"] = True
+                service.cancel_sync()
+                return
+            if result:
+                state["cancelled"] = True
+                service.cancel_sync()
+                return
+    
+    heartbeat_task = asyncio.create_task(keep_lease())
+    try:
+        await perform_batch_sync(service, job.user_id, data, job, worker_id)
+    finally:
+        heartbeat_task.cancel()
+        await asyncio.gather(heartbeat_task, return_exceptions=True)
+    
+    if state["lease_lost"]:
+        print(f"批量同步任务 {job.id} 的租约已被其他工作者取得，停止执行")
+        return
+    
+    # 结束前再检查一次取消请求，避免最后一次续约之后的取消被忽略
+    if not state["cancelled"]:
+        state["cancelled"] = bool(await asyncio.to_thread(_job_heartbeat, job.id, worker_id, None))
+    
+    progress = service.get_current_progress()
+    completed = progress is None or progress.completed_items == progress.total_items
+    if completed:
+        status, error = "completed", None
+    elif state["cancelled"]:
+        status, error = "cancelled", None
+    else:
+        status, error = "failed", "; ".join(errors) or "同步未完成"
+    await asyncio.to_thread(_finish_job, job.id, worker_id, status, progress, error)
 
-class SyncItem(BaseModel):
-    id: int
-    type: str  # task, comment, assignment, operation
-    title: str
-    description: Optional[str] = None
-    status: str  # pending, processing, completed, error
+worker_pool = SyncJobWorkerPool(run_sync_job)
+progress_relay = JobProgressRelay()
 
-class SyncError(BaseModel):
-    id: int
-    item_id: int
-    error_type: str
-    message: str
-    timestamp: datetime
-    details: Optional[dict] = None
\ No newline at end of file
+def apply_batch_in_session(
+    user_id: int,
+    operation_ids: List[int],
+    checkpoint: Optional[tuple] = None,
+    ledger: Optional[tuple] = None
+) -> dict:
+    """
+    在独立会话中应用一批操作并提交（请求的会话在后台任务运行时可能已关闭）
+    checkpoint 为 (任务ID, 工作者ID, 批次号, 已完成项目数, 最大操作ID)，
+    ledger 为 (任务ID, 批次号, {操作ID: 任务ID})，检查点和逐项结果与本批修改一起提交
+    """
+    db = SessionLocal()
+    try:
+        result = apply_operations_batch(db, user_id, operation_ids)
+        if checkpoint and not sync_job_crud.save_checkpoint(db, *checkpoint):
+            raise RuntimeError("任务租约已失效，放弃本批修改")
+        if ledger:
+            job_id, batch_id, todo_ids = ledger
+            sync_job_crud.record_items(db, job_id, user_id, batch_id, [
+                (op_id, todo_ids.get(op_id), status) for op_id, status in result["statuses"].items()
+            ])
+            sync_job_crud.record_errors(db, job_id, user_id, batch_id, [
+                (op_id, error_type, message, details)
+                for op_id, (error_type, message, details) in result["problems"].items()
+            ])
+        db.commit()
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def record_batch_failure(user_id: int, ledger: tuple, error: str):
+    """批次回滚后单独记录失败：每个操作一条 error 结果，外加一条批次错误"""
+    job_id, batch_id, todo_ids = ledger
+    db = SessionLocal()
+    try:
+        sync_job_crud.record_items(db, job_id, user_id, batch_id, [
+            (op_id, todo_id, "error") for op_id, todo_id in todo_ids.items()
+        ])
+        sync_job_crud.record_errors(db, job_id, user_id, batch_id, [
+            (None, "batch_failed", f"批次 {batch_id} 处理失败: {error}", {"item_ids": sorted(todo_ids)})
+        ])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"记录批次失败信息出错: {e}")
+    finally:
+        db.close()
+
+def apply_operations_batch(db: Session, user_id: int, operation_ids: List[int]) -> dict:
+    """
+    批量应用一批待处理的离线操作：
+    按任务分组、在内存中依次解析每个任务各字段的最终值（与 /offline/sync 相同的HLC冲突规则），
+    再用一条按主键的批量 UPDATE 写回，操作状态用一条语句更新。调用方负责提交。
+    返回计数，以及每个操作的状态 statuses 和未能正常应用的原因 problems
+    """
+    if not operation_ids:
+        return {"synced": 0, "conflicted": 0, "todos_updated": 0, "statuses": {}, "problems": {}}
+    
+    operations = db.query(models.OfflineOperation).filter(
+        models.OfflineOperation.id.in_(operation_ids),
+        models.OfflineOperation.user_id == user_id,
+        models.OfflineOperation.sync_status == "pending"
+    ).order_by(
+        models.OfflineOperation.logical_timestamp,
+        models.OfflineOperation.id
+    ).all()
+    
+    todos = {
+        todo.id: todo
+        for todo in db.query(models.Todo).filter(
+            models.Todo.id.in_({op.todo_id for op in operations}),
+            models.Todo.user_id == user_id
+        )
+    }
+    
+    statuses: Dict[int, str] = {}
+    problems: Dict[int, tuple] = {}  # 操作ID -> (错误类型, 说明, 详情)
+    values: Dict[int, dict] = {}  # 任务ID -> {字段: 最终值}
+    versions: Dict[int, dict] = {}  # 任务ID -> 合并后的字段版本
+    deleted = set()
+    
+    for op in operations:
+        todo = todos.get(op.todo_id)
+        if todo is None or op.todo_id in deleted:
+            statuses[op.id] = "conflicted"
+            problems[op.id] = ("todo_missing", "任务不存在或已被删除", {"todo_id": op.todo_id})
+            continue
+        
+        if op.operation_type == "DELETE":
+            deleted.add(op.todo_id)
+            values.pop(op.todo_id, None)
+            statuses[op.id] = "synced"
+            continue
+        
+        field = op.field_name
+        if op.operation_type != "UPDATE" or not todo_crud.is_writable_field(field):
+            statuses[op.id] = "conflicted"
+            problems[op.id] = ("invalid_field", "不支持的操作或不允许修改的字段", {
+                "operation_type": op.operation_type, "field_name": field
+            })
+            continue
+        try:
+            new_value = coerce_field_value(field, op.new_value)
+        except (ValueError, TypeError, KeyError):
+            statuses[op.id] = "conflicted"
+            problems[op.id] = ("invalid_value", "字段值格式错误", {"field_name": field, "value": op.new_value})
+            continue
+        if op.hlc and not hlc_clock.is_within_drift(op.hlc):
+            statuses[op.id] = "conflicted"
+            problems[op.id] = ("invalid_hlc", "客户端时钟超前过多", {"field_name": field, "hlc": op.hlc})
+            continue
+        
+        todo_values = values.setdefault(op.todo_id, {})
+        todo_versions = versions.setdefault(op.todo_id, todo_crud.get_field_versions(todo))
+        server_version = todo_versions.get(field)
+        current_value = todo_values.get(field, getattr(todo, field))
+        
+        concurrent = is_concurrent_change(op, server_version, current_value)
+        client_wins = (
+            not concurrent
+            or op.hlc is None
+            or server_version is None
+            or op.hlc > server_version
+        )
+        if client_wins:
+            todo_values[field] = new_value
+            todo_versions[field] = next_field_version(op, server_version)
+        
+        conflict = concurrent and field_value_text(current_value) != field_value_text(new_value)
+        statuses[op.id] = "conflicted" if conflict else "synced"
+        if conflict:
+            problems[op.id] = ("conflict", "数据冲突，需要手动解决", {
+                "field_name": field,
+                "server_value": field_value_text(current_value),
+                "client_value": op.new_value,
+                "resolved_with": "client" if client_wins else "server",
+            })
+    
+    # 删除走会话，以便级联删除评论/进度并记录墓碑
+    for todo_id in deleted:
+        todo = todos[todo_id]
+        contribution = rollup_crud.get_subtree_contribution(db, todo)
+        parent_id = todo.parent_id
+        db.delete(todo)
+        rollup_crud.on_subtree_removed(db, parent_id, contribution)
+    db.flush()
+    
+    changed_ids = [todo_id for todo_id, todo_values in values.items() if todo_values]
+    if changed_ids:
+        # 批量 UPDATE 绕过会话的flush钩子，显式记录变更日志
+        seqs = changes_crud.record_changes(db, [
+            ("todo", todo_id, user_id, changes_crud.UPSERT) for todo_id in changed_ids
+        ])
+        # 批量 UPDATE 会同步会话中已加载的对象，先记下汇总计算需要的旧值
+        previous = {
+            todo_id: (todos[todo_id].parent_id, todos[todo_id].completed, todos[todo_id].due_date)
+            for todo_id in changed_ids
+        }
+        now = datetime.utcnow()
+        db.execute(update(models.Todo), [
+            {
+                "id": todo_id,
+                **values[todo_id],
+                "field_versions": json.dumps(versions[todo_id], sort_keys=True),
+                "version": todos[todo_id].version + 1,
+                "updated_at": now,
+                "change_seq": seq,
+            }
+            for todo_id, seq in zip(changed_ids, seqs)
+        ])
+        
+        # 完成状态和截止日期的变化需要更新祖先汇总，同一父任务下的变化合并后一次应用
+        parent_deltas: Dict[int, list] = {}
+        for todo_id in changed_ids:
+            parent_id, was_completed, old_due_date = previous[todo_id]
+            todo_values = values[todo_id]
+            completed_delta = 0
+            if "completed" in todo_values:
+                completed_delta = int(bool(todo_values["completed"])) - int(bool(was_completed))
+            due_changed = "due_date" in todo_values and todo_values["due_date"] != old_due_date
+            if parent_id is not None and (completed_delta or due_changed):
+                delta = parent_deltas.setdefault(parent_id, [0, False])
+                delta[0] += completed_delta
+                delta[1] = delta[1] or due_changed
+        for parent_id, (completed_delta, due_changed) in parent_deltas.items():
+            rollup_crud.adjust_ancestors(
+                db, parent_id, completed=completed_delta, due_changed=due_changed
+            )
+    
+    db.execute(
+        update(models.OfflineOperation).where(
+            models.OfflineOperation.id.in_(list(statuses))
+        ).values(sync_status=case(statuses, value=models.OfflineOperation.id)),
+        execution_options={"synchronize_session": False}
+    )
+    
+    synced = sum(1 for status in statuses.values() if status == "synced")
+    return {
+        "synced": synced,
+        "conflicted": len(statuses) - synced,
+        "todos_updated": len(changed_ids),
+        "statuses": statuses,
+        "problems": problems,
+    }
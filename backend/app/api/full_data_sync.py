@@ -3,275 +3,252 @@
 提供完整的数据导出和增量同步功能
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime, timedelta
 from app.core.database import get_db
+from app.core.deps import get_current_user
 from app.models import models
 from app.schemas import schemas
-from app.api.auth import get_current_user
+from app.crud import changes as changes_crud
+from app.crud import export_snapshot as export_snapshot_crud
+from app.crud import manifest as manifest_crud
+from app.crud import merkle as merkle_crud
+from app.utils import data_export, merkle
+from app.utils.data_import import IMPORT_CHUNK_SIZE, StagedImport, iter_document_records, iter_ndjson_records
+from app.utils.export_snapshot import snapshot_exporter, snapshot_response
+from app.utils.sync_codec import (
+    NDJSON_MEDIA_TYPE, NegotiatedRoute, is_msgpack, is_ndjson, negotiate, wants_ndjson
+)
+import asyncio
+import base64
 import json
+import os
 
-router = APIRouter(prefix="/full-sync", tags=["全量同步"])
+# 所有接口的请求和响应都支持 JSON / MessagePack 协商
+router = APIRouter(prefix="/full-sync", tags=["全量同步"], route_class=NegotiatedRoute)
 
 @router.get("/export")
 async def export_all_user_data(
+    request: Request,
     since: Optional[datetime] = None,
     include_deleted: bool = False,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    """导出用户所有数据"""
+    """
+    导出用户所有数据
+    JSON 与 NDJSON 按数据类型分批读取并以流式响应逐段输出，MessagePack 需要整体编码，仍一次性构建
+    """
     
     try:
-        # 获取用户的所有任务
-        todos_query = db.query(models.Todo).filter(
-            models.Todo.user_id == current_user.id
-        )
-        
-        if not include_deleted:
-            todos_query = todos_query.filter(models.Todo.deleted == False)
-        
-        if since:
-            todos_query = todos_query.filter(models.Todo.updated_at > since)
-        
-        todos = todos_query.all()
-        
-        # 获取用户的评论
-        comments_query = db.query(models.Comment).filter(
-            models.Comment.user_id == current_user.id
-        )
-        
-        if since:
-            comments_query = comments_query.filter(models.Comment.created_at > since)
-        
-        comments = comments_query.all()
-        
-        # 获取任务分配
-        assignments_query = db.query(models.TaskAssignment).filter(
-            models.TaskAssignment.assignee_id == current_user.id
-        )
-        
-        if since:
-            assignments_query = assignments_query.filter(models.TaskAssignment.updated_at > since)
+        if is_msgpack(request.headers.get("accept")):
+            export_data = data_export.build_export(
+                db, current_user.id, current_user.username, since, include_deleted
+            )
+            return negotiate(request, export_data)
         
-        assignments = assignments_query.all()
+        if wants_ndjson(request):
+            return StreamingResponse(
+                data_export.iter_export_ndjson(current_user.id, current_user.username, since, include_deleted),
+                media_type=NDJSON_MEDIA_TYPE
+            )
         
-        # 获取共享清单
-        shared_lists_query = db.query(models.SharedList).filter(
-            models.SharedList.owner_id == current_user.id
+        return StreamingResponse(
+            data_export.iter_export_json(current_user.id, current_user.username, since, include_deleted),
+            media_type="application/json"
         )
         
-        if since:
-            shared_lists_query = shared_lists_query.filter(models.SharedList.updated_at > since)
-        
-        owned_lists = shared_lists_query.all()
-        
-        # 获取作为成员的共享清单
-        member_lists = db.query(models.SharedListMember).filter(
-            models.SharedListMember.user_id == current_user.id
-        ).all()
-        
-        member_list_ids = [member.list_id for member in member_lists]
-        shared_member_lists = db.query(models.SharedList).filter(
-            models.SharedList.id.in_(member_list_ids)
-        ).all() if member_list_ids else []
-        
-        # 构建响应数据
-        export_data = {
-            "export_timestamp": datetime.utcnow().isoformat(),
-            "user_id": current_user.id,
-            "user_username": current_user.username,
-            "data": {
-                "todos": [
-                    {
-                        "id": todo.id,
-                        "title": todo.title,
-                        "description": todo.description,
-                        "completed": todo.completed,
-                        "priority": todo.priority,
-                        "category": todo.category,
-                        "due_date": todo.due_date.isoformat() if todo.due_date else None,
-                        "parent_id": todo.parent_id,
-                        "created_at": todo.created_at.isoformat(),
-                        "updated_at": todo.updated_at.isoformat(),
-                        "version": todo.version
-                    }
-                    for todo in todos
-                ],
-                "comments": [
-                    {
-                        "id": comment.id,
-                        "todo_id": comment.todo_id,
-                        "content": comment.content,
-                        "created_at": comment.created_at.isoformat(),
-                        "updated_at": comment.updated_at.isoformat()
-                    }
-                    for comment in comments
-                ],
-                "assignments": [
-                    {
-                        "id": assignment.id,
-                        "todo_id": assignment.todo_id,
-                        "assigner_id": assignment.assigner_id,
-                        "assignee_id": assignment.assignee_id,
-                        "status": assignment.status,
-                        "assigned_at": assignment.assigned_at.isoformat() if assignment.assigned_at else None,
-                        "completed_at": assignment.completed_at.isoformat() if assignment.completed_at else None
-                    }
-                    for assignment in assignments
-                ],
-                "owned_shared_lists": [
-                    {
-                        "id": shared_list.id,
-                        "name": shared_list.name,
-                        "description": shared_list.description,
-                        "created_at": shared_list.created_at.isoformat(),
-                        "updated_at": shared_list.updated_at.isoformat(),
-                        "default_permission": shared_list.default_permission
-                    }
-                    for shared_list in owned_lists
-                ],
-                "member_shared_lists": [
-                    {
-                        "id": shared_list.id,
-                        "name": shared_list.name,
-                        "description": shared_list.description,
-                        "owner_id": shared_list.owner_id,
-                        "owner_username": shared_list.owner.username if shared_list.owner else "Unknown",
-                        "permission": next(
-                            (member.permission for member in member_lists if member.list_id == shared_list.id),
-                            "viewer"
-                        ),
-                        "joined_at": next(
-                            (member.joined_at.isoformat() for member in member_lists if member.list_id == shared_list.id),
-                            None
-                        )
-                    }
-                    for shared_list in shared_member_lists
-                ]
-            }
-        }
-        
-        return export_data
-        
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"数据导出失败: {str(e)}"
         )
 
+def serialize_snapshot(snapshot: models.ExportSnapshot) -> dict:
+    return {
+        "snapshot_id": snapshot.id,
+        "status": snapshot.status,
+        "change_seq": snapshot.change_seq,
+        "compression": snapshot.compression,
+        "file_size": snapshot.file_size,
+        "error": snapshot.error,
+        "created_at": snapshot.created_at,
+        "finished_at": snapshot.finished_at,
+        "download_url": f"/api/full-sync/snapshots/{snapshot.id}/download" if snapshot.status == "completed" else None
+    }
+
+@router.post("/snapshots")
+async def create_export_snapshot(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    请求导出快照：用户数据自上次快照以来没有变化时直接返回已有快照，
+    否则在后台进程中生成，返回202，客户端轮询快照状态后下载
+    """
+    change_seq = changes_crud.latest_change_seq(db, current_user.id)
+    snapshot = export_snapshot_crud.get_snapshot_for_seq(db, current_user.id, change_seq)
+    
+    if snapshot is None:
+        snapshot = export_snapshot_crud.create_snapshot(db, current_user.id, change_seq)
+        if snapshot is None:
+            # 并发请求已创建同一快照
+            snapshot = export_snapshot_crud.get_snapshot_for_seq(db, current_user.id, change_seq)
+        else:
+            snapshot_exporter.submit(snapshot, current_user.username)
+    elif (
+        snapshot.status == "failed"
+        or export_snapshot_crud.is_stale(snapshot)
+        or (snapshot.status == "completed" and not os.path.exists(snapshot.file_path))
+    ):
+        if export_snapshot_crud.restart_snapshot(db, snapshot):
+            snapshot_exporter.submit(snapshot, current_user.username)
+    
+    response.status_code = 200 if snapshot.status == "completed" else 202
+    return negotiate(request, serialize_snapshot(snapshot), status_code=response.status_code)
+
+@router.get("/snapshots/{snapshot_id}")
+async def get_export_snapshot(
+    request: Request,
+    snapshot_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """查询导出快照状态"""
+    snapshot = export_snapshot_crud.get_snapshot(db, snapshot_id, current_user.id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="未找到导出快照")
+    return negotiate(request, serialize_snapshot(snapshot))
+
+@router.get("/snapshots/{snapshot_id}/download")
+async def download_export_snapshot(
+    request: Request,
+    snapshot_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """下载快照文件（gzip 压缩的 NDJSON），支持 Range 断点续传"""
+    snapshot = export_snapshot_crud.get_snapshot(db, snapshot_id, current_user.id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="未找到导出快照")
+    if snapshot.status != "completed":
+        raise HTTPException(status_code=409, detail="导出快照尚未生成完成")
+    if not os.path.exists(snapshot.file_path):
+        raise HTTPException(status_code=404, detail="快照文件已失效，请重新生成")
+    return snapshot_response(request, snapshot)
+
+def _encode_feed_cursor(seq: int, entity_types: List[str]) -> str:
+    """变更流游标：已读到的变更序号 + 订阅的数据类型，对客户端不透明"""
+    payload = json.dumps({"s": seq, "t": sorted(entity_types)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def _decode_feed_cursor(cursor: str) -> Tuple[int, Optional[List[str]]]:
+    # 兼容旧客户端直接传入的整数序号
+    if cursor.isdigit():
+        return int(cursor), None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        seq, entity_types = int(payload["s"]), payload["t"]
+        if seq < 0 or not isinstance(entity_types, list):
+            raise ValueError("游标内容无效")
+        return seq, [str(name) for name in entity_types]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=400,
+            detail="无效的同步游标"
+        )
+
 @router.get("/incremental")
 async def get_incremental_updates(
-    since: datetime,
+    request: Request,
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，为空表示从头开始"),
     entity_types: Optional[List[str]] = Query(None),
-    page: int = Query(1, ge=1),
     size: int = Query(50, ge=1, le=200),
+    include_total: bool = Query(False, description="是否返回游标之后剩余的变更数（需要额外一次计数查询）"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    """获取增量更新数据"""
+    """
+    获取增量更新数据
+    按变更序号对各数据类型的变更日志做一次合并的键集扫描，按序号顺序返回一条变更流；
+    同一数据在一页内多次变更只返回最后一次，删除的数据以墓碑（data 为空）返回
+    """
+    
+    seq = 0
+    if cursor:
+        seq, cursor_types = _decode_feed_cursor(cursor)
+        if cursor_types is not None:
+            if entity_types and sorted(entity_types) != cursor_types:
+                raise HTTPException(
+                    status_code=400,
+                    detail="同步游标与请求的数据类型不匹配"
+                )
+            entity_types = cursor_types
     
     if not entity_types:
         entity_types = ["todos", "comments", "assignments"]
     
-    updates = {}
+    unknown = [name for name in entity_types if name not in INCREMENTAL_ENTITIES]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的数据类型: {', '.join(unknown)}"
+        )
     
     try:
-        # 任务更新
-        if "todos" in entity_types:
-            todos_query = db.query(models.Todo).filter(
-                models.Todo.user_id == current_user.id,
-                models.Todo.updated_at > since
-            ).order_by(models.Todo.updated_at.desc())
-            
-            total_todos = todos_query.count()
-            todos = todos_query.offset((page - 1) * size).limit(size).all()
-            
-            updates["todos"] = {
-                "items": [
-                    {
-                        "id": todo.id,
-                        "title": todo.title,
-                        "description": todo.description,
-                        "completed": todo.completed,
-                        "priority": todo.priority,
-                        "updated_at": todo.updated_at.isoformat(),
-                        "version": todo.version
-                    }
-                    for todo in todos
-                ],
-                "pagination": {
-                    "page": page,
-                    "size": size,
-                    "total": total_todos,
-                    "has_more": page * size < total_todos
-                }
-            }
+        change_types = [INCREMENTAL_ENTITIES[name][0] for name in entity_types]
+        rows, next_seq, has_more = changes_crud.scan_changes(
+            db, current_user.id, seq, size, change_types
+        )
         
-        # 评论更新
-        if "comments" in entity_types:
-            comments_query = db.query(models.Comment).filter(
-                models.Comment.user_id == current_user.id,
-                models.Comment.updated_at > since
-            ).order_by(models.Comment.updated_at.desc())
-            
-            total_comments = comments_query.count()
-            comments = comments_query.offset((page - 1) * size).limit(size).all()
-            
-            updates["comments"] = {
-                "items": [
-                    {
-                        "id": comment.id,
-                        "todo_id": comment.todo_id,
-                        "content": comment.content,
-                        "updated_at": comment.updated_at.isoformat()
-                    }
-                    for comment in comments
-                ],
-                "pagination": {
-                    "page": page,
-                    "size": size,
-                    "total": total_comments,
-                    "has_more": page * size < total_comments
-                }
-            }
+        # 同一数据只保留本页中的最后一次变更，按该变更的序号排序
+        latest: Dict[Tuple[str, int], models.Change] = {}
+        for row in rows:
+            key = (row.entity_type, row.entity_id)
+            latest.pop(key, None)
+            latest[key] = row
         
-        # 任务分配更新
-        if "assignments" in entity_types:
-            assignments_query = db.query(models.TaskAssignment).filter(
-                models.TaskAssignment.assignee_id == current_user.id,
-                models.TaskAssignment.updated_at > since
-            ).order_by(models.TaskAssignment.updated_at.desc())
-            
-            total_assignments = assignments_query.count()
-            assignments = assignments_query.offset((page - 1) * size).limit(size).all()
-            
-            updates["assignments"] = {
-                "items": [
-                    {
-                        "id": assignment.id,
-                        "todo_id": assignment.todo_id,
-                        "status": assignment.status,
-                        "updated_at": assignment.updated_at.isoformat(),
-                        "completed_at": assignment.completed_at.isoformat() if assignment.completed_at else None
-                    }
-                    for assignment in assignments
-                ],
-                "pagination": {
-                    "page": page,
-                    "size": size,
-                    "total": total_assignments,
-                    "has_more": page * size < total_assignments
-                }
-            }
+        entities = {}
+        for name in entity_types:
+            entity_type, model, serialize = INCREMENTAL_ENTITIES[name]
+            upserted_ids = [
+                entity_id for (change_type, entity_id), row in latest.items()
+                if change_type == entity_type and row.operation == changes_crud.UPSERT
+            ]
+            if upserted_ids:
+                for entity in db.query(model).filter(model.id.in_(upserted_ids)):
+                    entities[(entity_type, entity.id)] = serialize(entity)
         
-        return {
-            "since": since.isoformat(),
-            "current_time": datetime.utcnow().isoformat(),
-            "updates": updates
+        changes = []
+        for key, row in latest.items():
+            if row.operation == changes_crud.UPSERT and key not in entities:
+                # 已被后续变更删除的数据不在这里返回，其墓碑会出现在后面的页中
+                continue
+            changes.append({
+                "seq": row.seq,
+                "entity_type": row.entity_type,
+                "id": row.entity_id,
+                "operation": row.operation,
+                "data": entities.get(key) if row.operation == changes_crud.UPSERT else None
+            })
+        
+        result = {
+            "cursor": cursor,
+            "next_cursor": _encode_feed_cursor(next_seq, entity_types),
+            "has_more": has_more,
+            "current_time": datetime.utcnow(),
+            "changes": changes
         }
+        if include_total:
+            result["total_remaining"] = changes_crud.count_changes(db, current_user.id, next_seq, change_types)
+        
+        return negotiate(request, result)
         
     except Exception as e:
         raise HTTPException(
@@ -281,124 +258,188 @@ async def get_incremental_updates(
 
 @router.post("/import")
 async def import_user_data(
-    import_data: Dict[str, Any],
+    request: Request,
     clear_existing: bool = False,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    """导入用户数据"""
+    """
+    导入用户数据
+    请求体为 JSON / MessagePack 文档（{"todos": [...], ...} 或导出接口的完整文档），
+    或与导出格式相同的 NDJSON（可用 Content-Encoding: gzip 压缩，边接收边解析）。
+    数据先分块写入暂存表，整理父子关系后在一个短事务中换入，任务的 parent_id 以及
+    评论、分配的 todo_id 按上传数据中的任务ID重映射为新ID。
+    写入暂存表、整理和换入都是同步的数据库操作，放到线程中执行，大批量导入期间不阻塞事件循环
+    """
     
+    staged = StagedImport(db, current_user.id)
     try:
-        imported_counts = {
-            "todos": 0,
-            "comments": 0,
-            "assignments": 0
-        }
+        if is_ndjson(request.headers.get("content-type")):
+            gzipped = request.headers.get("content-encoding", "").lower() == "gzip"
+            records = []
+            async for record in iter_ndjson_records(request.stream(), gzipped):
+                records.append(record)
+                if len(records) >= IMPORT_CHUNK_SIZE:
+                    await asyncio.to_thread(staged.add_all, records)
+                    records = []
+            await asyncio.to_thread(staged.add_all, records)
+        else:
+            document = await request.json()
+            await asyncio.to_thread(staged.add_all, iter_document_records(document))
         
-        # 如果需要清空现有数据
-        if clear_existing:
-            # 删除用户现有的任务、评论等
-            db.query(models.Comment).filter(
-                models.Comment.user_id == current_user.id
-            ).delete()
-            
-            db.query(models.TaskAssignment).filter(
-                models.TaskAssignment.assignee_id == current_user.id
-            ).delete()
-            
-            db.query(models.Todo).filter(
-                models.Todo.user_id == current_user.id
-            ).delete()
-            
-            db.commit()
-        
-        # 导入任务
-        if "todos" in import_data:
-            for todo_data in import_data["todos"]:
-                todo = models.Todo(
-                    user_id=current_user.id,
-                    title=todo_data["title"],
-                    description=todo_data.get("description"),
-                    completed=todo_data.get("completed", False),
-                    priority=todo_data.get("priority", "medium"),
-                    category=todo_data.get("category", "默认"),
-                    due_date=datetime.fromisoformat(todo_data["due_date"]) if todo_data.get("due_date") else None,
-                    parent_id=todo_data.get("parent_id"),
-                    version=todo_data.get("version", 1)
-                )
-                db.add(todo)
-                imported_counts["todos"] += 1
-            
-            db.commit()
+        imported_counts = await asyncio.to_thread(staged.finish, clear_existing)
         
-        # 导入评论（需要先导入任务）
-        if "comments" in import_data:
-            for comment_data in import_data["comments"]:
-                comment = models.Comment(
-                    todo_id=comment_data["todo_id"],
-                    user_id=current_user.id,
-                    content=comment_data["content"]
-                )
-                db.add(comment)
-                imported_counts["comments"] += 1
-            
-            db.commit()
-        
-        # 导入任务分配
-        if "assignments" in import_data:
-            for assignment_data in import_data["assignments"]:
-                assignment = models.TaskAssignment(
-                    todo_id=assignment_data["todo_id"],
-                    assigner_id=assignment_data["assigner_id"],
-                    assignee_id=current_user.id,
-                    status=assignment_data.get("status", "pending")
-                )
-                db.add(assignment)
-                imported_counts["assignments"] += 1
-            
-            db.commit()
-        
-        return {
+        return negotiate(request, {
             "message": "数据导入成功",
             "imported_counts": imported_counts,
-            "timestamp": datetime.utcnow().isoformat()
-        }
+            # 引用的任务不存在的评论和分配不会导入
+            "skipped_counts": {
+                name: staged.counts[name] - imported_counts[name] for name in imported_counts
+            },
+            "timestamp": datetime.utcnow()
+        })
         
+    except ValueError as e:
+        # 包括请求体不是有效的JSON
+        raise HTTPException(
+            status_code=400,
+            detail=f"导入数据无效: {str(e)}"
+        )
     except Exception as e:
         db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"数据导入失败: {str(e)}"
         )
+    finally:
+        await asyncio.to_thread(staged.discard)
+
+@router.get("/manifest")
+async def get_sync_manifest(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    获取用户数据同步清单：各类数据的条数、最新变更序号和内容摘要。
+    清单在写入变更时同步维护，这里只按主键读取；摘要未变化时客户端可以跳过本次同步，
+    携带 If-None-Match 请求时摘要相同直接返回 304
+    """
+    rows = manifest_crud.get_manifest(db, current_user.id)
+    digest = manifest_crud.manifest_digest(rows)
+    etag = f'"{digest}"'
+    if request.headers.get("if-none-match", "").strip() == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    result = negotiate(request, {
+        "user_id": current_user.id,
+        "max_seq": max((row.max_seq for row in rows), default=0),
+        "digest": digest,
+        "entities": {
+            row.entity_type: {
+                "count": row.row_count,
+                "max_seq": row.max_seq,
+                "updated_at": row.updated_at
+            }
+            for row in rows
+        },
+        "server_time": datetime.utcnow()
+    })
+    (result if isinstance(result, Response) else response).headers["ETag"] = etag
+    return result
+
+def _serialize_merkle_tree(tree: models.SyncMerkleTree) -> dict:
+    return {
+        "entity_type": "todo",
+        "fanout": merkle.FANOUT,
+        "root": tree.root_hash,
+        "as_of_seq": tree.as_of_seq
+    }
+
+@router.get("/merkle")
+async def get_merkle_tree(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    获取任务哈希树：根哈希和全部非空桶的哈希（按ID的散列值分桶，叶子为 (id, change_seq)）。
+    客户端可在本地比对后只对不一致的桶调用 /merkle/diff；携带 If-None-Match 且根哈希相同时返回 304
+    """
+    tree = merkle_crud.refresh_tree(db, current_user.id)
+    etag = f'"{tree.root_hash}"'
+    if request.headers.get("if-none-match", "").strip() == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    result = negotiate(request, {
+        **_serialize_merkle_tree(tree),
+        "buckets": {bucket.bucket: bucket.hash for bucket in merkle_crud.get_buckets(db, current_user.id)}
+    })
+    (result if isinstance(result, Response) else response).headers["ETag"] = etag
+    return result
+
+@router.post("/merkle/diff")
+async def diff_merkle_tree(
+    diff_request: schemas.MerkleDiffRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    校验客户端的任务缓存：客户端上传根哈希或各桶哈希，只返回哈希不一致的桶。
+    根哈希一致时直接返回 match；否则每个不一致的桶返回服务端的哈希、条数，
+    以及（include_leaves 时）桶内全部 (id, change_seq)，客户端据此删除多余的任务、重新拉取缺失或过期的任务
+    """
+    tree = merkle_crud.refresh_tree(db, current_user.id)
+    result = {**_serialize_merkle_tree(tree), "match": diff_request.root == tree.root_hash, "buckets": []}
+    if result["match"]:
+        return negotiate(request, result)
+
+    server_buckets = {bucket.bucket: bucket for bucket in merkle_crud.get_buckets(db, current_user.id)}
+    differing = merkle.diff_buckets(
+        {bucket: row.hash for bucket, row in server_buckets.items()},
+        diff_request.buckets
+    )
+    result["match"] = not differing
+    leaves = merkle_crud.get_bucket_leaves(db, current_user.id, differing) if diff_request.include_leaves else {}
+    for bucket in differing:
+        row = server_buckets.get(bucket)
+        item = {
+            "bucket": bucket,
+            "hash": row.hash if row else None,  # 服务端没有该桶时为空，客户端应删除缓存中属于该桶的全部任务
+            "count": row.row_count if row else 0
+        }
+        if diff_request.include_leaves:
+            item["leaves"] = [list(leaf) for leaf in leaves.get(bucket, [])]
+        result["buckets"].append(item)
+    return negotiate(request, result)
 
 @router.get("/status")
 async def get_sync_status(
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """获取用户数据同步状态"""
     
     try:
-        # 获取各种数据的最新更新时间
-        latest_todo = db.query(models.Todo).filter(
-            models.Todo.user_id == current_user.id
-        ).order_by(models.Todo.updated_at.desc()).first()
+        # 同步清单中记录了各类数据的最新变更
+        latest = {row.entity_type: row for row in manifest_crud.get_manifest(db, current_user.id)}
         
-        latest_comment = db.query(models.Comment).filter(
-            models.Comment.user_id == current_user.id
-        ).order_by(models.Comment.updated_at.desc()).first()
+        def last_update(entity_type: str) -> Optional[datetime]:
+            row = latest.get(entity_type)
+            return row.updated_at if row else None
         
-        latest_assignment = db.query(models.TaskAssignment).filter(
-            models.TaskAssignment.assignee_id == current_user.id
-        ).order_by(models.TaskAssignment.updated_at.desc()).first()
-        
-        return {
+        return negotiate(request, {
             "user_id": current_user.id,
-            "last_todo_update": latest_todo.updated_at.isoformat() if latest_todo else None,
-            "last_comment_update": latest_comment.updated_at.isoformat() if latest_comment else None,
-            "last_assignment_update": latest_assignment.updated_at.isoformat() if latest_assignment else None,
-            "server_time": datetime.utcnow().isoformat()
-        }
+            "latest_change_seq": max((row.max_seq for row in latest.values()), default=0),
+            "last_todo_update": last_update("todo"),
+            "last_comment_update": last_update("comment"),
+            "last_assignment_update": last_update("assignment"),
+            "server_time": datetime.utcnow()
+        })
         
     except Exception as e:
         raise HTTPException(
@@ -406,19 +447,59 @@ async def get_sync_status(
             detail=f"获取同步状态失败: {str(e)}"
         )
 
-# Schema定义
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+def _serialize_todo(todo: models.Todo) -> dict:
+    return {
+        "id": todo.id,
+        "title": todo.title,
+        "description": todo.description,
+        "completed": todo.completed,
+        "priority": todo.priority,
+        "updated_at": todo.updated_at,
+        "version": todo.version,
+        "change_seq": todo.change_seq
+    }
+
+def _serialize_comment(comment: models.Comment) -> dict:
+    return {
+        "id": comment.id,
+        "todo_id": comment.todo_id,
+        "content": comment.content,
+        "updated_at": comment.updated_at
+    }
+
+def _serialize_assignment(assignment: models.TaskAssignment) -> dict:
+    return {
+        "id": assignment.id,
+        "todo_id": assignment.todo_id,
+        "status": assignment.status,
+        "assigned_at": assignment.assigned_at,
+        "completed_at": assignment.completed_at
+    }
+
+def _serialize_shared_list(shared_list: models.SharedList) -> dict:
+    return {
+        "id": shared_list.id,
+        "name": shared_list.name,
+        "description": shared_list.description,
+        "owner_id": shared_list.owner_id,
+        "updated_at": shared_list.updated_at
+    }
 
-class ImportDataRequest(BaseModel):
-    todos: Optional[List[Dict[str, Any]]] = None
-    comments: Optional[List[Dict[str, Any]]] = None
-    assignments: Optional[List[Dict[str, Any]]] = None
-    shared_lists: Optional[List[Dict[str, Any]]] = None
+def _serialize_progress(progress: models.ProgressTracking) -> dict:
+    return {
+        "id": progress.id,
+        "todo_id": progress.todo_id,
+        "status": progress.status,
+        "progress_percentage": progress.progress_percentage,
+        "hours_spent": progress.hours_spent,
+        "updated_at": progress.updated_at
+    }
 
-class ExportDataResponse(BaseModel):
-    export_timestamp: str
-    user_id: int
-    user_username: str
-    data: Dict[str, Any]
\ No newline at end of file
+# 增量同步支持的数据类型：请求参数名 -> (变更日志实体类型, 模型, 序列化函数)
+INCREMENTAL_ENTITIES = {
+    "todos": ("todo", models.Todo, _serialize_todo),
+    "comments": ("comment", models.Comment, _serialize_comment),
+    "assignments": ("assignment", models.TaskAssignment, _serialize_assignment),
+    "shared_lists": ("shared_list", models.SharedList, _serialize_shared_list),
+    "progress": ("progress", models.ProgressTracking, _serialize_progress),
+}
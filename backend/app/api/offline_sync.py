@@ -1,21 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import Boolean, DateTime, Enum, Integer, func
+from typing import Dict, List, Optional, Tuple
+import enum
+import json
 import uuid
+from dataclasses import dataclass, field as dataclass_field
 from datetime import datetime
 
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import SessionLocal, get_db
 from app.core.deps import get_current_user
 from app.schemas import schemas
 from app.models import models
-from app.utils.timestamp_service import get_consistent_timestamp
+from app.crud import changes as changes_crud
+from app.crud import compaction as compaction_crud
+from app.crud import rollup as rollup_crud
+from app.crud import todo as todo_crud
+from app.utils.sync_codec import NDJSON_MEDIA_TYPE, NegotiatedRoute, negotiate, wants_ndjson
+from app.utils.timestamp_service import get_consistent_timestamp, hlc_clock
 
-router = APIRouter(tags=["离线同步"])
+# 同步接口的请求和响应都支持 JSON / MessagePack 协商
+router = APIRouter(tags=["离线同步"], route_class=NegotiatedRoute)
+
+# 流式同步每批读取和输出的行数
+STREAM_BATCH_SIZE = 500
 
 
 @router.post("/sync", response_model=schemas.SyncResponse)
 def sync_offline_operations(
     sync_request: schemas.SyncRequest,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -27,8 +43,25 @@ def sync_offline_operations(
         # 1. 处理客户端上传的离线操作
         conflicts = []
         processed_operations = []
+        duplicate_op_ids = []
+        
+        # 一次IN查询探测本批中已处理过的操作ID，重试的操作直接返回上次结果而不重复应用
+        seen = load_seen_operations(
+            db, current_user.id, sync_request.device_id,
+            [op.op_id for op in sync_request.pending_operations if op.op_id]
+        )
+        client_op_ids = {}
         
         for op_data in sync_request.pending_operations:
+            if op_data.op_id:
+                if op_data.op_id in seen:
+                    duplicate_op_ids.append(op_data.op_id)
+                    if seen[op_data.op_id]:
+                        conflicts.append(seen[op_data.op_id])
+                    continue
+                # 同一批内重复的ID只应用一次
+                seen[op_data.op_id] = None
+            
             # 获取服务器时间戳
             timestamp_info = get_consistent_timestamp()
             
@@ -43,42 +76,82 @@ def sync_offline_operations(
                 client_timestamp=op_data.timestamp if hasattr(op_data, 'timestamp') else None,
                 server_timestamp=datetime.utcnow(),
                 logical_timestamp=timestamp_info["logical_timestamp"],
+                hlc=op_data.hlc,
+                base_hlc=op_data.base_hlc,
                 sequence_id=str(uuid.uuid4()),
                 device_id=sync_request.device_id,
                 sync_status="pending"
             )
-            db.add(operation)
             processed_operations.append(operation)
+            if op_data.op_id:
+                client_op_ids[op_data.op_id] = operation
         
-        db.commit()
+        # 一次批量插入操作日志，冲突信息需要操作ID
+        db.add_all(processed_operations)
+        db.flush()
         
-        # 2. 应用操作并检测冲突
-        for operation in processed_operations:
-            conflict = apply_operation(db, operation, current_user.id)
+        # 2. 一次IN查询预加载所有目标任务，按逻辑时钟顺序在内存中应用并检测冲突
+        todos = load_operation_targets(db, current_user.id, processed_operations)
+        tree_changes = DeferredTreeChanges(subtrees=rollup_crud.get_subtree_ids(db, [
+            op.todo_id for op in processed_operations
+            if op.operation_type == "DELETE" and op.todo_id in todos
+        ]))
+        results = {}
+        for operation in sorted(processed_operations, key=lambda op: op.logical_timestamp):
+            conflict = apply_operation(db, operation, current_user.id, todos, tree_changes)
+            results[operation.id] = conflict
             if conflict:
                 conflicts.append(conflict)
                 operation.sync_status = "conflicted"
             else:
                 operation.sync_status = "synced"
+        apply_tree_changes(db, tree_changes)
         
+        # 记录已处理的操作ID，与操作日志、任务变更在同一个事务中提交
+        record_seen_operations(
+            db, current_user.id, sync_request.device_id,
+            {op_id: (operation, results[operation.id]) for op_id, operation in client_op_ids.items()}
+        )
         db.commit()
         
-        # 3. 获取服务器端更新
-        server_updates = get_server_updates(
+        # 3. 按设备游标分页获取服务器端更新
+        cursor = sync_request.cursor
+        if cursor is not None:
+            # 客户端回传上次响应的游标，说明该响应已完整收到，此时才保存为设备游标；
+            # 响应在途中丢失时设备游标不变，下次同步会重新下发这些变更
+            update_last_sync_time(db, current_user.id, sync_request.device_id, cursor)
+        else:
+            cursor = get_device_cursor(db, current_user.id, sync_request.device_id)
+        if cursor is None and sync_request.last_sync_time:
+            # 旧客户端只有时间戳，换算为该时间点的变更序号
+            cursor = changes_crud.seq_at_time(db, current_user.id, sync_request.last_sync_time)
+        
+        if wants_ndjson(request):
+            # 流式模式：不分页，逐行输出游标之后的全部更新
+            return StreamingResponse(
+                stream_server_updates(
+                    current_user.id, cursor or 0,
+                    conflicts, duplicate_op_ids
+                ),
+                media_type=NDJSON_MEDIA_TYPE
+            )
+        
+        server_updates, deleted_todo_ids, next_cursor, has_more = get_server_updates(
             db, 
             current_user.id, 
-            sync_request.last_sync_time
+            cursor or 0,
+            sync_request.limit
         )
         
-        # 4. 更新同步时间戳
-        update_last_sync_time(db, current_user.id, sync_request.device_id)
-        
-        return schemas.SyncResponse(
+        return negotiate(request, schemas.SyncResponse(
             server_updates=server_updates,
+            deleted_todo_ids=deleted_todo_ids,
             conflicts=conflicts,
             sync_timestamp=datetime.utcnow(),
-            has_more=False
-        )
+            has_more=has_more,
+            next_cursor=next_cursor,
+            duplicate_op_ids=duplicate_op_ids
+        ))
         
     except Exception as e:
         db.rollback()
@@ -100,6 +173,16 @@ def get_pending_operations(
     
     return operations
 
+@router.post("/operations/compact")
+def compact_operations(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """压缩当前用户的离线操作日志：合并连续修改、清理已删除任务的操作、归档过期操作"""
+    report = compaction_crud.compact_offline_operations(db, current_user.id)
+    db.commit()
+    return report
+
 @router.post("/resolve-conflict")
 def resolve_conflict(
     resolution: schemas.ConflictResolution,
@@ -132,71 +215,298 @@ def resolve_conflict(
     db.commit()
     return {"message": "冲突已解决"}
 
-def apply_operation(db: Session, operation: models.OfflineOperation, user_id: int) -> dict:
-    """应用离线操作，基于服务器时间戳检测冲突"""
-    todo = db.query(models.Todo).filter(
-        models.Todo.id == operation.todo_id,
+def load_seen_operations(
+    db: Session,
+    user_id: int,
+    device_id: str,
+    op_ids: List[str]
+) -> Dict[str, Optional[dict]]:
+    """
+    查询设备去重窗口中已存在的操作ID，返回 op_id -> 首次处理结果（成功为 None）
+    """
+    if not op_ids:
+        return {}
+    
+    rows = db.query(
+        models.SyncSeenOperation.client_op_id,
+        models.SyncSeenOperation.result
+    ).filter(
+        models.SyncSeenOperation.user_id == user_id,
+        models.SyncSeenOperation.device_id == device_id,
+        models.SyncSeenOperation.client_op_id.in_(set(op_ids))
+    ).all()
+    return {op_id: json.loads(result) if result else None for op_id, result in rows}
+
+def record_seen_operations(
+    db: Session,
+    user_id: int,
+    device_id: str,
+    entries: Dict[str, tuple]
+):
+    """
+    记录本批处理的操作ID及结果（op_id -> (操作, 结果)），
+    并裁剪该设备的去重窗口，只保留最近 SYNC_DEDUP_WINDOW 条
+    """
+    if not entries:
+        return
+    
+    db.add_all([
+        models.SyncSeenOperation(
+            user_id=user_id,
+            device_id=device_id,
+            client_op_id=op_id,
+            operation_id=operation.id,
+            result=json.dumps(result, ensure_ascii=False) if result else None
+        )
+        for op_id, (operation, result) in entries.items()
+    ])
+    db.flush()
+    
+    cutoff = db.query(models.SyncSeenOperation.id).filter(
+        models.SyncSeenOperation.user_id == user_id,
+        models.SyncSeenOperation.device_id == device_id
+    ).order_by(models.SyncSeenOperation.id.desc()).offset(settings.SYNC_DEDUP_WINDOW).limit(1).scalar()
+    
+    if cutoff is not None:
+        db.query(models.SyncSeenOperation).filter(
+            models.SyncSeenOperation.user_id == user_id,
+            models.SyncSeenOperation.device_id == device_id,
+            models.SyncSeenOperation.id <= cutoff
+        ).delete(synchronize_session=False)
+
+def load_operation_targets(
+    db: Session,
+    user_id: int,
+    operations: List[models.OfflineOperation]
+) -> Dict[int, models.Todo]:
+    """用一次IN查询加载一批操作涉及的所有任务，返回 todo_id -> Todo"""
+    todo_ids = {op.todo_id for op in operations if op.todo_id is not None}
+    if not todo_ids:
+        return {}
+    
+    todos = db.query(models.Todo).filter(
+        models.Todo.id.in_(todo_ids),
         models.Todo.user_id == user_id
-    ).first()
+    ).all()
+    return {todo.id: todo for todo in todos}
+
+@dataclass
+class DeferredTreeChanges:
+    """批量应用离线操作时延后到最后统一执行的删除和祖先汇总变化"""
+    subtrees: Dict[int, List[int]]  # 待删除任务ID -> 全部后代ID，在应用前一次查询取得
+    deleted: Dict[int, tuple] = dataclass_field(default_factory=dict)  # 被删除的子树根 -> (原父任务ID, 子树贡献)
+    parent_deltas: Dict[int, list] = dataclass_field(default_factory=dict)  # 父任务ID -> [任务数, 已完成数, 耗时, 截止日期是否变化]
+
+    def add_delta(self, parent_id: Optional[int], count: int = 0, completed: int = 0, hours: int = 0, due_changed: bool = False):
+        if parent_id is None or not (count or completed or hours or due_changed):
+            return
+        delta = self.parent_deltas.setdefault(parent_id, [0, 0, 0, False])
+        delta[0] += count
+        delta[1] += completed
+        delta[2] += hours
+        delta[3] = delta[3] or due_changed
+
+def apply_tree_changes(db: Session, changes: DeferredTreeChanges):
+    """
+    删除本批标记的子树，再把同一父任务下累计的汇总变化合并后一次应用。
+    先删除后调整：父任务已被删除的变化随子树一起消失，不会重复计入祖先
+    """
+    if changes.deleted:
+        root_ids = list(changes.deleted)
+        own_hours = dict(db.query(
+            models.ProgressTracking.todo_id, func.sum(models.ProgressTracking.hours_spent)
+        ).filter(
+            models.ProgressTracking.todo_id.in_(root_ids)
+        ).group_by(models.ProgressTracking.todo_id).all())
+        for root_id, (parent_id, (count, completed, hours, has_due)) in changes.deleted.items():
+            changes.add_delta(parent_id, -count, -completed, -(hours + (own_hours.get(root_id) or 0)), has_due)
+        
+        # 走会话删除，以便级联删除评论/进度并记录墓碑
+        delete_ids = set(root_ids).union(*(changes.subtrees.get(root_id, []) for root_id in root_ids))
+        for todo in db.query(models.Todo).filter(models.Todo.id.in_(delete_ids)).all():
+            db.delete(todo)
+        db.flush()
+    
+    for parent_id, (count, completed, hours, due_changed) in changes.parent_deltas.items():
+        rollup_crud.adjust_ancestors(db, parent_id, count, completed, hours, due_changed)
+
+def apply_operation(
+    db: Session,
+    operation: models.OfflineOperation,
+    user_id: int,
+    todos: Optional[Dict[int, models.Todo]] = None,
+    tree_changes: Optional[DeferredTreeChanges] = None
+) -> dict:
+    """
+    应用离线操作，基于字段级HLC版本做因果合并与冲突检测
+    todos 为预加载的任务映射（见 load_operation_targets），未提供时单独查询；
+    提供 tree_changes 时删除和祖先汇总的调整只做记录，由 apply_tree_changes 统一执行
+    """
+    if todos is not None:
+        todo = todos.get(operation.todo_id)
+    else:
+        todo = db.query(models.Todo).filter(
+            models.Todo.id == operation.todo_id,
+            models.Todo.user_id == user_id
+        ).first()
     
     if not todo:
         return {"error": "任务不存在", "operation_id": operation.id}
     
-    # 基于服务器时间戳的冲突检测
-    conflict_detected = False
     if operation.operation_type == "UPDATE":
-        current_value = getattr(todo, operation.field_name, None)
+        field = operation.field_name
+        if not todo_crud.is_writable_field(field):
+            return {"error": "字段不存在或不允许修改", "field": field, "operation_id": operation.id}
         
-        # 使用服务器时间戳进行精确的时序判断
-        if (hasattr(todo, 'updated_at') and 
-            todo.updated_at and operation.server_timestamp):
-            # 如果任务更新时间晚于操作记录时间，说明有并发修改
-            if todo.updated_at > operation.server_timestamp.replace(tzinfo=None):
-                conflict_detected = True
+        # 超前过多的客户端时间戳一旦存为字段版本，之后服务端对该字段的写入都会在LWW中落败
+        if operation.hlc and not hlc_clock.is_within_drift(operation.hlc):
+            return {"error": "客户端时钟超前过多", "field": field, "operation_id": operation.id}
         
-        # 传统值比较作为补充
-        elif (current_value is not None and 
-              str(current_value) != str(operation.old_value) and
-              operation.old_value is not None):
-            conflict_detected = True
+        try:
+            new_value = coerce_field_value(field, operation.new_value)
+        except (ValueError, TypeError, KeyError):
+            return {"error": "字段值无效", "field": field, "operation_id": operation.id}
         
-        if conflict_detected:
-            # 记录冲突信息
-            todo.conflict_status = "detected"
-            print(f"检测到冲突: 任务{todo.id}的{operation.field_name}字段")
-            print(f"服务器当前值: {current_value}")
-            print(f"客户端原始值: {operation.old_value}")
-            print(f"客户端新值: {operation.new_value}")
-            print(f"服务器时间戳: {operation.server_timestamp}")
-            print(f"任务更新时间: {todo.updated_at}")
-        
-        # 应用更新（基于服务器时间戳的LWW策略）
-        if hasattr(todo, operation.field_name):
-            setattr(todo, operation.field_name, operation.new_value)
-        
-        # 更新元数据
-        if hasattr(todo, 'version'):
+        versions = todo_crud.get_field_versions(todo)
+        server_version = versions.get(field)
+        current_value = getattr(todo, field)
+        
+        # 字段级冲突检测：只有同一字段被并发修改且结果不同才算冲突，
+        # 不同字段的修改总是直接合并
+        concurrent = is_concurrent_change(operation, server_version, current_value)
+        conflict_detected = concurrent and field_value_text(current_value) != field_value_text(new_value)
+        
+        # 并发修改时按HLC取最后写入者；没有HLC的旧客户端保持客户端优先
+        client_wins = (
+            not concurrent
+            or operation.hlc is None
+            or server_version is None
+            or operation.hlc > server_version
+        )
+        
+        if client_wins:
+            was_completed, old_due_date = todo.completed, todo.due_date
+            setattr(todo, field, new_value)
+            todo_crud.set_field_versions(todo, {field: next_field_version(operation, server_version)})
+            if tree_changes is not None:
+                tree_changes.add_delta(
+                    todo.parent_id,
+                    completed=int(bool(todo.completed)) - int(bool(was_completed)),
+                    due_changed=todo.due_date != old_due_date
+                )
+            else:
+                rollup_crud.on_todo_changed(db, todo, was_completed, old_due_date)
+            
+            # 更新元数据
             todo.version += 1
-        todo.updated_at = datetime.utcnow()
+            todo.updated_at = datetime.utcnow()
+        elif operation.hlc:
+            hlc_clock.update(operation.hlc)
         
         # 如果有冲突，返回冲突详情供客户端处理
         if conflict_detected:
+            todo.conflict_status = "detected"
+            # 冲突详情会随响应返回，逐条打印只在调试时开启，避免大批积压同步时刷屏
+            if settings.DEBUG:
+                print(f"检测到冲突: 任务{todo.id}的{field}字段, "
+                      f"服务器版本 {server_version}, 客户端基线版本 {operation.base_hlc}, 客户端版本 {operation.hlc}")
             return {
                 "conflict": True,
-                "field": operation.field_name,
-                "server_value": current_value,
+                "field": field,
+                "server_value": field_value_text(current_value),
                 "client_old_value": operation.old_value,
                 "client_new_value": operation.new_value,
+                "server_version": server_version,
+                "client_base_version": operation.base_hlc,
+                "client_version": operation.hlc,
+                "resolution": "client_wins" if client_wins else "server_wins",
                 "server_timestamp": operation.server_timestamp.isoformat() if operation.server_timestamp else None,
                 "task_updated_at": todo.updated_at.isoformat() if todo.updated_at else None,
                 "operation_id": operation.id
             }
     
     elif operation.operation_type == "DELETE":
-        db.delete(todo)
+        if tree_changes is not None:
+            # 自身耗时在 apply_tree_changes 中一次查询，这里只记录汇总字段中的部分
+            contribution = (
+                1 + (todo.descendant_count or 0),
+                (1 if todo.completed else 0) + (todo.completed_descendant_count or 0),
+                todo.descendant_hours_spent or 0,
+                todo.due_date is not None or todo.earliest_descendant_due_date is not None,
+            )
+            tree_changes.deleted[todo.id] = (todo.parent_id, contribution)
+            # 整棵子树随之删除，本批之后的操作不能再作用于其中的任务
+            if todos is not None:
+                for todo_id in [todo.id, *tree_changes.subtrees.get(todo.id, [])]:
+                    todos.pop(todo_id, None)
+        else:
+            contribution = rollup_crud.get_subtree_contribution(db, todo)
+            parent_id = todo.parent_id
+            db.delete(todo)
+            rollup_crud.on_subtree_removed(db, parent_id, contribution)
+            if todos is not None:
+                todos.pop(operation.todo_id, None)
     
     return None
 
+def coerce_field_value(field_name: str, raw_value):
+    """把离线操作中的文本值转换为任务字段的实际类型"""
+    column = models.Todo.__table__.columns.get(field_name)
+    if raw_value is None or column is None or not isinstance(raw_value, str):
+        return raw_value
+    
+    column_type = column.type
+    if isinstance(column_type, Boolean):
+        return raw_value.strip().lower() in ("true", "1", "yes")
+    if isinstance(column_type, Integer):
+        return int(raw_value)
+    if isinstance(column_type, DateTime):
+        return datetime.fromisoformat(raw_value)
+    if isinstance(column_type, Enum) and column_type.enum_class:
+        return column_type.enum_class(raw_value)
+    return raw_value
+
+def field_value_text(value) -> Optional[str]:
+    """字段值的规范文本形式，用于比较服务端值与客户端值"""
+    if value is None:
+        return None
+    if isinstance(value, enum.Enum):
+        return str(value.value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def is_concurrent_change(operation: models.OfflineOperation, server_version: Optional[str], current_value) -> bool:
+    """
+    判断服务端该字段是否在客户端修改之后被其他端改过
+    有 base_hlc 时比较字段版本；旧客户端没有版本信息，退回到原始值比较
+    """
+    if operation.base_hlc is not None:
+        return server_version is not None and server_version > operation.base_hlc
+    
+    if operation.old_value is None or current_value is None:
+        return False
+    try:
+        old_value = coerce_field_value(operation.field_name, operation.old_value)
+    except (ValueError, TypeError, KeyError):
+        return True
+    return field_value_text(current_value) != field_value_text(old_value)
+
+def next_field_version(operation: models.OfflineOperation, server_version: Optional[str]) -> str:
+    """
+    客户端修改被采纳后的字段版本：优先沿用客户端HLC（同一客户端后续修改以此为基线），
+    客户端时钟落后于服务端版本时由服务端时钟生成更大的版本
+    """
+    if operation.hlc:
+        hlc_clock.update(operation.hlc)
+        if server_version is None or operation.hlc > server_version:
+            return operation.hlc
+    if server_version:
+        return hlc_clock.update(server_version)
+    return hlc_clock.now()
+
 def apply_operation_force(db: Session, operation: models.OfflineOperation):
     """强制应用操作（用于冲突解决）"""
     todo = db.query(models.Todo).filter(
@@ -204,8 +514,9 @@ def apply_operation_force(db: Session, operation: models.OfflineOperation):
     ).first()
     
     if todo and operation.operation_type == "UPDATE":
-        if hasattr(todo, operation.field_name):
-            setattr(todo, operation.field_name, operation.new_value)
+        if todo_crud.is_writable_field(operation.field_name):
+            setattr(todo, operation.field_name, coerce_field_value(operation.field_name, operation.new_value))
+            todo_crud.set_field_versions(todo, {operation.field_name: hlc_clock.now()})
         if hasattr(todo, 'version'):
             todo.version += 1
         todo.updated_at = datetime.utcnow()
@@ -219,30 +530,139 @@ def merge_changes(db: Session, operation: models.OfflineOperation, merged_data:
     ).first()
     
     if todo and merged_data:
+        version = hlc_clock.now()
         for field, value in merged_data.items():
-            if hasattr(todo, field):
-                setattr(todo, field, value)
+            if todo_crud.is_writable_field(field):
+                setattr(todo, field, coerce_field_value(field, value))
+                todo_crud.set_field_versions(todo, {field: version})
         if hasattr(todo, 'version'):
             todo.version += 1
         todo.updated_at = datetime.utcnow()
     
     operation.sync_status = "resolved"
 
-def get_server_updates(db: Session, user_id: int, last_sync_time: datetime) -> List[schemas.TodoResponse]:
-    """获取服务器端更新"""
-    query = db.query(models.Todo).filter(
-        models.Todo.user_id == user_id
-    )
+def get_server_updates(
+    db: Session,
+    user_id: int,
+    cursor: int = 0,
+    limit: int = 500
+) -> Tuple[List[schemas.TodoResponse], List[int], int, bool]:
+    """
+    按序号范围扫描变更日志中 cursor 之后的任务变更（最多 limit 条）
+    返回 (更新的任务, 删除的任务ID, 下一个游标, 是否还有更多)
+    """
+    rows, next_cursor, has_more = changes_crud.scan_changes(db, user_id, cursor, limit, ["todo"])
+    latest = changes_crud.collapse_changes(rows)
     
-    if last_sync_time:
-        query = query.filter(models.Todo.updated_at > last_sync_time)
+    upserted_ids = [todo_id for (_, todo_id), op in latest.items() if op == changes_crud.UPSERT]
+    deleted_ids = [todo_id for (_, todo_id), op in latest.items() if op == changes_crud.DELETE]
     
-    todos = query.all()
+    todos = {
+        todo.id: todo
+        for todo in db.query(models.Todo).filter(
+            models.Todo.id.in_(upserted_ids),
+            models.Todo.user_id == user_id
+        )
+    } if upserted_ids else {}
     
-    # 转换为响应模型
-    return [schemas.TodoResponse.model_validate(todo) for todo in todos]
+    # 已被后续变更删除的任务不在这里返回，其墓碑会出现在后面的页中
+    updates = [
+        schemas.TodoResponse.model_validate(todos[todo_id])
+        for todo_id in upserted_ids if todo_id in todos
+    ]
+    return updates, deleted_ids, next_cursor, has_more
+
+def _ndjson_line(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False, default=str, separators=(",", ":")) + "\n"
+
+def stream_server_updates(
+    user_id: int,
+    cursor: int,
+    conflicts: List[dict],
+    duplicate_op_ids: List[str]
+):
+    """
+    以 NDJSON 逐行输出服务器端更新：先是任务更新和删除墓碑，然后是冲突，最后是游标记录。
+    按页读取变更日志，内存占用与积压量无关；
+    开始时固定序号水位，期间的新变更留给下一次同步。
+    这里不用 yield_per 服务端游标：游标会让一条查询在整个响应期间保持打开，
+    下载慢的客户端会一直占用连接和读事务；按 seq 键集分页每页都是独立的短查询，
+    并且与分页同步使用同一个变更序号游标，两种模式下发的内容一致
+    """
+    # 响应流结束前请求的数据库会话可能已关闭，流式读取使用独立会话
+    db = SessionLocal()
+    try:
+        watermark = max(changes_crud.latest_change_seq(db, user_id), cursor)
+        
+        # 与分页同步相同：按页扫描变更日志并合并同一任务的多次变更，更新和墓碑按序号顺序交错输出
+        buffer = []
+        page_cursor = cursor
+        has_more = True
+        while has_more:
+            rows, page_cursor, has_more = changes_crud.scan_changes(
+                db, user_id, page_cursor, STREAM_BATCH_SIZE, ["todo"], max_seq=watermark
+            )
+            latest = changes_crud.collapse_changes(rows)
+            upserted_ids = [todo_id for (_, todo_id), op in latest.items() if op == changes_crud.UPSERT]
+            todos = {
+                todo.id: todo
+                for todo in db.query(models.Todo).filter(
+                    models.Todo.id.in_(upserted_ids),
+                    models.Todo.user_id == user_id
+                )
+            } if upserted_ids else {}
+            
+            for (_, todo_id), op in latest.items():
+                if op == changes_crud.DELETE:
+                    buffer.append(_ndjson_line({"type": "delete", "id": todo_id}))
+                elif todo_id in todos:
+                    # 已被后续变更删除的任务不在这里输出，其墓碑会出现在后面
+                    buffer.append(_ndjson_line({
+                        "type": "update",
+                        "data": schemas.TodoResponse.model_validate(todos[todo_id]).model_dump(mode="json")
+                    }))
+            yield "".join(buffer)
+            buffer = []
+            # 已输出的对象不再需要，避免会话的标识映射随积压量增长
+            db.expunge_all()
+        
+        for conflict in conflicts:
+            buffer.append(_ndjson_line({"type": "conflict", "data": conflict}))
+        
+        # 设备游标在客户端下次请求回传 next_cursor 时才保存
+        buffer.append(_ndjson_line({
+            "type": "cursor",
+            "next_cursor": watermark,
+            "has_more": False,
+            "sync_timestamp": datetime.utcnow().isoformat(),
+            "duplicate_op_ids": duplicate_op_ids
+        }))
+        yield "".join(buffer)
+    finally:
+        db.close()
+
+def get_device_cursor(db: Session, user_id: int, device_id: str) -> Optional[int]:
+    """读取设备保存的同步游标，设备首次同步时返回 None"""
+    return db.query(models.SyncCursor.last_change_seq).filter(
+        models.SyncCursor.user_id == user_id,
+        models.SyncCursor.device_id == device_id
+    ).scalar()
 
-def update_last_sync_time(db: Session, user_id: int, device_id: str):
-    """更新最后同步时间"""
-    # 这里可以扩展为记录每个设备的同步时间
-    pass
\ No newline at end of file
+def update_last_sync_time(db: Session, user_id: int, device_id: str, cursor: int):
+    """保存客户端已确认收到的同步游标和最后同步时间"""
+    sync_cursor = db.query(models.SyncCursor).filter(
+        models.SyncCursor.user_id == user_id,
+        models.SyncCursor.device_id == device_id
+    ).first()
+    
+    if sync_cursor:
+        sync_cursor.last_change_seq = cursor
+        sync_cursor.last_sync_at = datetime.utcnow()
+    else:
+        db.add(models.SyncCursor(
+            user_id=user_id,
+            device_id=device_id,
+            last_change_seq=cursor,
+            last_sync_at=datetime.utcnow()
+        ))
+    db.commit()
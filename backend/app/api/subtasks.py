@@ -1,10 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import and_, func, or_
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional, Tuple
+import base64
+import json
 from app.core.database import get_db
 from app.core.deps import get_current_user
 from app.schemas import schemas
 from app.models import models
+from app.crud import changes as changes_crud
+from app.crud import rollup as rollup_crud
+from app.crud import todo as todo_crud
+from app.utils.fractional_index import key_between
 
 router = APIRouter()
 
@@ -35,10 +42,13 @@ def create_subtask(
         priority=subtask.priority,
         due_date=subtask.due_date,
         user_id=current_user.id,
-        parent_id=parent_id
+        parent_id=parent_id,
+        position=todo_crud.get_append_position(db, current_user.id, parent_id)
     )
     
     db.add(db_subtask)
+    db.flush()
+    rollup_crud.on_todo_added(db, db_subtask)
     db.commit()
     db.refresh(db_subtask)
     
@@ -67,7 +77,7 @@ def get_subtasks(
     subtasks = db.query(models.Todo).filter(
         models.Todo.parent_id == todo_id,
         models.Todo.user_id == current_user.id
-    ).all()
+    ).order_by(models.Todo.position, models.Todo.id).all()
     
     return subtasks
 
@@ -95,7 +105,7 @@ def get_task_tree(
         children = db.query(models.Todo).filter(
             models.Todo.parent_id == todo_obj.id,
             models.Todo.user_id == current_user.id
-        ).all()
+        ).order_by(models.Todo.position, models.Todo.id).all()
         
         # 递归构建子树
         tree_children = [build_tree(child) for child in children]
@@ -114,26 +124,219 @@ def get_task_tree(
             updated_at=todo_obj.updated_at,
             user_id=todo_obj.user_id,
             parent_id=todo_obj.parent_id,
+            position=todo_obj.position,
             has_children=len(children) > 0,
             children_count=len(children),
+            descendant_count=todo_obj.descendant_count,
+            completed_descendant_count=todo_obj.completed_descendant_count,
+            descendant_hours_spent=todo_obj.descendant_hours_spent,
+            earliest_descendant_due_date=todo_obj.earliest_descendant_due_date,
             children=tree_children
         )
     
     return build_tree(todo)
 
-@router.put("/{todo_id}/move", response_model=schemas.TodoResponse)
-def move_task(
+def _encode_cursor(parent_id: int, last: Optional[models.Todo]) -> str:
+    """子任务分页游标：父任务ID + 上一页最后一个子任务的排序键 (position, id)"""
+    key = [last.position, last.id] if last is not None else None
+    payload = json.dumps({"p": parent_id, "k": key}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[int, Optional[Tuple[str, int]]]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        key = payload.get("k")
+        return int(payload["p"]), (key[0], int(key[1])) if key else None
+    except (ValueError, KeyError, TypeError, IndexError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
+        )
+
+def _load_children(
+    db: Session,
+    user_id: int,
+    parent_ids: List[int],
+    limit: int,
+    after: Optional[Tuple[str, int]] = None
+):
+    """
+    一次查询加载多个父任务的子任务，每个父任务最多取 limit + 1 条
+    （多取的一条用于判断是否还有下一页）
+    """
+    if not parent_ids:
+        return {}
+
+    query = db.query(
+        models.Todo.id.label("id"),
+        func.row_number().over(
+            partition_by=models.Todo.parent_id,
+            order_by=(models.Todo.position, models.Todo.id)
+        ).label("rn")
+    ).filter(
+        models.Todo.parent_id.in_(parent_ids),
+        models.Todo.user_id == user_id
+    )
+    if after is not None:
+        after_position, after_id = after
+        query = query.filter(or_(
+            models.Todo.position > after_position,
+            and_(models.Todo.position == after_position, models.Todo.id > after_id)
+        ))
+    ranked = query.subquery()
+
+    rows = db.query(models.Todo).join(
+        ranked, models.Todo.id == ranked.c.id
+    ).filter(
+        ranked.c.rn <= limit + 1
+    ).order_by(models.Todo.parent_id, models.Todo.position, models.Todo.id).all()
+
+    children = {}
+    for row in rows:
+        children.setdefault(row.parent_id, []).append(row)
+    return children
+
+def _count_children(db: Session, user_id: int, parent_ids: List[int]):
+    """一次分组查询统计多个任务的直接子任务数"""
+    if not parent_ids:
+        return {}
+    rows = db.query(models.Todo.parent_id, func.count(models.Todo.id)).filter(
+        models.Todo.parent_id.in_(parent_ids),
+        models.Todo.user_id == user_id
+    ).group_by(models.Todo.parent_id).all()
+    return {parent_id: count for parent_id, count in rows}
+
+def _build_lazy_level(
+    db: Session,
+    user_id: int,
+    nodes: List[models.Todo],
+    depth: int,
+    limit: int,
+    max_nodes: int
+) -> List[schemas.TodoTreeNode]:
+    """
+    按层（广度优先）构建节点，每层固定两次查询：子任务数统计 + 子任务加载。
+    超出 depth 或 max_nodes 的节点不展开，只返回 children_count 和游标。
+    """
+    tree_nodes = {}
+    levels = [nodes]
+    budget = max_nodes - len(nodes)
+
+    for level in range(depth + 1):
+        current = levels[level]
+        counts = _count_children(db, user_id, [todo.id for todo in current])
+
+        # 只展开有子任务且剩余节点预算足够的节点
+        expandable = []
+        if level < depth:
+            for todo in current:
+                page_size = min(counts.get(todo.id, 0), limit)
+                if page_size and page_size <= budget:
+                    expandable.append(todo.id)
+                    budget -= page_size
+        loaded = _load_children(db, user_id, expandable, limit)
+
+        next_level = []
+        for todo in current:
+            children_count = counts.get(todo.id, 0)
+            data = schemas.TodoResponse.model_validate(todo).model_dump()
+            data.update(has_children=children_count > 0, children_count=children_count)
+            node = schemas.TodoTreeNode(**data)
+
+            if todo.id in loaded:
+                page = loaded[todo.id][:limit]
+                if len(loaded[todo.id]) > limit:
+                    node.children_cursor = _encode_cursor(todo.id, page[-1])
+                next_level.extend(page)
+            elif children_count:
+                node.children_cursor = _encode_cursor(todo.id, None)
+            tree_nodes[todo.id] = node
+
+        if not next_level:
+            break
+        levels.append(next_level)
+
+    # 自底向上挂载子节点
+    for level_nodes in reversed(levels[1:]):
+        for todo in level_nodes:
+            tree_nodes[todo.parent_id].children.append(tree_nodes[todo.id])
+
+    return [tree_nodes[todo.id] for todo in nodes]
+
+@router.get("/{todo_id}/tree/lazy", response_model=schemas.TodoTreeNode)
+def get_task_tree_lazy(
     todo_id: int,
-    move_data: schemas.SubtaskMove,
+    depth: int = Query(2, ge=0, le=10),
+    limit: int = Query(50, ge=1, le=200),
+    max_nodes: int = Query(500, ge=1, le=5000),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    """移动任务到新的父级"""
-    # 验证任务存在且属于当前用户
+    """
+    按需加载任务树：只返回 depth 层，每个节点最多 limit 个子任务，
+    未展开或未加载完的节点通过 children_cursor 继续加载
+    """
     todo = db.query(models.Todo).filter(
         models.Todo.id == todo_id,
         models.Todo.user_id == current_user.id
     ).first()
+
+    if not todo:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="任务不存在或无权限访问"
+        )
+
+    return _build_lazy_level(db, current_user.id, [todo], depth, limit, max_nodes)[0]
+
+@router.get("/{todo_id}/children/page", response_model=schemas.TodoChildrenPage)
+def get_subtasks_page(
+    todo_id: int,
+    cursor: Optional[str] = None,
+    depth: int = Query(0, ge=0, le=10),
+    limit: int = Query(50, ge=1, le=200),
+    max_nodes: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """分页获取直接子任务，depth > 0 时同时预加载这些子任务的下几层"""
+    todo = db.query(models.Todo).filter(
+        models.Todo.id == todo_id,
+        models.Todo.user_id == current_user.id
+    ).first()
+
+    if not todo:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="任务不存在或无权限访问"
+        )
+
+    after = None
+    if cursor:
+        parent_id, after = _decode_cursor(cursor)
+        if parent_id != todo_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="分页游标与任务不匹配"
+            )
+
+    loaded = _load_children(db, current_user.id, [todo_id], limit, after).get(todo_id, [])
+    page = loaded[:limit]
+    next_cursor = _encode_cursor(todo_id, page[-1]) if len(loaded) > limit else None
+
+    return schemas.TodoChildrenPage(
+        items=_build_lazy_level(db, current_user.id, page, depth, limit, max_nodes) if page else [],
+        next_cursor=next_cursor
+    )
+
+def _validate_move(db: Session, user_id: int, todo_id: int, new_parent_id: Optional[int]) -> models.Todo:
+    """校验移动操作：任务与目标父任务都属于当前用户，且不会形成循环引用"""
+    # 验证任务存在且属于当前用户
+    todo = db.query(models.Todo).filter(
+        models.Todo.id == todo_id,
+        models.Todo.user_id == user_id
+    ).first()
     
     if not todo:
         raise HTTPException(
@@ -142,10 +345,10 @@ def move_task(
         )
     
     # 验证新父任务（如果指定了的话）
-    if move_data.new_parent_id is not None:
+    if new_parent_id is not None:
         new_parent = db.query(models.Todo).filter(
-            models.Todo.id == move_data.new_parent_id,
-            models.Todo.user_id == current_user.id
+            models.Todo.id == new_parent_id,
+            models.Todo.user_id == user_id
         ).first()
         
         if not new_parent:
@@ -155,22 +358,102 @@ def move_task(
             )
         
         # 检查循环引用（不能将任务移动到自己的子树下）
-        def check_circular_reference(parent_id, target_id):
-            if parent_id == target_id:
-                return True
-            parent = db.query(models.Todo).filter(models.Todo.id == parent_id).first()
-            if parent and parent.parent_id:
-                return check_circular_reference(parent.parent_id, target_id)
-            return False
-        
-        if check_circular_reference(move_data.new_parent_id, todo_id):
+        # 批量移动时需要先刷新之前的移动，祖先链才是最新的
+        db.flush()
+        if todo_id in rollup_crud.get_ancestor_chain(db, new_parent_id):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="不能将任务移动到自己的子树下"
             )
     
+    return todo
+
+def _get_sibling_anchor(db: Session, user_id: int, todo: models.Todo, parent_id: Optional[int], anchor_id: int) -> models.Todo:
+    anchor = todo_crud.get_siblings_query(db, user_id, parent_id).filter(
+        models.Todo.id == anchor_id,
+        models.Todo.id != todo.id
+    ).first()
+    if not anchor or anchor.position is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="排序锚点必须是目标父任务下的其他任务"
+        )
+    return anchor
+
+def _compute_position(db: Session, user_id: int, todo: models.Todo, move: schemas.SubtaskMove) -> str:
+    """根据 after_id / before_id 计算新的排序键，都未指定时追加到末尾"""
+    parent_id = move.new_parent_id
+    siblings = todo_crud.get_siblings_query(db, user_id, parent_id).filter(
+        models.Todo.id != todo.id
+    )
+    
+    if move.after_id is not None:
+        lower = _get_sibling_anchor(db, user_id, todo, parent_id, move.after_id).position
+        if move.before_id is not None:
+            upper = _get_sibling_anchor(db, user_id, todo, parent_id, move.before_id).position
+        else:
+            upper = siblings.filter(models.Todo.position > lower).with_entities(func.min(models.Todo.position)).scalar()
+    elif move.before_id is not None:
+        upper = _get_sibling_anchor(db, user_id, todo, parent_id, move.before_id).position
+        lower = siblings.filter(models.Todo.position < upper).with_entities(func.max(models.Todo.position)).scalar()
+    else:
+        # MAX 忽略 NULL；按 position 降序取第一条时，NULL 在 PostgreSQL 中排在最前
+        lower = siblings.with_entities(func.max(models.Todo.position)).scalar()
+        upper = None
+    
+    try:
+        return key_between(lower, upper)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="同级排序位置冲突，请刷新后重试"
+        )
+
+def _apply_move(db: Session, user_id: int, todo: models.Todo, move: schemas.SubtaskMove):
+    """执行移动：只改写被移动任务自身的 parent_id 和 position"""
+    old_parent_id = todo.parent_id
+    reparented = old_parent_id != move.new_parent_id
+    
+    if reparented or move.after_id is not None or move.before_id is not None:
+        todo.position = _compute_position(db, user_id, todo, move)
+    todo.parent_id = move.new_parent_id
+    
+    if reparented:
+        rollup_crud.on_todo_moved(db, todo, old_parent_id)
+    else:
+        db.flush()
+
+@router.put("/reorder", response_model=List[schemas.TodoResponse])
+def reorder_tasks(
+    reorder: schemas.SubtaskReorder,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """批量移动/排序任务，按顺序依次应用并在同一个事务中提交"""
+    moved = []
+    for move in reorder.moves:
+        todo = _validate_move(db, current_user.id, move.todo_id, move.new_parent_id)
+        _apply_move(db, current_user.id, todo, move)
+        moved.append(todo)
+    
+    db.commit()
+    for todo in moved:
+        db.refresh(todo)
+    
+    return moved
+
+@router.put("/{todo_id}/move", response_model=schemas.TodoResponse)
+def move_task(
+    todo_id: int,
+    move_data: schemas.SubtaskMove,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """移动任务到新的父级"""
+    todo = _validate_move(db, current_user.id, todo_id, move_data.new_parent_id)
+    
     # 执行移动操作
-    todo.parent_id = move_data.new_parent_id
+    _apply_move(db, current_user.id, todo, move_data)
     db.commit()
     db.refresh(todo)
     
@@ -185,7 +468,7 @@ def get_root_tasks(
     root_tasks = db.query(models.Todo).filter(
         models.Todo.user_id == current_user.id,
         models.Todo.parent_id.is_(None)
-    ).all()
+    ).order_by(models.Todo.position, models.Todo.id).all()
     
     # 为每个根任务添加子任务信息
     result = []
@@ -236,9 +519,13 @@ def delete_task_cascade(
     all_ids_to_delete = [todo_id] + get_all_descendants(todo_id)
     
     # 执行删除
+    contribution = rollup_crud.get_subtree_contribution(db, todo)
+    parent_id = todo.parent_id
     db.query(models.Todo).filter(
         models.Todo.id.in_(all_ids_to_delete)
     ).delete(synchronize_session=False)
+    changes_crud.record_todo_deletes(db, all_ids_to_delete, current_user.id)
+    rollup_crud.on_subtree_removed(db, parent_id, contribution)
     
     db.commit()
     
@@ -1,14 +1,33 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import SessionLocal, get_db
 from app.core.deps import get_current_active_user
 from app.crud import todo as todo_crud
 from app.schemas import schemas
 from app.models import models
+from app.utils.write_coalescer import WriteCoalescer
 
 router = APIRouter()
 
+def apply_coalesced_writes_in_session(writes: dict) -> int:
+    db = SessionLocal()
+    try:
+        return todo_crud.apply_coalesced_writes(db, writes)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# 高频字段修改的合并写入器，由应用启动时启动、关闭时落盘
+write_coalescer = WriteCoalescer(
+    apply_coalesced_writes_in_session,
+    window=settings.WRITE_COALESCE_WINDOW_MS / 1000,
+    max_pending=settings.WRITE_COALESCE_MAX_PENDING
+)
+
 @router.post("/", response_model=schemas.TodoResponse, status_code=status.HTTP_201_CREATED)
 def create_todo(
     todo: schemas.TodoCreate,
@@ -36,6 +55,10 @@ def read_todo(
     db_todo = todo_crud.get_todo(db, todo_id=todo_id, user_id=current_user.id)
     if db_todo is None:
         raise HTTPException(status_code=404, detail="待办事项不存在")
+    # 叠加本进程尚未落盘的合并写入，客户端能读到自己刚提交的修改
+    pending = write_coalescer.pending_fields(todo_id)
+    if pending:
+        return schemas.TodoResponse.model_validate(db_todo).model_copy(update=pending)
     return db_todo
 
 @router.put("/{todo_id}", response_model=schemas.TodoResponse)
@@ -48,8 +71,38 @@ def update_todo(
     db_todo = todo_crud.get_todo(db, todo_id=todo_id, user_id=current_user.id)
     if db_todo is None:
         raise HTTPException(status_code=404, detail="待办事项不存在")
+    # 直接写入比缓冲中的合并写入更新，丢弃被覆盖的字段
+    write_coalescer.discard(todo_id, todo.dict(exclude_unset=True).keys())
     return todo_crud.update_todo(db=db, todo_id=todo_id, user_id=current_user.id, todo_update=todo)
 
+@router.patch("/{todo_id}", response_model=schemas.TodoResponse, status_code=status.HTTP_202_ACCEPTED)
+def update_todo_coalesced(
+    todo_id: int,
+    todo: schemas.TodoUpdate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    高频修改（连续输入、拖动滑块）使用的合并写入：修改先进入缓冲，
+    同一字段在合并窗口内只写入最后一次，返回包含本次修改的任务视图
+    """
+    db_todo = todo_crud.get_todo(db, todo_id=todo_id, user_id=current_user.id)
+    if db_todo is None:
+        raise HTTPException(status_code=404, detail="待办事项不存在")
+    update_data = todo.dict(exclude_unset=True)
+    # 写入在返回之后才落盘，无效的值必须在这里拒绝，否则会在后台写入时才失败
+    null_fields = sorted(field for field, value in update_data.items() if value is None and field in todo_crud.NON_NULL_FIELDS)
+    if null_fields:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"字段不能为空: {', '.join(null_fields)}"
+        )
+    if update_data:
+        write_coalescer.submit(todo_id, current_user.id, update_data)
+    pending = write_coalescer.pending_fields(todo_id)
+    db.refresh(db_todo)
+    return schemas.TodoResponse.model_validate(db_todo).model_copy(update=pending)
+
 @router.delete("/{todo_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_todo(
     todo_id: int,
@@ -59,6 +112,7 @@ def delete_todo(
     db_todo = todo_crud.get_todo(db, todo_id=todo_id, user_id=current_user.id)
     if db_todo is None:
         raise HTTPException(status_code=404, detail="待办事项不存在")
+    write_coalescer.discard(todo_id)
     todo_crud.delete_todo(db=db, todo_id=todo_id, user_id=current_user.id)
     return
 
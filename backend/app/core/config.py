@@ -24,6 +24,32 @@ class Settings(BaseSettings):
     # WebSocket配置
     WEBSOCKET_MAX_CONNECTIONS: int = 1000
     
+    # 离线同步配置
+    SYNC_DEDUP_WINDOW: int = 1000  # 每个设备保留的最近操作ID数量（重试去重窗口）
+    OFFLINE_OP_RETENTION_DAYS: int = 30  # 已同步的离线操作保留天数，超过后移入归档表
+    
+    # 高频字段修改合并写入配置
+    WRITE_COALESCE_WINDOW_MS: int = 200  # 同一任务字段的修改在该窗口内合并，只写入最后一次
+    WRITE_COALESCE_MAX_PENDING: int = 500  # 缓冲的 (任务, 字段) 数达到该值时立即写入
+    
+    # 批量同步任务队列配置
+    BATCH_SYNC_WORKERS: int = 2  # 每个进程的工作者数量
+    BATCH_SYNC_MAX_CONCURRENT_JOBS: int = 4  # 所有进程合计同时运行的任务上限，保护数据库
+    BATCH_SYNC_LEASE_SECONDS: int = 30  # 任务租约时长，工作者在此期间内续约，过期后可被其他工作者认领
+    BATCH_SYNC_POLL_INTERVAL: float = 1.0  # 空闲工作者轮询任务表的间隔（秒）
+    BATCH_SYNC_MAX_ATTEMPTS: int = 3  # 任务最多被认领的次数，超过后标记为失败
+    BATCH_SYNC_MIN_BATCH_SIZE: int = 10  # 自适应批次大小的下限
+    BATCH_SYNC_MAX_BATCH_SIZE: int = 1000  # 自适应批次大小的上限
+    BATCH_SYNC_MAX_CONCURRENCY: int = 32  # 逐项处理时批内并发数上限
+    BATCH_SYNC_TARGET_BATCH_LATENCY: float = 0.5  # 每批目标耗时（秒），超过即减小批次
+    BATCH_SYNC_MAX_ERROR_RATE: float = 0.05  # 每批允许的错误率，超过即减小批次
+    BATCH_SYNC_PROGRESS_INTERVAL: float = 0.5  # 通过WebSocket推送同步进度的最小间隔（秒），同时决定进度写回任务表的频率
+    
+    # 数据导出快照配置
+    EXPORT_SNAPSHOT_DIR: str = "./export_snapshots"  # 快照文件目录
+    EXPORT_SNAPSHOT_WORKERS: int = 2  # 生成快照的进程数
+    EXPORT_SNAPSHOT_TIMEOUT: int = 600  # 快照超过该秒数仍未生成完成时视为失败，可重新提交
+    
     class Config:
         env_file = ".env"
 
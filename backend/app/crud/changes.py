@@ -0,0 +1,306 @@
+from sqlalchemy import case, event, func, insert
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.crud import manifest as manifest_crud
+from app.models.models import (
+    Change, Comment, ProgressTracking, SharedList, SharedListMember,
+    SyncSequence, TaskAssignment, Todo
+)
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 任务变更使用的序号计数器名称
+CHANGE_SEQUENCE = "changes"
+
+# 需要写入变更日志的模型及其实体类型
+TRACKED_ENTITIES = {
+    Todo: "todo",
+    Comment: "comment",
+    TaskAssignment: "assignment",
+    SharedList: "shared_list",
+    SharedListMember: "shared_list_member",
+    ProgressTracking: "progress",
+}
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+def next_change_seq(db: Session, user_id: int, count: int = 1) -> int:
+    """
+    为用户分配 count 个连续的变更序号，返回其中最大的一个（区间为 (返回值-count, 返回值]）。
+    每个用户一个计数行，先 UPDATE 计数行再读取，行锁持有到事务提交，
+    因此同一用户序号较小的变更总是先于序号较大的变更提交，客户端按序号水位增量拉取不会漏数据；
+    不同用户的写入者互不阻塞
+    """
+    updated = db.query(SyncSequence).filter(
+        SyncSequence.name == CHANGE_SEQUENCE,
+        SyncSequence.user_id == user_id
+    ).update({SyncSequence.value: SyncSequence.value + count}, synchronize_session=False)
+
+    if not updated:
+        # 可能在flush过程中调用，直接执行INSERT而不经过会话
+        db.execute(insert(SyncSequence).values(name=CHANGE_SEQUENCE, user_id=user_id, value=count))
+        return count
+
+    return db.query(SyncSequence.value).filter(
+        SyncSequence.name == CHANGE_SEQUENCE,
+        SyncSequence.user_id == user_id
+    ).scalar()
+
+def _allocate_seqs(db: Session, user_ids: List[int]) -> List[int]:
+    """为 user_ids 中的每一项分配所属用户的下一个序号，返回与 user_ids 一一对应的序号"""
+    counts = Counter(user_ids)
+    last = {}
+    # 按用户ID顺序获取计数行的锁，同时写入多个用户的事务之间不会死锁
+    for user_id in sorted(counts):
+        last[user_id] = next_change_seq(db, user_id, counts[user_id]) - counts[user_id]
+    seqs = []
+    for user_id in user_ids:
+        last[user_id] += 1
+        seqs.append(last[user_id])
+    return seqs
+
+def record_changes(db: Session, entries: List[Tuple[str, int, int, str]], created: bool = False) -> List[int]:
+    """
+    为绕过会话钩子的批量语句显式追加变更记录，
+    entries 为 (实体类型, 实体ID, 接收用户ID, 操作) 列表，返回对应的序号；
+    created 表示其中的 upsert 都是新插入的数据，同步清单的条数随之增加
+    """
+    if not entries:
+        return []
+
+    seqs = _allocate_seqs(db, [user_id for _, _, user_id, _ in entries])
+    db.execute(insert(Change), [
+        {
+            "seq": seq,
+            "user_id": user_id,
+            "entity_type": entity_type,
+            "entity_id": entity_id,
+            "operation": operation,
+            "created_at": datetime.utcnow(),
+        }
+        for seq, (entity_type, entity_id, user_id, operation) in zip(seqs, entries)
+    ])
+    manifest_crud.apply_changes(db, [
+        (user_id, entity_type, seq, -1 if operation == DELETE else (1 if created else 0))
+        for seq, (entity_type, _, user_id, operation) in zip(seqs, entries)
+    ])
+    return seqs
+
+def touch_todos(db: Session, todo_ids: List[int]):
+    """批量UPDATE修改的任务：追加变更记录并同步更新任务的 change_seq"""
+    if not todo_ids:
+        return
+
+    owners = dict(db.query(Todo.id, Todo.user_id).filter(Todo.id.in_(todo_ids)).all())
+    todo_ids = [todo_id for todo_id in todo_ids if todo_id in owners]
+    seqs = record_changes(db, [("todo", todo_id, owners[todo_id], UPSERT) for todo_id in todo_ids])
+    db.query(Todo).filter(Todo.id.in_(todo_ids)).update({
+        Todo.change_seq: case(dict(zip(todo_ids, seqs)), value=Todo.id)
+    }, synchronize_session=False)
+
+def record_todo_deletes(db: Session, todo_ids: List[int], user_id: int):
+    """批量DELETE删除的任务：追加墓碑"""
+    record_changes(db, [("todo", todo_id, user_id, DELETE) for todo_id in todo_ids])
+
+def backfill_changes(db: Session) -> int:
+    """为变更日志上线前已存在的数据各追加一条 upsert 记录（用于迁移），返回追加的条数"""
+    total = 0
+    for model, entity_type in TRACKED_ENTITIES.items():
+        objects = db.query(model).order_by(model.id).all()
+        entries = [
+            (entity_type, obj.id, user_id, UPSERT)
+            for obj, users in zip(objects, _audiences(db, objects))
+            for user_id in users
+        ]
+        seqs = record_changes(db, entries)
+        if model is Todo:
+            for (_, todo_id, _, _), seq in zip(entries, seqs):
+                db.query(Todo).filter(Todo.id == todo_id).update(
+                    {Todo.change_seq: seq}, synchronize_session=False
+                )
+        total += len(entries)
+    # 回填记录不区分是否新建，同步清单按回填后的日志整体重算
+    manifest_crud.rebuild_manifests(db)
+    return total
+
+def scan_changes(
+    db: Session,
+    user_id: int,
+    cursor: int = 0,
+    limit: int = 500,
+    entity_types: Optional[Iterable[str]] = None,
+    max_seq: Optional[int] = None
+) -> Tuple[List[Change], int, bool]:
+    """
+    按序号范围扫描用户的变更日志 (cursor, max_seq]，最多返回 limit 条，max_seq 为空表示不设上限
+    返回 (变更列表, 下一个游标, 是否还有更多)
+    """
+    query = db.query(Change).filter(
+        Change.user_id == user_id,
+        Change.seq > cursor
+    )
+    if max_seq is not None:
+        query = query.filter(Change.seq <= max_seq)
+    if entity_types is not None:
+        query = query.filter(Change.entity_type.in_(list(entity_types)))
+
+    # 多取一条用于判断是否还有下一页
+    rows = query.order_by(Change.seq).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = rows[-1].seq if rows else cursor
+    return rows, next_cursor, has_more
+
+def count_changes(
+    db: Session,
+    user_id: int,
+    cursor: int = 0,
+    entity_types: Optional[Iterable[str]] = None
+) -> int:
+    """用户在 cursor 之后的变更条数（索引范围计数，只在客户端明确需要时调用）"""
+    query = db.query(func.count(Change.seq)).filter(
+        Change.user_id == user_id,
+        Change.seq > cursor
+    )
+    if entity_types is not None:
+        query = query.filter(Change.entity_type.in_(list(entity_types)))
+    return query.scalar()
+
+def collapse_changes(rows: List[Change]) -> Dict[Tuple[str, int], str]:
+    """同一实体的多次变更只保留最后一次，结果按最后一次变更的序号排序"""
+    latest = {}
+    for row in rows:
+        key = (row.entity_type, row.entity_id)
+        latest.pop(key, None)
+        latest[key] = row.operation
+    return latest
+
+def latest_change_seq(db: Session, user_id: int) -> int:
+    """用户已产生的最大变更序号，没有变更时为0；用户的任何可见数据变化都会使它增大"""
+    return db.query(func.coalesce(func.max(Change.seq), 0)).filter(
+        Change.user_id == user_id
+    ).scalar()
+
+def seq_at_time(db: Session, user_id: int, timestamp: datetime) -> int:
+    """给定时间点之前用户已产生的最大序号，用于把旧客户端的时间戳换算为游标"""
+    return db.query(func.coalesce(func.max(Change.seq), 0)).filter(
+        Change.user_id == user_id,
+        Change.created_at <= timestamp
+    ).scalar()
+
+def _todo_owners(session: Session, todo_ids: set) -> Dict[int, int]:
+    todo_ids.discard(None)
+    if not todo_ids:
+        return {}
+    return dict(session.query(Todo.id, Todo.user_id).filter(Todo.id.in_(todo_ids)).all())
+
+def _audiences(session: Session, objects: List) -> List[List[int]]:
+    """计算每个变更对象对哪些用户可见（用户各自的变更日志中都要追加一条）"""
+    owners = _todo_owners(session, {
+        obj.todo_id for obj in objects
+        if isinstance(obj, (Comment, TaskAssignment, ProgressTracking))
+    })
+
+    list_ids = {obj.id for obj in objects if isinstance(obj, SharedList) and obj.id is not None}
+    list_members: Dict[int, List[int]] = {}
+    if list_ids:
+        for list_id, member_id in session.query(
+            SharedListMember.shared_list_id, SharedListMember.user_id
+        ).filter(SharedListMember.shared_list_id.in_(list_ids)):
+            list_members.setdefault(list_id, []).append(member_id)
+
+    member_list_ids = {obj.shared_list_id for obj in objects if isinstance(obj, SharedListMember)}
+    list_owners = dict(session.query(SharedList.id, SharedList.owner_id).filter(
+        SharedList.id.in_(member_list_ids)
+    ).all()) if member_list_ids else {}
+
+    audiences = []
+    for obj in objects:
+        if isinstance(obj, Todo):
+            users = [obj.user_id]
+        elif isinstance(obj, Comment):
+            users = [owners.get(obj.todo_id), obj.user_id]
+        elif isinstance(obj, ProgressTracking):
+            users = [owners.get(obj.todo_id), obj.user_id]
+        elif isinstance(obj, TaskAssignment):
+            users = [owners.get(obj.todo_id), obj.assigner_id, obj.assignee_id]
+        elif isinstance(obj, SharedList):
+            users = [obj.owner_id] + list_members.get(obj.id, [])
+        else:
+            users = [list_owners.get(obj.shared_list_id), obj.user_id]
+        audiences.append(list(dict.fromkeys(u for u in users if u is not None)))
+    return audiences
+
+def _count_delta(obj, operation: str, user_id: int, created: bool) -> int:
+    """
+    一次变更对接收用户清单条数的影响：新增+1，删除-1，修改不变。
+    共享清单的成员会变化，创建时只对所有者可见，因此只计入所有者的条数
+    """
+    if isinstance(obj, SharedList) and user_id != obj.owner_id:
+        return 0
+    if operation == DELETE:
+        return -1
+    return 1 if created else 0
+
+@event.listens_for(SessionLocal, "before_flush")
+def _capture_changes(session: Session, flush_context, instances):
+    """
+    在flush前为新增、修改、删除的受跟踪对象分配变更序号，
+    新对象的ID要到flush后才有，变更记录在 after_flush 中写入
+    """
+    pending = []
+    for obj in session.new:
+        if type(obj) in TRACKED_ENTITIES:
+            pending.append((obj, UPSERT))
+    for obj in session.dirty:
+        if type(obj) in TRACKED_ENTITIES and session.is_modified(obj):
+            pending.append((obj, UPSERT))
+    for obj in session.deleted:
+        if type(obj) in TRACKED_ENTITIES:
+            pending.append((obj, DELETE))
+    if not pending:
+        return
+
+    audiences = _audiences(session, [obj for obj, _ in pending])
+    seqs = iter(_allocate_seqs(session, [user_id for users in audiences for user_id in users]))
+
+    captured = session.info.setdefault("captured_changes", [])
+    for (obj, operation), users in zip(pending, audiences):
+        created = obj in session.new
+        for user_id in users:
+            seq = next(seqs)
+            captured.append((seq, obj, operation, user_id, created))
+            # 任务只对所有者可见，change_seq 即该任务最后一条变更的序号
+            if isinstance(obj, Todo) and operation == UPSERT:
+                obj.change_seq = seq
+
+@event.listens_for(SessionLocal, "after_flush")
+def _write_changes(session: Session, flush_context):
+    """写入 before_flush 中捕获的变更记录，与业务数据处于同一事务"""
+    captured = session.info.pop("captured_changes", None)
+    if not captured:
+        return
+
+    now = datetime.utcnow()
+    session.connection().execute(insert(Change), [
+        {
+            "seq": seq,
+            "user_id": user_id,
+            "entity_type": TRACKED_ENTITIES[type(obj)],
+            "entity_id": obj.id,
+            "operation": operation,
+            "created_at": now,
+        }
+        for seq, obj, operation, user_id, _ in captured
+    ])
+    manifest_crud.apply_changes(session.connection(), [
+        (user_id, TRACKED_ENTITIES[type(obj)], seq, _count_delta(obj, operation, user_id, created))
+        for seq, obj, operation, user_id, created in captured
+    ])
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _discard_changes(session: Session, previous_transaction):
+    """flush失败回滚时丢弃已捕获但未写入的变更"""
+    session.info.pop("captured_changes", None)
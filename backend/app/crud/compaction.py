@@ -0,0 +1,165 @@
+from sqlalchemy import and_, exists, insert, select
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.models import (
+    OfflineOperation, OfflineOperationArchive, SyncSeenOperation, Todo
+)
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+# 已处理完毕、可以被压缩的操作状态；pending 只合并不删除，conflicted 等待人工处理，不做改动
+SETTLED_STATUSES = ("synced", "resolved")
+MERGEABLE_STATUSES = ("pending", "synced")
+
+# IN 查询每批的参数数量
+CHUNK_SIZE = 500
+
+def count_operations(db: Session, user_id: Optional[int] = None) -> int:
+    query = db.query(OfflineOperation)
+    if user_id is not None:
+        query = query.filter(OfflineOperation.user_id == user_id)
+    return query.count()
+
+def _delete_operations(db: Session, operation_ids: List[int]):
+    """按批删除操作，并解除去重窗口对这些操作的引用（去重结果本身仍然有效）"""
+    for start in range(0, len(operation_ids), CHUNK_SIZE):
+        chunk = operation_ids[start:start + CHUNK_SIZE]
+        db.query(SyncSeenOperation).filter(
+            SyncSeenOperation.operation_id.in_(chunk)
+        ).update({SyncSeenOperation.operation_id: None}, synchronize_session=False)
+        db.query(OfflineOperation).filter(
+            OfflineOperation.id.in_(chunk)
+        ).delete(synchronize_session=False)
+
+def drop_operations_for_deleted_todos(db: Session, user_id: Optional[int] = None) -> int:
+    """删除目标任务已不存在的已处理操作"""
+    query = db.query(OfflineOperation.id).filter(
+        OfflineOperation.sync_status.in_(SETTLED_STATUSES),
+        ~exists().where(Todo.id == OfflineOperation.todo_id)
+    )
+    if user_id is not None:
+        query = query.filter(OfflineOperation.user_id == user_id)
+
+    operation_ids = [row.id for row in query]
+    _delete_operations(db, operation_ids)
+    return len(operation_ids)
+
+def merge_consecutive_updates(db: Session, user_id: Optional[int] = None) -> int:
+    """
+    把同一任务同一字段上连续的 UPDATE 合并为一条：
+    保留最后一条（最终值和HLC），旧值和基线版本取自第一条。
+    连续指同一设备、同一状态，且中间没有该任务的其他类型操作；返回被合并掉的操作数
+    """
+    query = db.query(OfflineOperation)
+    if user_id is not None:
+        query = query.filter(OfflineOperation.user_id == user_id)
+    query = query.order_by(
+        OfflineOperation.todo_id,
+        OfflineOperation.logical_timestamp,
+        OfflineOperation.id
+    )
+
+    survivors = []
+    merged_ids = []
+    runs: Dict[str, List[OfflineOperation]] = {}
+
+    def close_run(field: str):
+        run = runs.pop(field, None)
+        if run and len(run) > 1:
+            first, last = run[0], run[-1]
+            survivors.append({
+                "id": last.id,
+                "old_value": first.old_value,
+                "base_hlc": first.base_hlc,
+            })
+            merged_ids.extend(op.id for op in run[:-1])
+
+    current_todo = None
+    for op in query.yield_per(1000):
+        if op.todo_id != current_todo:
+            for field in list(runs):
+                close_run(field)
+            current_todo = op.todo_id
+
+        if op.operation_type != "UPDATE" or not op.field_name:
+            # 其他类型的操作打断该任务所有字段上的连续修改
+            for field in list(runs):
+                close_run(field)
+            continue
+
+        run = runs.get(op.field_name)
+        if op.sync_status not in MERGEABLE_STATUSES:
+            close_run(op.field_name)
+            continue
+        if run and (run[-1].device_id != op.device_id or run[-1].sync_status != op.sync_status):
+            close_run(op.field_name)
+            run = None
+        if run is None:
+            runs[op.field_name] = [op]
+        else:
+            run.append(op)
+
+    for field in list(runs):
+        close_run(field)
+
+    db.bulk_update_mappings(OfflineOperation, survivors)
+    _delete_operations(db, merged_ids)
+    return len(merged_ids)
+
+def archive_old_operations(
+    db: Session,
+    retention_days: int,
+    user_id: Optional[int] = None
+) -> int:
+    """把超过保留期的已处理操作移入归档表"""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    condition = and_(
+        OfflineOperation.sync_status.in_(SETTLED_STATUSES),
+        OfflineOperation.server_timestamp < cutoff
+    )
+    if user_id is not None:
+        condition = and_(condition, OfflineOperation.user_id == user_id)
+
+    operation_ids = [row.id for row in db.query(OfflineOperation.id).filter(condition)]
+    columns = [
+        column.name for column in OfflineOperationArchive.__table__.columns
+        if column.name != "archived_at"
+    ]
+    for start in range(0, len(operation_ids), CHUNK_SIZE):
+        chunk = operation_ids[start:start + CHUNK_SIZE]
+        db.execute(
+            insert(OfflineOperationArchive).from_select(
+                columns,
+                select(*[getattr(OfflineOperation, name) for name in columns]).where(
+                    OfflineOperation.id.in_(chunk)
+                )
+            )
+        )
+    _delete_operations(db, operation_ids)
+    return len(operation_ids)
+
+def compact_offline_operations(
+    db: Session,
+    user_id: Optional[int] = None,
+    retention_days: Optional[int] = None
+) -> dict:
+    """
+    压缩离线操作日志，返回各步骤处理的行数与压缩前后的总行数
+    user_id 为空时处理所有用户；调用方负责提交事务
+    """
+    if retention_days is None:
+        retention_days = settings.OFFLINE_OP_RETENTION_DAYS
+
+    before = count_operations(db, user_id)
+    dropped = drop_operations_for_deleted_todos(db, user_id)
+    merged = merge_consecutive_updates(db, user_id)
+    archived = archive_old_operations(db, retention_days, user_id)
+    after = count_operations(db, user_id)
+
+    return {
+        "before": before,
+        "dropped_deleted_todos": dropped,
+        "merged_updates": merged,
+        "archived": archived,
+        "after": after,
+    }
@@ -0,0 +1,93 @@
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.models import ExportSnapshot
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+def get_snapshot(db: Session, snapshot_id: int, user_id: Optional[int] = None) -> Optional[ExportSnapshot]:
+    query = db.query(ExportSnapshot).filter(ExportSnapshot.id == snapshot_id)
+    if user_id is not None:
+        query = query.filter(ExportSnapshot.user_id == user_id)
+    return query.first()
+
+def get_snapshot_for_seq(db: Session, user_id: int, change_seq: int) -> Optional[ExportSnapshot]:
+    return db.query(ExportSnapshot).filter(
+        ExportSnapshot.user_id == user_id,
+        ExportSnapshot.change_seq == change_seq
+    ).first()
+
+def is_stale(snapshot: ExportSnapshot) -> bool:
+    """生成中的快照超时未完成，说明生成进程已退出"""
+    timeout = timedelta(seconds=settings.EXPORT_SNAPSHOT_TIMEOUT)
+    return snapshot.status == "pending" and (
+        snapshot.started_at is None or snapshot.started_at < datetime.utcnow() - timeout
+    )
+
+def create_snapshot(db: Session, user_id: int, change_seq: int) -> Optional[ExportSnapshot]:
+    """创建待生成的快照；同一变更序号的快照已存在时返回 None"""
+    snapshot = ExportSnapshot(
+        user_id=user_id,
+        change_seq=change_seq,
+        status="pending",
+        started_at=datetime.utcnow()
+    )
+    db.add(snapshot)
+    try:
+        db.commit()
+    except IntegrityError:
+        # 并发请求已创建了同一序号的快照
+        db.rollback()
+        return None
+    db.refresh(snapshot)
+    return snapshot
+
+def restart_snapshot(db: Session, snapshot: ExportSnapshot) -> bool:
+    """
+    把失败、超时或文件丢失的快照重新置为待生成，
+    以读取时的状态为条件更新，并发请求中只有一个会重新提交生成
+    """
+    updated = db.query(ExportSnapshot).filter(
+        ExportSnapshot.id == snapshot.id,
+        ExportSnapshot.status == snapshot.status,
+        ExportSnapshot.started_at == snapshot.started_at
+    ).update({
+        ExportSnapshot.status: "pending",
+        ExportSnapshot.started_at: datetime.utcnow(),
+        ExportSnapshot.finished_at: None,
+        ExportSnapshot.error: None
+    }, synchronize_session=False)
+    db.commit()
+    db.refresh(snapshot)
+    return bool(updated)
+
+def complete_snapshot(db: Session, snapshot_id: int, file_path: str, file_size: int):
+    db.query(ExportSnapshot).filter(ExportSnapshot.id == snapshot_id).update({
+        ExportSnapshot.status: "completed",
+        ExportSnapshot.file_path: file_path,
+        ExportSnapshot.file_size: file_size,
+        ExportSnapshot.error: None,
+        ExportSnapshot.finished_at: datetime.utcnow()
+    }, synchronize_session=False)
+    db.commit()
+
+def fail_snapshot(db: Session, snapshot_id: int, error: str):
+    db.query(ExportSnapshot).filter(ExportSnapshot.id == snapshot_id).update({
+        ExportSnapshot.status: "failed",
+        ExportSnapshot.error: error,
+        ExportSnapshot.finished_at: datetime.utcnow()
+    }, synchronize_session=False)
+    db.commit()
+
+def remove_older_snapshots(db: Session, user_id: int, change_seq: int) -> List[str]:
+    """删除用户序号更早且已结束的快照记录，返回需要删除的文件路径"""
+    snapshots = db.query(ExportSnapshot).filter(
+        ExportSnapshot.user_id == user_id,
+        ExportSnapshot.change_seq < change_seq,
+        ExportSnapshot.status != "pending"
+    ).all()
+    paths = [snapshot.file_path for snapshot in snapshots if snapshot.file_path]
+    for snapshot in snapshots:
+        db.delete(snapshot)
+    db.commit()
+    return paths
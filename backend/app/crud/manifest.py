@@ -0,0 +1,88 @@
+from sqlalchemy import and_, case, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+from app.models.models import Change, SharedList, SyncManifest
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+import hashlib
+
+def apply_changes(connection, entries: Iterable[Tuple[int, str, int, int]]):
+    """
+    按新写入的变更记录更新同步清单，entries 为 (用户ID, 实体类型, 序号, 条数增量)。
+    写入变更的事务已持有序号计数行的锁，首次插入清单行不会与其他写入者冲突
+    """
+    aggregated: Dict[Tuple[int, str], Tuple[int, int]] = {}
+    for user_id, entity_type, seq, delta in entries:
+        max_seq, total = aggregated.get((user_id, entity_type), (0, 0))
+        aggregated[(user_id, entity_type)] = (max(max_seq, seq), total + delta)
+    if not aggregated:
+        return
+
+    now = datetime.utcnow()
+    for (user_id, entity_type), (max_seq, delta) in aggregated.items():
+        updated = connection.execute(
+            update(SyncManifest).where(
+                SyncManifest.user_id == user_id,
+                SyncManifest.entity_type == entity_type
+            ).values(
+                row_count=SyncManifest.row_count + delta,
+                max_seq=case((SyncManifest.max_seq < max_seq, max_seq), else_=SyncManifest.max_seq),
+                updated_at=now
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            connection.execute(insert(SyncManifest).values(
+                user_id=user_id,
+                entity_type=entity_type,
+                row_count=delta,
+                max_seq=max_seq,
+                updated_at=now
+            ))
+
+def get_manifest(db: Session, user_id: int) -> List[SyncManifest]:
+    """按主键前缀读取用户的全部清单行"""
+    return db.query(SyncManifest).filter(
+        SyncManifest.user_id == user_id
+    ).order_by(SyncManifest.entity_type).all()
+
+def manifest_digest(rows: List[SyncManifest]) -> str:
+    """清单内容摘要，任何类型的条数或最新序号变化都会改变摘要，可直接用作 ETag"""
+    content = "|".join(f"{row.entity_type}:{row.row_count}:{row.max_seq}" for row in rows)
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+def rebuild_manifests(db: Session) -> int:
+    """由变更日志重算全部清单（用于迁移或数据修复），返回写入的行数"""
+    latest = select(
+        Change.user_id, Change.entity_type, Change.entity_id, func.max(Change.seq).label("seq")
+    ).group_by(Change.user_id, Change.entity_type, Change.entity_id).subquery()
+
+    # 与写入时的计数规则一致：共享清单只计入所有者的条数
+    counted = and_(
+        Change.operation == "upsert",
+        or_(latest.c.entity_type != "shared_list", SharedList.owner_id == latest.c.user_id)
+    )
+    rows = db.query(
+        latest.c.user_id,
+        latest.c.entity_type,
+        func.sum(case((counted, 1), else_=0)),
+        func.max(latest.c.seq),
+        func.max(Change.created_at)
+    ).join(
+        Change, and_(Change.user_id == latest.c.user_id, Change.seq == latest.c.seq)
+    ).outerjoin(
+        SharedList, and_(latest.c.entity_type == "shared_list", SharedList.id == latest.c.entity_id)
+    ).group_by(latest.c.user_id, latest.c.entity_type).all()
+
+    db.query(SyncManifest).delete(synchronize_session=False)
+    if not rows:
+        return 0
+    db.execute(insert(SyncManifest), [
+        {
+            "user_id": user_id,
+            "entity_type": entity_type,
+            "row_count": row_count or 0,
+            "max_seq": max_seq,
+            "updated_at": updated_at,
+        }
+        for user_id, entity_type, row_count, max_seq, updated_at in rows
+    ])
+    return len(rows)
@@ -0,0 +1,86 @@
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.models.models import Change, SyncManifest, SyncMerkleBucket, SyncMerkleTree, Todo
+from app.utils.merkle import bucket_expression, bucket_of, build_buckets, root_hash
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+def refresh_tree(db: Session, user_id: int) -> SyncMerkleTree:
+    """
+    把用户的任务哈希树更新到同步清单中的最新任务变更序号，只重算其间有任务变更的桶。
+    变更日志覆盖所有写入路径（包括批量语句和导入），据此找出需要重算的桶；
+    树已是最新时只有两次主键读取
+    """
+    target_seq = db.query(SyncManifest.max_seq).filter(
+        SyncManifest.user_id == user_id,
+        SyncManifest.entity_type == "todo"
+    ).scalar() or 0
+    tree = db.query(SyncMerkleTree).filter(SyncMerkleTree.user_id == user_id).first()
+    if tree is not None and tree.as_of_seq >= target_seq:
+        return tree
+
+    dirty = None
+    if tree is not None:
+        changed_ids = db.query(Change.entity_id).filter(
+            Change.user_id == user_id,
+            Change.entity_type == "todo",
+            Change.seq > tree.as_of_seq,
+            Change.seq <= target_seq
+        ).distinct()
+        dirty = sorted({bucket_of(entity_id) for (entity_id,) in changed_ids})
+    _rebuild_buckets(db, user_id, dirty)
+
+    buckets = dict(db.query(SyncMerkleBucket.bucket, SyncMerkleBucket.hash).filter(
+        SyncMerkleBucket.user_id == user_id
+    ).all())
+    if tree is None:
+        tree = SyncMerkleTree(user_id=user_id)
+        db.add(tree)
+    tree.root_hash = root_hash(buckets)
+    tree.as_of_seq = target_seq
+    tree.updated_at = datetime.utcnow()
+    try:
+        db.commit()
+    except IntegrityError:
+        # 并发请求已先建好了这棵树
+        db.rollback()
+        return db.query(SyncMerkleTree).filter(SyncMerkleTree.user_id == user_id).first()
+    return tree
+
+def _leaf_query(db: Session, user_id: int, buckets: Optional[List[int]]):
+    query = db.query(Todo.id, Todo.change_seq).filter(Todo.user_id == user_id)
+    if buckets is not None:
+        # 桶编号由ID算出，在 (user_id, id, change_seq) 覆盖索引上筛选，不读取任务行
+        query = query.filter(bucket_expression(Todo.id).in_(buckets))
+    return query
+
+def _rebuild_buckets(db: Session, user_id: int, buckets: Optional[List[int]] = None):
+    """重算指定的桶，buckets 为 None 时重建该用户的全部桶"""
+    if buckets == []:
+        return
+    stale = db.query(SyncMerkleBucket).filter(SyncMerkleBucket.user_id == user_id)
+    if buckets is not None:
+        stale = stale.filter(SyncMerkleBucket.bucket.in_(buckets))
+    stale.delete(synchronize_session=False)
+
+    rebuilt = build_buckets(_leaf_query(db, user_id, buckets))
+    if rebuilt:
+        db.bulk_insert_mappings(SyncMerkleBucket, [
+            {"user_id": user_id, "bucket": bucket, "hash": bucket_hash, "row_count": row_count}
+            for bucket, (bucket_hash, row_count) in rebuilt.items()
+        ])
+
+def get_buckets(db: Session, user_id: int) -> List[SyncMerkleBucket]:
+    return db.query(SyncMerkleBucket).filter(
+        SyncMerkleBucket.user_id == user_id
+    ).order_by(SyncMerkleBucket.bucket).all()
+
+def get_bucket_leaves(db: Session, user_id: int, buckets: Iterable[int]) -> Dict[int, List[Tuple[int, int]]]:
+    """指定桶内的全部叶子 {桶编号: [(id, change_seq), ...]}，按ID排序"""
+    buckets = sorted(set(buckets))
+    leaves: Dict[int, List[Tuple[int, int]]] = {bucket: [] for bucket in buckets}
+    if not buckets:
+        return leaves
+    for entity_id, change_seq in _leaf_query(db, user_id, buckets).order_by(Todo.id):
+        leaves[bucket_of(entity_id)].append((entity_id, change_seq or 0))
+    return leaves
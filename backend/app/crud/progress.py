@@ -1,6 +1,7 @@
 from sqlalchemy.orm import Session
 from app.models.models import ProgressTracking, ProgressStatusEnum
 from app.schemas.schemas import ProgressTrackingCreate, ProgressTrackingUpdate
+from app.crud import rollup as rollup_crud
 from datetime import datetime
 from typing import List, Optional
 
@@ -27,6 +28,7 @@ def create_progress_track(db: Session, progress: ProgressTrackingCreate, user_id
         hours_spent=progress.hours_spent
     )
     db.add(db_progress)
+    rollup_crud.on_hours_changed(db, progress.todo_id, progress.hours_spent or 0)
     db.commit()
     db.refresh(db_progress)
     return db_progress
@@ -43,8 +45,10 @@ def update_progress_track(db: Session, progress_id: int, progress_update: Progre
     if "status" in update_data and update_data["status"] == ProgressStatusEnum.DONE:
         update_data["completed_at"] = datetime.utcnow()
     
+    old_hours = db_progress.hours_spent or 0
     for key, value in update_data.items():
         setattr(db_progress, key, value)
+    rollup_crud.on_hours_changed(db, db_progress.todo_id, (db_progress.hours_spent or 0) - old_hours)
     
     db.commit()
     db.refresh(db_progress)
@@ -57,6 +61,7 @@ def delete_progress_track(db: Session, progress_id: int) -> bool:
         return False
     
     db.delete(db_progress)
+    rollup_crud.on_hours_changed(db, db_progress.todo_id, -(db_progress.hours_spent or 0))
     db.commit()
     return True
 
@@ -0,0 +1,244 @@
+from sqlalchemy import func, literal, select
+from sqlalchemy.orm import Session
+from app.models.models import Todo, ProgressTracking
+from app.crud.changes import touch_todos
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# 祖先链递归深度上限，防止脏数据中的环导致无限递归
+MAX_TREE_DEPTH = 1000
+
+ROLLUP_FIELDS = (
+    "descendant_count",
+    "completed_descendant_count",
+    "descendant_hours_spent",
+    "earliest_descendant_due_date",
+    "change_seq",
+)
+
+def get_ancestor_chain(db: Session, todo_id: int) -> List[int]:
+    """沿 parent_id 索引用一次递归查询取出 [todo_id, 父任务, 祖父任务, ...]"""
+    chain = select(
+        Todo.id, Todo.parent_id, literal(0).label("depth")
+    ).where(Todo.id == todo_id).cte("ancestor_chain", recursive=True)
+
+    chain = chain.union_all(
+        select(Todo.id, Todo.parent_id, chain.c.depth + 1).where(
+            Todo.id == chain.c.parent_id,
+            chain.c.depth < MAX_TREE_DEPTH
+        )
+    )
+
+    return list(db.execute(select(chain.c.id).order_by(chain.c.depth)).scalars())
+
+def get_subtree_ids(db: Session, root_ids: List[int]) -> Dict[int, List[int]]:
+    """用一次递归查询取出多个任务各自的全部后代，返回 根任务ID -> [后代ID, ...]"""
+    if not root_ids:
+        return {}
+
+    tree = select(
+        Todo.id.label("root_id"), Todo.id.label("id"), literal(0).label("depth")
+    ).where(Todo.id.in_(root_ids)).cte("subtree", recursive=True)
+
+    tree = tree.union_all(
+        select(tree.c.root_id, Todo.id, tree.c.depth + 1).where(
+            Todo.parent_id == tree.c.id,
+            tree.c.depth < MAX_TREE_DEPTH
+        )
+    )
+
+    subtrees: Dict[int, List[int]] = {root_id: [] for root_id in root_ids}
+    for root_id, todo_id in db.execute(select(tree.c.root_id, tree.c.id).where(tree.c.depth > 0)):
+        subtrees[root_id].append(todo_id)
+    return subtrees
+
+def get_own_hours_spent(db: Session, todo_id: int) -> int:
+    """任务自身的进度记录耗时合计"""
+    return db.query(
+        func.coalesce(func.sum(ProgressTracking.hours_spent), 0)
+    ).filter(ProgressTracking.todo_id == todo_id).scalar()
+
+def get_subtree_contribution(db: Session, todo: Todo) -> Tuple[int, int, int, bool]:
+    """
+    任务整棵子树对祖先汇总的贡献：(任务数, 已完成数, 耗时, 是否有截止日期)
+    """
+    count = 1 + (todo.descendant_count or 0)
+    completed = (1 if todo.completed else 0) + (todo.completed_descendant_count or 0)
+    hours = get_own_hours_spent(db, todo.id) + (todo.descendant_hours_spent or 0)
+    has_due = todo.due_date is not None or todo.earliest_descendant_due_date is not None
+    return count, completed, hours, has_due
+
+def adjust_ancestors(
+    db: Session,
+    parent_id: Optional[int],
+    count: int = 0,
+    completed: int = 0,
+    hours: int = 0,
+    due_changed: bool = False
+):
+    """
+    将一次后代变化应用到 parent_id 及其所有祖先上。
+    计数类字段用一条 UPDATE 增量更新，最早截止日期自下而上重算。
+    """
+    if parent_id is None:
+        return
+
+    db.flush()
+    ancestor_ids = get_ancestor_chain(db, parent_id)
+    if not ancestor_ids:
+        return
+
+    if count or completed or hours:
+        db.query(Todo).filter(Todo.id.in_(ancestor_ids)).update({
+            Todo.descendant_count: Todo.descendant_count + count,
+            Todo.completed_descendant_count: Todo.completed_descendant_count + completed,
+            Todo.descendant_hours_spent: Todo.descendant_hours_spent + hours,
+        }, synchronize_session=False)
+
+    if due_changed:
+        _refresh_earliest_due_date(db, ancestor_ids)
+
+    # 批量UPDATE绕过了会话的flush钩子，需要单独记录祖先的变更
+    if count or completed or hours or due_changed:
+        touch_todos(db, ancestor_ids)
+
+    _expire_rollups(db, ancestor_ids)
+
+def _refresh_earliest_due_date(db: Session, ancestor_ids: List[int]):
+    """由近及远重算最早截止日期，某一层未变化时更上层也不会变化"""
+    for ancestor_id in ancestor_ids:
+        child_due, child_descendant_due, current = db.query(
+            func.min(Todo.due_date),
+            func.min(Todo.earliest_descendant_due_date),
+            select(Todo.earliest_descendant_due_date).where(
+                Todo.id == ancestor_id
+            ).scalar_subquery()
+        ).filter(Todo.parent_id == ancestor_id).one()
+
+        candidates = [d for d in (child_due, child_descendant_due) if d is not None]
+        earliest = min(candidates) if candidates else None
+        if earliest == current:
+            break
+
+        db.query(Todo).filter(Todo.id == ancestor_id).update(
+            {Todo.earliest_descendant_due_date: earliest},
+            synchronize_session=False
+        )
+
+def _expire_rollups(db: Session, todo_ids: List[int]):
+    """让会话中已加载的祖先对象在下次访问时重新读取汇总字段"""
+    ids = set(todo_ids)
+    for obj in list(db.identity_map.values()):
+        if isinstance(obj, Todo) and obj.id in ids:
+            db.expire(obj, list(ROLLUP_FIELDS))
+
+def on_todo_added(db: Session, todo: Todo):
+    """新任务（或导入的子树根）挂到父任务下"""
+    count, completed, hours, has_due = get_subtree_contribution(db, todo)
+    adjust_ancestors(db, todo.parent_id, count, completed, hours, due_changed=has_due)
+
+def on_subtree_removed(db: Session, parent_id: Optional[int], contribution: Tuple[int, int, int, bool]):
+    """
+    子树被删除（或脱离原父任务）后扣减祖先汇总，
+    contribution 需在删除前通过 get_subtree_contribution 取得
+    """
+    count, completed, hours, has_due = contribution
+    adjust_ancestors(db, parent_id, -count, -completed, -hours, due_changed=has_due)
+
+def on_todo_moved(db: Session, todo: Todo, old_parent_id: Optional[int]):
+    """任务连同子树从 old_parent_id 移动到 todo.parent_id"""
+    if old_parent_id == todo.parent_id:
+        return
+    count, completed, hours, has_due = get_subtree_contribution(db, todo)
+    adjust_ancestors(db, old_parent_id, -count, -completed, -hours, due_changed=has_due)
+    adjust_ancestors(db, todo.parent_id, count, completed, hours, due_changed=has_due)
+
+def on_todo_changed(db: Session, todo: Todo, was_completed: bool, old_due_date):
+    """任务自身的完成状态或截止日期变化"""
+    completed = (1 if todo.completed else 0) - (1 if was_completed else 0)
+    due_changed = todo.due_date != old_due_date
+    if completed or due_changed:
+        adjust_ancestors(db, todo.parent_id, completed=completed, due_changed=due_changed)
+
+def on_hours_changed(db: Session, todo_id: int, delta: int):
+    """任务的进度记录耗时变化，影响该任务的所有祖先"""
+    if not delta:
+        return
+    todo = db.query(Todo).filter(Todo.id == todo_id).first()
+    if todo:
+        adjust_ancestors(db, todo.parent_id, hours=delta)
+
+def compute_rollups(rows, own_hours: Optional[Dict[int, int]] = None) -> Dict[int, Tuple[int, int, int, Optional[datetime]]]:
+    """
+    按树形结构计算每个任务的汇总 (后代数, 已完成后代数, 后代耗时, 最早后代截止日期)，
+    rows 为带 id、parent_id、completed、due_date 属性的行，环上的任务不在结果中
+    """
+    own_hours = own_hours or {}
+    children: Dict[Optional[int], List[int]] = {}
+    info = {}
+    for row in rows:
+        info[row.id] = row
+        children.setdefault(row.parent_id, []).append(row.id)
+
+    # 根节点：没有父任务，或父任务不在本次重算范围内
+    roots = [todo_id for todo_id, row in info.items() if row.parent_id is None or row.parent_id not in info]
+
+    # 迭代后序遍历，避免深树触发递归深度限制
+    order = []
+    stack = list(roots)
+    visited = set()
+    while stack:
+        todo_id = stack.pop()
+        if todo_id in visited:
+            continue
+        visited.add(todo_id)
+        order.append(todo_id)
+        stack.extend(children.get(todo_id, []))
+
+    rollups = {}
+    for todo_id in reversed(order):
+        count = completed = hours = 0
+        earliest = None
+        for child_id in children.get(todo_id, []):
+            child = info[child_id]
+            c_count, c_completed, c_hours, c_earliest = rollups.get(child_id, (0, 0, 0, None))
+            count += 1 + c_count
+            completed += (1 if child.completed else 0) + c_completed
+            hours += (own_hours.get(child_id) or 0) + c_hours
+            for due in (child.due_date, c_earliest):
+                if due is not None and (earliest is None or due < earliest):
+                    earliest = due
+        rollups[todo_id] = (count, completed, hours, earliest)
+    return rollups
+
+def rebuild_rollups(db: Session, user_id: Optional[int] = None) -> int:
+    """全量重算汇总字段（用于迁移或数据修复），返回更新的任务数"""
+    query = db.query(
+        Todo.id, Todo.parent_id, Todo.completed, Todo.due_date
+    )
+    if user_id is not None:
+        query = query.filter(Todo.user_id == user_id)
+    rows = query.all()
+
+    hours_query = db.query(
+        ProgressTracking.todo_id, func.sum(ProgressTracking.hours_spent)
+    )
+    if user_id is not None:
+        hours_query = hours_query.join(Todo, Todo.id == ProgressTracking.todo_id).filter(
+            Todo.user_id == user_id
+        )
+    own_hours = dict(hours_query.group_by(ProgressTracking.todo_id).all())
+
+    rollups = compute_rollups(rows, own_hours)
+
+    db.bulk_update_mappings(Todo, [
+        {
+            "id": todo_id,
+            "descendant_count": count,
+            "completed_descendant_count": completed,
+            "descendant_hours_spent": hours,
+            "earliest_descendant_due_date": earliest,
+        }
+        for todo_id, (count, completed, hours, earliest) in rollups.items()
+    ])
+    return len(rollups)
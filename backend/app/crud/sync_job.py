@@ -0,0 +1,364 @@
+from sqlalchemy import and_, insert, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.models import BatchSyncError, BatchSyncItem, BatchSyncJob, OfflineOperation, SyncSequence
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+import json
+
+# 排队或运行中的任务状态
+ACTIVE_STATUSES = ("queued", "running")
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+# 认领任务时用于串行化的计数行，保证并发上限在多进程下也准确
+CLAIM_LOCK = "batch_sync_claims"
+
+def get_job(db: Session, job_id: int, user_id: Optional[int] = None) -> Optional[BatchSyncJob]:
+    query = db.query(BatchSyncJob).filter(BatchSyncJob.id == job_id)
+    if user_id is not None:
+        query = query.filter(BatchSyncJob.user_id == user_id)
+    return query.first()
+
+def get_latest_job(db: Session, user_id: int) -> Optional[BatchSyncJob]:
+    return db.query(BatchSyncJob).filter(
+        BatchSyncJob.user_id == user_id
+    ).order_by(BatchSyncJob.id.desc()).first()
+
+def get_active_job(db: Session, user_id: int) -> Optional[BatchSyncJob]:
+    return db.query(BatchSyncJob).filter(
+        BatchSyncJob.user_id == user_id,
+        BatchSyncJob.status.in_(ACTIVE_STATUSES)
+    ).first()
+
+def get_jobs_updated_since(db: Session, user_ids: List[int], since: datetime) -> List[BatchSyncJob]:
+    """这些用户在 since 之后有进度或状态变化的任务"""
+    return db.query(BatchSyncJob).filter(
+        BatchSyncJob.user_id.in_(user_ids),
+        BatchSyncJob.updated_at >= since
+    ).order_by(BatchSyncJob.id).all()
+
+def create_job(db: Session, user_id: int, batch_size: int, total_items: int) -> Optional[BatchSyncJob]:
+    """创建排队任务；用户已有排队或运行中的任务时返回 None"""
+    job = BatchSyncJob(
+        user_id=user_id,
+        status="queued",
+        batch_size=batch_size,
+        total_items=total_items
+    )
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # 唯一索引保证并发提交时也只有一个活动任务
+        db.rollback()
+        return None
+    db.refresh(job)
+    return job
+
+def get_resumable_job(db: Session, user_id: int) -> Optional[BatchSyncJob]:
+    """用户最近一次任务被取消或失败且留有检查点时，返回该任务以便续传"""
+    job = get_latest_job(db, user_id)
+    if job and job.status in ("cancelled", "failed") and job.checkpoint_operation_id is not None:
+        return job
+    return None
+
+def requeue_job(db: Session, job: BatchSyncJob, total_items: int) -> Optional[BatchSyncJob]:
+    """把中断的任务重新排队，进度回到检查点；用户已有活动任务时返回 None"""
+    job.status = "queued"
+    job.total_items = total_items
+    job.completed_items = job.checkpoint_items
+    job.current_batch = job.checkpoint_batch
+    job.total_batches = job.checkpoint_batch
+    job.speed = None
+    job.estimated_time = None
+    job.error = None
+    job.cancel_requested = False
+    job.lease_owner = None
+    job.lease_expires_at = None
+    job.attempts = 0
+    job.finished_at = None
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    db.refresh(job)
+    return job
+
+def save_checkpoint(
+    db: Session,
+    job_id: int,
+    worker_id: str,
+    batch: int,
+    items: int,
+    operation_id: int
+) -> bool:
+    """
+    在应用批次的事务中写入检查点（不提交）。
+    只有租约持有者能写入，返回 False 时调用方应回滚该批，避免与接手的工作者重复应用
+    """
+    updated = db.query(BatchSyncJob).filter(
+        BatchSyncJob.id == job_id,
+        BatchSyncJob.lease_owner == worker_id,
+        BatchSyncJob.status == "running"
+    ).update({
+        BatchSyncJob.checkpoint_operation_id: operation_id,
+        BatchSyncJob.checkpoint_batch: batch,
+        BatchSyncJob.checkpoint_items: items,
+    }, synchronize_session=False)
+    return bool(updated)
+
+def _lock_claims(db: Session):
+    """UPDATE 计数行取得行锁，同一时刻只有一个工作者在认领任务，锁持有到事务提交"""
+    updated = db.query(SyncSequence).filter(
+        SyncSequence.name == CLAIM_LOCK
+    ).update({SyncSequence.value: SyncSequence.value + 1}, synchronize_session=False)
+    if not updated:
+        db.execute(insert(SyncSequence).values(name=CLAIM_LOCK, value=1))
+
+def claim_job(db: Session, worker_id: str) -> Optional[BatchSyncJob]:
+    """
+    认领一个排队中或租约已过期的任务并取得租约，
+    运行中（租约有效）的任务数达到 BATCH_SYNC_MAX_CONCURRENT_JOBS 时不认领，返回 None
+    """
+    now = datetime.utcnow()
+    try:
+        _lock_claims(db)
+
+        # 多次认领仍未完成的任务不再重试
+        db.query(BatchSyncJob).filter(
+            BatchSyncJob.status == "running",
+            BatchSyncJob.lease_expires_at < now,
+            BatchSyncJob.attempts >= settings.BATCH_SYNC_MAX_ATTEMPTS
+        ).update({
+            BatchSyncJob.status: "failed",
+            BatchSyncJob.error: "工作者多次中断，任务已放弃",
+            BatchSyncJob.lease_owner: None,
+            BatchSyncJob.finished_at: now,
+        }, synchronize_session=False)
+
+        running = db.query(BatchSyncJob).filter(
+            BatchSyncJob.status == "running",
+            BatchSyncJob.lease_expires_at >= now
+        ).count()
+        if running >= settings.BATCH_SYNC_MAX_CONCURRENT_JOBS:
+            db.commit()
+            return None
+
+        job = db.query(BatchSyncJob).filter(
+            or_(
+                BatchSyncJob.status == "queued",
+                and_(BatchSyncJob.status == "running", BatchSyncJob.lease_expires_at < now)
+            )
+        ).order_by(BatchSyncJob.id).first()
+        if job is None:
+            db.commit()
+            return None
+
+        job.status = "running"
+        job.lease_owner = worker_id
+        job.lease_expires_at = now + timedelta(seconds=settings.BATCH_SYNC_LEASE_SECONDS)
+        job.attempts += 1
+        job.started_at = job.started_at or now
+        db.commit()
+        db.refresh(job)
+        return job
+    except Exception:
+        db.rollback()
+        raise
+
+def heartbeat(
+    db: Session,
+    job_id: int,
+    worker_id: str,
+    progress=None
+) -> Optional[bool]:
+    """
+    续约并写入进度。返回是否请求了取消；租约已被其他工作者取得（或任务已结束）时返回 None，
+    调用方应停止执行
+    """
+    values = {
+        BatchSyncJob.lease_expires_at: datetime.utcnow() + timedelta(seconds=settings.BATCH_SYNC_LEASE_SECONDS),
+    }
+    if progress is not None:
+        values.update(_progress_values(progress))
+    updated = db.query(BatchSyncJob).filter(
+        BatchSyncJob.id == job_id,
+        BatchSyncJob.lease_owner == worker_id,
+        BatchSyncJob.status == "running"
+    ).update(values, synchronize_session=False)
+    db.commit()
+    if not updated:
+        return None
+    return db.query(BatchSyncJob.cancel_requested).filter(BatchSyncJob.id == job_id).scalar()
+
+def finish_job(
+    db: Session,
+    job_id: int,
+    worker_id: str,
+    status: str,
+    progress=None,
+    error: Optional[str] = None
+) -> bool:
+    """结束任务并释放租约，只有当前租约持有者能结束任务"""
+    values = {
+        BatchSyncJob.status: status,
+        BatchSyncJob.error: error,
+        BatchSyncJob.lease_owner: None,
+        BatchSyncJob.lease_expires_at: None,
+        BatchSyncJob.finished_at: datetime.utcnow(),
+    }
+    if progress is not None:
+        values.update(_progress_values(progress))
+    updated = db.query(BatchSyncJob).filter(
+        BatchSyncJob.id == job_id,
+        BatchSyncJob.lease_owner == worker_id,
+        BatchSyncJob.status == "running"
+    ).update(values, synchronize_session=False)
+    db.commit()
+    return bool(updated)
+
+def request_cancel(db: Session, job: BatchSyncJob) -> BatchSyncJob:
+    """排队中的任务直接取消；运行中的任务打上取消标记，由持有租约的工作者在下次续约时停止"""
+    if job.status == "queued":
+        job.status = "cancelled"
+        job.finished_at = datetime.utcnow()
+    elif job.status == "running":
+        job.cancel_requested = True
+    db.commit()
+    db.refresh(job)
+    return job
+
+def _progress_values(progress) -> dict:
+    return {
+        BatchSyncJob.total_items: progress.total_items,
+        BatchSyncJob.completed_items: progress.completed_items,
+        BatchSyncJob.current_batch: progress.current_batch,
+        BatchSyncJob.total_batches: progress.total_batches,
+        BatchSyncJob.speed: progress.speed,
+        BatchSyncJob.estimated_time: progress.estimated_time,
+        BatchSyncJob.current_batch_size: progress.batch_size,
+        BatchSyncJob.concurrency: progress.concurrency,
+    }
+
+# 同步明细账本（只追加）
+def record_items(
+    db: Session,
+    job_id: int,
+    user_id: int,
+    batch_id: int,
+    outcomes: List[Tuple[int, Optional[int], str]]
+):
+    """批量追加一批的逐项结果，outcomes 为 (操作ID, 任务ID, 状态) 列表（不提交）"""
+    if not outcomes:
+        return
+    now = datetime.utcnow()
+    db.execute(insert(BatchSyncItem), [
+        {
+            "job_id": job_id,
+            "user_id": user_id,
+            "batch_id": batch_id,
+            "item_type": "operation",
+            "item_id": item_id,
+            "todo_id": todo_id,
+            "status": status,
+            "created_at": now,
+        }
+        for item_id, todo_id, status in outcomes
+    ])
+
+def record_errors(
+    db: Session,
+    job_id: int,
+    user_id: int,
+    batch_id: int,
+    errors: List[Tuple[Optional[int], str, str, Optional[dict]]]
+):
+    """批量追加一批的错误，errors 为 (操作ID, 错误类型, 说明, 详情) 列表（不提交）"""
+    if not errors:
+        return
+    now = datetime.utcnow()
+    db.execute(insert(BatchSyncError), [
+        {
+            "job_id": job_id,
+            "user_id": user_id,
+            "batch_id": batch_id,
+            "item_id": item_id,
+            "error_type": error_type,
+            "message": message,
+            "details": json.dumps(details, ensure_ascii=False, default=str) if details is not None else None,
+            "timestamp": now,
+        }
+        for item_id, error_type, message, details in errors
+    ])
+
+def list_items(
+    db: Session,
+    job_id: int,
+    status: Optional[str] = None,
+    batch_id: Optional[int] = None,
+    cursor: Optional[int] = None,
+    size: int = 20
+) -> Tuple[List[BatchSyncItem], Optional[int]]:
+    """按主键键集分页读取任务的逐项结果，返回 (本页, 下一页游标)"""
+    query = db.query(BatchSyncItem).filter(BatchSyncItem.job_id == job_id)
+    if status is not None:
+        query = query.filter(BatchSyncItem.status == status)
+    if batch_id is not None:
+        query = query.filter(BatchSyncItem.batch_id == batch_id)
+    return _keyset_page(query, BatchSyncItem.id, cursor, size)
+
+def list_errors(
+    db: Session,
+    job_id: int,
+    error_type: Optional[str] = None,
+    cursor: Optional[int] = None,
+    size: int = 20
+) -> Tuple[List[BatchSyncError], Optional[int]]:
+    """按主键键集分页读取任务的错误记录，返回 (本页, 下一页游标)"""
+    query = db.query(BatchSyncError).filter(BatchSyncError.job_id == job_id)
+    if error_type is not None:
+        query = query.filter(BatchSyncError.error_type == error_type)
+    return _keyset_page(query, BatchSyncError.id, cursor, size)
+
+def _keyset_page(query, key, cursor: Optional[int], size: int):
+    if cursor is not None:
+        query = query.filter(key > cursor)
+    rows = query.order_by(key).limit(size + 1).all()
+    next_cursor = rows[size - 1].id if len(rows) > size else None
+    return rows[:size], next_cursor
+
+def get_failed_item_ids(db: Session, job_id: int, item_ids: Optional[List[int]] = None) -> List[int]:
+    """任务中处理失败且仍待处理的离线操作ID，可限定在 item_ids 之内"""
+    query = db.query(BatchSyncItem.item_id).join(
+        OfflineOperation, OfflineOperation.id == BatchSyncItem.item_id
+    ).filter(
+        BatchSyncItem.job_id == job_id,
+        BatchSyncItem.status == "error",
+        OfflineOperation.sync_status == "pending"
+    )
+    if item_ids is not None:
+        query = query.filter(BatchSyncItem.item_id.in_(item_ids))
+    return sorted({row.item_id for row in query})
+
+def create_retry_job(db: Session, user_id: int, batch_size: int, item_ids: List[int]) -> Optional[BatchSyncJob]:
+    """创建只处理指定操作的重试任务；用户已有活动任务时返回 None"""
+    job = BatchSyncJob(
+        user_id=user_id,
+        status="queued",
+        batch_size=batch_size,
+        total_items=len(item_ids),
+        retry_item_ids=json.dumps(item_ids)
+    )
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    db.refresh(job)
+    return job
+
+def get_retry_item_ids(job: BatchSyncJob) -> Optional[List[int]]:
+    return json.loads(job.retry_item_ids) if job.retry_item_ids else None
@@ -1,9 +1,30 @@
 from sqlalchemy.orm import Session
 from app.models import models
 from app.schemas import schemas
+from app.crud import rollup as rollup_crud
+from app.utils.fractional_index import key_between
+from app.utils.timestamp_service import hlc_clock
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+import json
 from typing import List, Optional
 from datetime import datetime
 
+# 离线操作不能直接修改的字段：标识、归属、树结构（移动走子任务接口）和服务端维护的元数据
+PROTECTED_FIELDS = {
+    "id", "user_id", "parent_id", "position", "created_at", "updated_at",
+    "version", "field_versions", "change_seq", "last_synced_at",
+    "descendant_count", "completed_descendant_count",
+    "descendant_hours_spent", "earliest_descendant_due_date",
+}
+
+# 写入时不能为空的任务字段（更新请求中这些字段为null视为无效）
+NON_NULL_FIELDS = {"title", "completed", "priority"}
+
+def is_writable_field(field: Optional[str]) -> bool:
+    """离线操作和冲突合并可以按字段名写入的任务列（不含关系属性和受保护字段）"""
+    return bool(field) and field in models.Todo.__table__.columns and field not in PROTECTED_FIELDS
+
 def get_todo(db: Session, todo_id: int, user_id: int):
     return db.query(models.Todo).filter(
         models.Todo.id == todo_id,
@@ -21,9 +42,39 @@ def get_todos_by_category(db: Session, user_id: int, category: str):
         models.Todo.category == category
     ).all()
 
+def get_siblings_query(db: Session, user_id: int, parent_id: Optional[int]):
+    """同一父任务下的所有任务（parent_id 为 None 时为根任务）"""
+    query = db.query(models.Todo).filter(models.Todo.user_id == user_id)
+    if parent_id is None:
+        return query.filter(models.Todo.parent_id.is_(None))
+    return query.filter(models.Todo.parent_id == parent_id)
+
+def get_append_position(db: Session, user_id: int, parent_id: Optional[int]) -> str:
+    """生成排在所有同级任务之后的排序键"""
+    last_position = get_siblings_query(db, user_id, parent_id).with_entities(
+        func.max(models.Todo.position)
+    ).scalar()
+    return key_between(last_position, None)
+
+def get_field_versions(db_todo: models.Todo) -> dict:
+    """字段级版本 {字段名: HLC}"""
+    return json.loads(db_todo.field_versions) if db_todo.field_versions else {}
+
+def set_field_versions(db_todo: models.Todo, versions: dict):
+    """合并写入字段级版本"""
+    merged = get_field_versions(db_todo)
+    merged.update(versions)
+    db_todo.field_versions = json.dumps(merged, sort_keys=True)
+
 def create_todo(db: Session, todo: schemas.TodoCreate, user_id: int):
-    db_todo = models.Todo(**todo.dict(), user_id=user_id)
+    db_todo = models.Todo(
+        **todo.dict(),
+        user_id=user_id,
+        position=get_append_position(db, user_id, todo.parent_id)
+    )
     db.add(db_todo)
+    db.flush()
+    rollup_crud.on_todo_added(db, db_todo)
     db.commit()
     db.refresh(db_todo)
     return db_todo
@@ -37,16 +88,69 @@ def update_todo(db: Session, todo_id: int, user_id: int, todo_update: schemas.To
         elif 'completed' in update_data and not update_data['completed']:
             update_data['completed_at'] = None
             
+        was_completed, old_due_date = db_todo.completed, db_todo.due_date
         for field, value in update_data.items():
             setattr(db_todo, field, value)
+        # 服务端直接修改同样推进字段版本，离线客户端据此识别同字段并发修改
+        version = hlc_clock.now()
+        set_field_versions(db_todo, {field: version for field in update_data})
+        rollup_crud.on_todo_changed(db, db_todo, was_completed, old_due_date)
         db.commit()
         db.refresh(db_todo)
     return db_todo
 
+def apply_coalesced_writes(db: Session, writes: dict) -> int:
+    """
+    在一个事务中写入合并器缓冲的字段修改，writes 为 {任务ID: {字段: PendingWrite}}。
+    字段当前版本比缓冲写入更新（期间有直接修改或其他进程的写入）时保留当前值，返回修改的任务数。
+    每个任务在各自的保存点中写入，写入失败的任务只丢弃自己的修改，不影响同批其他任务
+    """
+    if not writes:
+        return 0
+    todos = db.query(models.Todo).filter(models.Todo.id.in_(list(writes))).all()
+    updated = 0
+    for db_todo in todos:
+        versions = get_field_versions(db_todo)
+        fields = {
+            field: write for field, write in writes[db_todo.id].items()
+            if write.user_id == db_todo.user_id
+            and (
+                versions.get(field) is None
+                or write.hlc > versions[field]
+                # 旧数据中超前过多的版本无效，不能让已确认的写入被静默丢弃
+                or not hlc_clock.is_within_drift(versions[field])
+            )
+        }
+        if not fields:
+            continue
+        update_data = {field: write.value for field, write in fields.items()}
+        if 'completed' in update_data:
+            update_data['completed_at'] = datetime.utcnow() if update_data['completed'] else None
+        
+        todo_id = db_todo.id
+        try:
+            with db.begin_nested():
+                was_completed, old_due_date = db_todo.completed, db_todo.due_date
+                for field, value in update_data.items():
+                    setattr(db_todo, field, value)
+                set_field_versions(db_todo, {field: write.hlc for field, write in fields.items()})
+                rollup_crud.on_todo_changed(db, db_todo, was_completed, old_due_date)
+                db.flush()
+        except SQLAlchemyError as e:
+            # 重试也不会成功（如违反约束），丢弃该任务的写入
+            print(f"任务{todo_id}的合并写入失败，已丢弃: {e}")
+            continue
+        updated += 1
+    db.commit()
+    return updated
+
 def delete_todo(db: Session, todo_id: int, user_id: int):
     db_todo = get_todo(db, todo_id, user_id)
     if db_todo:
+        contribution = rollup_crud.get_subtree_contribution(db, db_todo)
+        parent_id = db_todo.parent_id
         db.delete(db_todo)
+        rollup_crud.on_subtree_removed(db, parent_id, contribution)
         db.commit()
     return db_todo
 
@@ -1,7 +1,7 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
-from app.api import auth, todos, users, websocket, shared_lists, comments, assignments, progress, subtasks, offline_sync
+from app.api import auth, todos, users, websocket, shared_lists, comments, assignments, progress, subtasks, offline_sync, full_data_sync, batch_sync
 from app.core.config import settings
 from app.core.database import engine, Base
 import os
@@ -30,6 +30,8 @@ app.include_router(users.router, prefix="/api/users", tags=["用户"])
 app.include_router(todos.router, prefix="/api/todos", tags=["待办事项"])
 app.include_router(subtasks.router, prefix="/api/subtasks", tags=["子任务"])
 app.include_router(offline_sync.router, prefix="/api/offline", tags=["离线同步"])
+app.include_router(full_data_sync.router, prefix="/api", tags=["全量同步"])
+app.include_router(batch_sync.router, prefix="/api")
 
 
 app.include_router(shared_lists.router, prefix="/api", tags=["共享清单"])
@@ -38,6 +40,32 @@ app.include_router(assignments.router, prefix="/api", tags=["任务分配"])
 app.include_router(progress.router, prefix="/api", tags=["进度跟踪"])
 app.include_router(websocket.router, prefix="/api/ws", tags=["WebSocket"])
 
+@app.on_event("startup")
+async def start_write_coalescer():
+    """启动高频字段修改的合并写入器"""
+    todos.write_coalescer.start()
+
+@app.on_event("shutdown")
+async def stop_write_coalescer():
+    # 关闭前把缓冲中的修改全部写入
+    await todos.write_coalescer.stop()
+
+@app.on_event("shutdown")
+async def stop_snapshot_exporter():
+    """停止导出快照进程池"""
+    full_data_sync.snapshot_exporter.shutdown()
+
+@app.on_event("startup")
+async def start_batch_sync_workers():
+    """启动批量同步工作者池和进度转发器"""
+    batch_sync.worker_pool.start()
+    batch_sync.progress_relay.start()
+
+@app.on_event("shutdown")
+async def stop_batch_sync_workers():
+    await batch_sync.progress_relay.stop()
+    await batch_sync.worker_pool.stop()
+
 @app.get("/")
 async def root():
     return {"message": "待办事项API服务正常运行"}
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Enum
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, ForeignKey, Text, Enum, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -53,12 +53,21 @@ class Todo(Base):
     
     # 树形结构支持
     parent_id = Column(Integer, ForeignKey("todos.id"), nullable=True, index=True)
+    position = Column(String(255))  # 同级排序键（分数索引），按字典序排列
+    
+    # 子树汇总（只统计后代，不含自身），在后代变化时沿祖先链增量维护
+    descendant_count = Column(Integer, default=0, nullable=False)
+    completed_descendant_count = Column(Integer, default=0, nullable=False)
+    descendant_hours_spent = Column(Integer, default=0, nullable=False)
+    earliest_descendant_due_date = Column(DateTime)
     
     # 离线同步相关字段
     version = Column(Integer, default=1, nullable=False)  # 版本号控制
     last_synced_at = Column(DateTime)  # 最后同步时间
     conflict_status = Column(String(20), default="resolved")  # 冲突状态
     conflict_details = Column(Text)  # 冲突详情JSON
+    field_versions = Column(Text)  # 字段级版本JSON {字段名: HLC}，用于按字段合并
+    change_seq = Column(Integer)  # 最后一次变更在所有者变更日志中的序号（按用户单调递增），用于增量同步
     
     # 关系
     owner = relationship("User", back_populates="todos")
@@ -69,6 +78,12 @@ class Todo(Base):
     # 树形关系
     parent = relationship("Todo", remote_side=[id], back_populates="children")
     children = relationship("Todo", back_populates="parent")
+    
+    __table_args__ = (
+        Index("ix_todos_parent_position", "parent_id", "position"),
+        Index("ix_todos_user_change_seq", "user_id", "change_seq"),
+        Index("ix_todos_user_id_change_seq", "user_id", "id", "change_seq"),  # 计算哈希树的桶（覆盖索引）
+    )
 
 class SharedList(Base):
     __tablename__ = "shared_lists"
@@ -143,6 +158,8 @@ class OfflineOperation(Base):
     client_timestamp = Column(DateTime)  # 客户端时间戳（仅供参考）
     server_timestamp = Column(DateTime, default=datetime.utcnow)  # 服务器生成的时间戳
     logical_timestamp = Column(Integer)  # 逻辑时钟（用于严格排序）
+    hlc = Column(String(64))  # 客户端修改时的混合逻辑时钟
+    base_hlc = Column(String(64))  # 客户端修改前看到的该字段版本
     timestamp = Column(DateTime, default=datetime.utcnow)
     sequence_id = Column(String(50), unique=True)  # 唯一操作标识
     sync_status = Column(String(20), default="pending")  # pending, synced, conflicted
@@ -151,6 +168,298 @@ class OfflineOperation(Base):
     # 关系
     user = relationship("User")
     todo = relationship("Todo")
+    
+    __table_args__ = (
+        Index("ix_offline_operations_user_status", "user_id", "sync_status"),
+    )
+
+
+class OfflineOperationArchive(Base):
+    """超过保留期的已同步离线操作，由压缩任务从 offline_operations 移入"""
+    __tablename__ = "offline_operations_archive"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)  # 保留原操作ID
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    todo_id = Column(Integer, nullable=False)  # 任务可能已被删除，不设外键
+    operation_type = Column(String(20), nullable=False)
+    field_name = Column(String(50))
+    old_value = Column(Text)
+    new_value = Column(Text)
+    client_timestamp = Column(DateTime)
+    server_timestamp = Column(DateTime)
+    logical_timestamp = Column(Integer)
+    hlc = Column(String(64))
+    base_hlc = Column(String(64))
+    timestamp = Column(DateTime)
+    sequence_id = Column(String(50))
+    sync_status = Column(String(20))
+    device_id = Column(String(50))
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SyncSequence(Base):
+    """
+    单调序号计数器，分配时行锁串行化写入者，保证序号顺序与提交顺序一致；
+    变更序号按用户各一行，只串行化同一用户的写入者，全局计数器的 user_id 为0
+    """
+    __tablename__ = "sync_sequences"
+    
+    name = Column(String(50), primary_key=True)
+    user_id = Column(Integer, primary_key=True, default=0)
+    value = Column(Integer, nullable=False, default=0)
+
+
+class Change(Base):
+    """
+    变更数据捕获日志：任务、评论、分配、共享清单和进度的每次写入
+    按可见用户各追加一条，seq 在每个用户内单调递增，删除记为墓碑
+    """
+    __tablename__ = "changes"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)  # 接收该变更的用户
+    seq = Column(Integer, primary_key=True, autoincrement=False)  # 由 sync_sequences 中该用户的计数行分配
+    entity_type = Column(String(30), nullable=False)  # todo, comment, assignment, shared_list, shared_list_member, progress
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String(10), nullable=False)  # upsert, delete
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_changes_user_type_seq", "user_id", "entity_type", "seq"),
+    )
+
+
+class SyncManifest(Base):
+    """
+    同步清单：每个用户每种数据类型一行，与变更日志在同一事务中维护，
+    客户端读取一次即可判断自上次同步以来是否有任何变化
+    """
+    __tablename__ = "sync_manifests"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    entity_type = Column(String(30), primary_key=True)  # 与 changes.entity_type 相同
+    row_count = Column(Integer, nullable=False, default=0)  # 该用户变更流中现存的数据条数（新增+1，删除-1）
+    max_seq = Column(Integer, nullable=False, default=0)  # 该类型最后一次变更的序号
+    updated_at = Column(DateTime, default=datetime.utcnow)  # 该类型最后一次变更的时间
+
+
+class SyncMerkleTree(Base):
+    """
+    用户任务哈希树的根（算法见 app/utils/merkle.py），
+    as_of_seq 及之前的任务变更都已反映在桶哈希中
+    """
+    __tablename__ = "sync_merkle_trees"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    root_hash = Column(String(32), nullable=False)
+    as_of_seq = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SyncMerkleBucket(Base):
+    """用户任务哈希树的叶子桶，任务按ID的散列值分桶，空桶不保存"""
+    __tablename__ = "sync_merkle_buckets"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    bucket = Column(Integer, primary_key=True)  # 0 ~ FANOUT-1，见 app/utils/merkle.py
+    hash = Column(String(16), nullable=False)
+    row_count = Column(Integer, nullable=False, default=0)
+
+
+class SyncCursor(Base):
+    """每个用户设备的同步游标（已拉取到的变更序号）"""
+    __tablename__ = "sync_cursors"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    device_id = Column(String(50), nullable=False)
+    last_change_seq = Column(Integer, nullable=False, default=0)
+    last_sync_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ux_sync_cursors_device", "user_id", "device_id", unique=True),
+    )
+
+
+class SyncSeenOperation(Base):
+    """最近处理过的客户端操作ID，每个设备只保留固定窗口，用于重试时去重"""
+    __tablename__ = "sync_seen_operations"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    device_id = Column(String(50), nullable=False)
+    client_op_id = Column(String(64), nullable=False)  # 客户端提供的稳定操作ID
+    operation_id = Column(Integer, ForeignKey("offline_operations.id"))
+    result = Column(Text)  # 首次处理结果（冲突/错误JSON），成功时为空
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ux_sync_seen_operations_op", "user_id", "device_id", "client_op_id", unique=True),
+        Index("ix_sync_seen_operations_window", "user_id", "device_id", "id"),
+    )
+
+
+class BatchSyncJob(Base):
+    """
+    批量同步任务：由接口写入排队，任意进程的工作者按租约认领执行，
+    进度写回本表，因此任何进程都能读取状态，进程重启后过期租约的任务会被重新认领
+    """
+    __tablename__ = "batch_sync_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, completed, failed, cancelled
+    batch_size = Column(Integer, nullable=False, default=50)  # 初始批次大小
+    current_batch_size = Column(Integer)  # 自适应控制器当前选择的批次大小
+    concurrency = Column(Integer)  # 自适应控制器当前选择的并发数
+    total_items = Column(Integer, nullable=False, default=0)
+    completed_items = Column(Integer, nullable=False, default=0)
+    current_batch = Column(Integer, nullable=False, default=0)
+    total_batches = Column(Integer, nullable=False, default=0)
+    speed = Column(Float)  # 项/秒
+    estimated_time = Column(Float)  # 预计剩余秒数
+    error = Column(Text)
+    # 检查点：从头开始连续应用完成的最后一批，与该批的数据修改在同一事务中写入
+    checkpoint_operation_id = Column(Integer)  # 已应用的最大离线操作ID
+    checkpoint_batch = Column(Integer, nullable=False, default=0)  # 已完成的批次号
+    checkpoint_items = Column(Integer, nullable=False, default=0)  # 已完成的项目数
+    retry_item_ids = Column(Text)  # 选择性重试时只处理的离线操作ID（JSON数组），为空表示全部待处理操作
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    lease_owner = Column(String(64))  # 持有租约的工作者标识
+    lease_expires_at = Column(DateTime)
+    attempts = Column(Integer, nullable=False, default=0)  # 被认领的次数
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_batch_sync_jobs_status_lease", "status", "lease_expires_at"),
+        Index("ix_batch_sync_jobs_user", "user_id", "id"),
+        # 每个用户同时只能有一个排队或运行中的任务
+        Index(
+            "ux_batch_sync_jobs_active", "user_id", unique=True,
+            sqlite_where=status.in_(["queued", "running"]),
+            postgresql_where=status.in_(["queued", "running"]),
+        ),
+    )
+
+
+class BatchSyncItem(Base):
+    """批量同步的逐项结果，只追加不修改，每批一次批量写入"""
+    __tablename__ = "batch_sync_items"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("batch_sync_jobs.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    batch_id = Column(Integer, nullable=False)
+    item_type = Column(String(20), nullable=False, default="operation")
+    item_id = Column(Integer, nullable=False)  # 离线操作ID
+    todo_id = Column(Integer)
+    status = Column(String(20), nullable=False)  # synced, conflicted, error
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_batch_sync_items_job", "job_id", "id"),
+        Index("ix_batch_sync_items_job_status", "job_id", "status", "id"),
+    )
+
+
+class BatchSyncError(Base):
+    """批量同步错误记录，只追加不修改：批次失败、冲突和无法应用的操作"""
+    __tablename__ = "batch_sync_errors"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("batch_sync_jobs.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    batch_id = Column(Integer, nullable=False)
+    item_id = Column(Integer)  # 离线操作ID
+    error_type = Column(String(30), nullable=False)  # batch_failed, conflict, todo_missing, invalid_field, invalid_value
+    message = Column(Text, nullable=False)
+    details = Column(Text)  # 详情JSON
+    timestamp = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_batch_sync_errors_job", "job_id", "id"),
+        Index("ix_batch_sync_errors_job_type", "job_id", "error_type", "id"),
+    )
+
+
+class ExportSnapshot(Base):
+    """
+    数据导出快照：后台进程把用户数据写成压缩的 NDJSON 文件，
+    以生成时用户的最新变更序号为键，数据未变化时直接复用已有文件
+    """
+    __tablename__ = "export_snapshots"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    change_seq = Column(Integer, nullable=False)  # 生成时用户的最新变更序号，文件内容不早于该序号
+    status = Column(String(20), nullable=False, default="pending")  # pending, completed, failed
+    compression = Column(String(10), nullable=False, default="gzip")
+    file_path = Column(String(255))
+    file_size = Column(Integer)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)  # 最近一次提交生成的时间，超时未完成视为生成进程已退出
+    finished_at = Column(DateTime)
+    
+    __table_args__ = (
+        Index("ux_export_snapshots_user_seq", "user_id", "change_seq", unique=True),
+    )
+
+
+class ImportStagingTodo(Base):
+    """
+    全量导入的暂存任务：上传内容边解析边分块写入暂存表，
+    校验和父子关系整理完成后在一个短事务中换入 todos，结束后按 import_id 清理
+    """
+    __tablename__ = "import_staging_todos"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    import_id = Column(String(32), nullable=False)
+    row_no = Column(Integer, nullable=False)  # 本次导入内从0开始的序号，决定换入时分配的变更序号
+    source_id = Column(Integer)  # 上传数据中的任务ID，只用于解析父子关系和评论归属
+    source_parent_id = Column(Integer)  # 父任务不在本次导入中或成环时置空
+    title = Column(String(200), nullable=False)
+    description = Column(Text)
+    priority = Column(Enum(PriorityEnum), nullable=False)
+    category = Column(String(50), nullable=False)
+    due_date = Column(DateTime)
+    completed = Column(Boolean, nullable=False)
+    version = Column(Integer, nullable=False)
+    position = Column(String(255))  # 同级排序键：子任务在整理时按上传顺序生成，根任务在换入时接在已有根任务之后生成
+    # 按暂存的树形结构预先算好的子树汇总，换入时直接写入
+    descendant_count = Column(Integer, nullable=False, default=0)
+    completed_descendant_count = Column(Integer, nullable=False, default=0)
+    earliest_descendant_due_date = Column(DateTime)
+    new_id = Column(Integer)  # 换入后的任务ID
+    
+    __table_args__ = (
+        Index("ux_import_staging_todos_source", "import_id", "source_id", unique=True),
+        Index("ix_import_staging_todos_row", "import_id", "row_no"),
+        Index("ix_import_staging_todos_new", "import_id", "new_id"),
+    )
+
+
+class ImportStagingComment(Base):
+    """全量导入的暂存评论，换入时按 source_todo_id 关联到新任务"""
+    __tablename__ = "import_staging_comments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    import_id = Column(String(32), nullable=False, index=True)
+    source_todo_id = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False)
+
+
+class ImportStagingAssignment(Base):
+    """全量导入的暂存任务分配，换入时按 source_todo_id 关联到新任务"""
+    __tablename__ = "import_staging_assignments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    import_id = Column(String(32), nullable=False, index=True)
+    source_todo_id = Column(Integer, nullable=False)
+    assigner_id = Column(Integer, nullable=False)
+    status = Column(Enum(AssignmentStatusEnum), nullable=False)
 
 
 class ProgressTracking(Base):
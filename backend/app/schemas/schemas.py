@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict
+import json
 from app.models.models import PriorityEnum, ProgressStatusEnum, AssignmentStatusEnum
 
 # 用户相关模式
@@ -61,10 +62,28 @@ class TodoResponse(TodoBase):
     parent_id: Optional[int] = None
     has_children: Optional[bool] = None
     children_count: Optional[int] = None
+    position: Optional[str] = None  # 同级排序键
     # 离线同步字段
     version: int = 1
     last_synced_at: Optional[datetime] = None
     conflict_status: str = "resolved"
+    change_seq: Optional[int] = None
+    # 子树汇总字段（只统计后代）
+    descendant_count: int = 0
+    completed_descendant_count: int = 0
+    descendant_hours_spent: int = 0
+    earliest_descendant_due_date: Optional[datetime] = None
+    # 字段级版本（HLC），离线客户端修改字段时作为 base_hlc 回传
+    field_versions: Dict[str, str] = {}
+    
+    @field_validator("field_versions", mode="before")
+    @classmethod
+    def parse_field_versions(cls, value):
+        if not value:
+            return {}
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
     
     class Config:
         from_attributes = True
@@ -171,12 +190,16 @@ class WebSocketMessage(BaseModel):
 
 # 离线操作相关模式
 class OfflineOperationBase(BaseModel):
+    op_id: Optional[str] = Field(None, min_length=1, max_length=64)  # 客户端生成的稳定操作ID，重试时保持不变
     todo_id: int
     operation_type: str  # CREATE, UPDATE, DELETE
     field_name: Optional[str] = None
     old_value: Optional[str] = None
     new_value: Optional[str] = None
     device_id: Optional[str] = None
+    # HLC格式: 物理毫秒(15位)-逻辑计数(5位)-节点
+    hlc: Optional[str] = Field(None, max_length=64, pattern=r"^\d{15}-\d{5}-.+$")  # 客户端修改时的HLC
+    base_hlc: Optional[str] = Field(None, max_length=64, pattern=r"^\d{15}-\d{5}-.+$")  # 修改前客户端看到的字段版本
 
 
 class OfflineOperationCreate(OfflineOperationBase):
@@ -195,7 +218,9 @@ class OfflineOperationResponse(OfflineOperationBase):
 
 
 class SyncRequest(BaseModel):
-    last_sync_time: Optional[datetime] = None
+    last_sync_time: Optional[datetime] = None  # 兼容旧客户端，设备没有同步游标时才使用
+    cursor: Optional[int] = Field(None, ge=0)  # 上次响应的 next_cursor，回传即确认已收到并保存为设备游标；为空时使用已确认的设备游标
+    limit: int = Field(500, ge=1, le=5000)  # 单次返回的服务器更新数量上限
     device_id: str
     pending_operations: List[OfflineOperationCreate] = []
 
@@ -209,9 +234,12 @@ class ConflictResolution(BaseModel):
 
 class SyncResponse(BaseModel):
     server_updates: List[TodoResponse]
+    deleted_todo_ids: List[int] = []  # 游标之后被删除的任务（墓碑）
     conflicts: List[dict]
     sync_timestamp: datetime
     has_more: bool
+    next_cursor: int = 0  # 下一次同步使用的游标
+    duplicate_op_ids: List[str] = []  # 已处理过而被跳过的操作ID
 
 
 # 子任务相关模式
@@ -223,9 +251,88 @@ class SubtaskCreate(BaseModel):
 
 class SubtaskMove(BaseModel):
     new_parent_id: Optional[int] = None  # None表示移动到根级别
+    after_id: Optional[int] = None  # 放到该同级任务之后
+    before_id: Optional[int] = None  # 放到该同级任务之前
+
+class SubtaskReorderItem(SubtaskMove):
+    todo_id: int
+
+class SubtaskReorder(BaseModel):
+    moves: List[SubtaskReorderItem] = Field(..., min_length=1, max_length=500)
     
 class TodoTreeResponse(TodoResponse):
     children: List['TodoTreeResponse'] = []
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class TodoTreeNode(TodoResponse):
+    """按需展开的树节点，children 只包含已加载的部分"""
+    children: List['TodoTreeNode'] = []
+    children_cursor: Optional[str] = None  # 继续加载剩余子任务的游标，None表示已全部加载
+
+class TodoChildrenPage(BaseModel):
+    items: List[TodoTreeNode]
+    next_cursor: Optional[str] = None
+
+
+# 批量同步相关模式
+class BatchSyncRequest(BaseModel):
+    last_sync_time: Optional[datetime] = None
+    batch_size: Optional[int] = Field(50, ge=1, le=1000)
+    include_tasks: bool = True
+    include_comments: bool = True
+    include_assignments: bool = True
+
+class BatchSyncRetryRequest(BaseModel):
+    job_id: Optional[int] = None  # 默认为最近一次任务
+    item_ids: Optional[List[int]] = Field(None, max_length=5000)  # 只重试其中这些失败项目，默认全部失败项目
+    batch_size: Optional[int] = Field(None, ge=1, le=1000)
+
+class SyncItem(BaseModel):
+    id: int
+    job_id: int
+    batch_id: int
+    type: str = Field(validation_alias="item_type")  # operation
+    item_id: int
+    todo_id: Optional[int] = None
+    status: str  # synced, conflicted, error
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+class SyncError(BaseModel):
+    id: int
+    job_id: int
+    batch_id: int
+    item_id: Optional[int] = None
+    error_type: str
+    message: str
+    timestamp: datetime
+    details: Optional[dict] = None
+    
+    @field_validator("details", mode="before")
+    @classmethod
+    def parse_details(cls, value):
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+    
+    class Config:
+        from_attributes = True
+
+class SyncItemPage(BaseModel):
+    job_id: Optional[int] = None
+    items: List[SyncItem]
+    next_cursor: Optional[int] = None  # 为空表示没有更多
+
+class SyncErrorPage(BaseModel):
+    job_id: Optional[int] = None
+    errors: List[SyncError]
+    next_cursor: Optional[int] = None
+
+class MerkleDiffRequest(BaseModel):
+    root: Optional[str] = None  # 客户端缓存的根哈希，与服务端一致时不再比较各个桶
+    buckets: Dict[int, str] = Field(default_factory=dict, max_length=1024)  # {桶编号: 桶哈希}，空桶不传
+    include_leaves: bool = True  # 是否返回不一致的桶中服务端的全部 (id, change_seq)
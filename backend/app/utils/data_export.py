@@ -0,0 +1,246 @@
+"""
+用户数据导出
+按数据类型用 yield_per 分批读取并逐段输出 JSON 或 NDJSON，
+内存占用与账户数据量无关，第一段数据无需等待全部查询完成即可发出
+"""
+
+import enum
+import json
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.database import SessionLocal
+from app.crud import changes as changes_crud
+from app.models import models
+
+# 每次读取的行数，也是输出时合并为一段的记录数
+EXPORT_BATCH_SIZE = 500
+
+# NDJSON 中每种数据的记录类型
+RECORD_TYPES = {
+    "todos": "todo",
+    "comments": "comment",
+    "assignments": "assignment",
+    "owned_shared_lists": "owned_shared_list",
+    "member_shared_lists": "member_shared_list",
+    "deleted": "deleted",
+}
+
+def _export_todo(todo: models.Todo) -> dict:
+    return {
+        "id": todo.id,
+        "title": todo.title,
+        "description": todo.description,
+        "completed": todo.completed,
+        "priority": todo.priority,
+        "category": todo.category,
+        "due_date": todo.due_date,
+        "parent_id": todo.parent_id,
+        "created_at": todo.created_at,
+        "updated_at": todo.updated_at,
+        "version": todo.version,
+        "change_seq": todo.change_seq
+    }
+
+def _export_comment(comment: models.Comment) -> dict:
+    return {
+        "id": comment.id,
+        "todo_id": comment.todo_id,
+        "content": comment.content,
+        "created_at": comment.created_at,
+        "updated_at": comment.updated_at
+    }
+
+def _export_assignment(assignment: models.TaskAssignment) -> dict:
+    return {
+        "id": assignment.id,
+        "todo_id": assignment.todo_id,
+        "assigner_id": assignment.assigner_id,
+        "assignee_id": assignment.assignee_id,
+        "status": assignment.status,
+        "assigned_at": assignment.assigned_at,
+        "completed_at": assignment.completed_at
+    }
+
+def _export_owned_list(shared_list: models.SharedList) -> dict:
+    return {
+        "id": shared_list.id,
+        "name": shared_list.name,
+        "description": shared_list.description,
+        "created_at": shared_list.created_at,
+        "updated_at": shared_list.updated_at
+    }
+
+def _iter_entities(db: Session, query, serialize: Callable[[Any], dict]) -> Iterator[dict]:
+    for entity in query.yield_per(EXPORT_BATCH_SIZE):
+        yield serialize(entity)
+        # 已输出的对象不再需要，避免会话的标识映射随数据量增长
+        db.expunge(entity)
+
+def _iter_member_lists(db: Session, user_id: int) -> Iterator[dict]:
+    rows = db.query(
+        models.SharedList.id,
+        models.SharedList.name,
+        models.SharedList.description,
+        models.SharedList.owner_id,
+        models.User.username,
+        models.SharedListMember.role,
+        models.SharedListMember.joined_at
+    ).join(
+        models.SharedListMember, models.SharedListMember.shared_list_id == models.SharedList.id
+    ).outerjoin(
+        models.User, models.User.id == models.SharedList.owner_id
+    ).filter(
+        models.SharedListMember.user_id == user_id
+    ).order_by(models.SharedList.id).yield_per(EXPORT_BATCH_SIZE)
+
+    for list_id, name, description, owner_id, owner_username, role, joined_at in rows:
+        yield {
+            "id": list_id,
+            "name": name,
+            "description": description,
+            "owner_id": owner_id,
+            "owner_username": owner_username or "Unknown",
+            "role": role or "member",
+            "joined_at": joined_at
+        }
+
+def _iter_tombstones(db: Session, user_id: int) -> Iterator[dict]:
+    rows = db.query(
+        models.Change.entity_type, models.Change.entity_id, models.Change.seq
+    ).filter(
+        models.Change.user_id == user_id,
+        models.Change.operation == changes_crud.DELETE
+    ).order_by(models.Change.seq).yield_per(EXPORT_BATCH_SIZE)
+
+    for entity_type, entity_id, seq in rows:
+        yield {"entity_type": entity_type, "entity_id": entity_id, "seq": seq}
+
+def iter_export_sections(
+    db: Session,
+    user_id: int,
+    since: Optional[datetime] = None,
+    include_deleted: bool = False
+) -> Iterator[Tuple[str, Iterator[dict]]]:
+    """依次产生 (数据类型, 记录迭代器)，每个迭代器在被消费时才查询数据库"""
+    todos = db.query(models.Todo).filter(models.Todo.user_id == user_id)
+    if since:
+        todos = todos.filter(models.Todo.updated_at > since)
+    yield "todos", _iter_entities(db, todos.order_by(models.Todo.id), _export_todo)
+
+    comments = db.query(models.Comment).filter(models.Comment.user_id == user_id)
+    if since:
+        comments = comments.filter(models.Comment.created_at > since)
+    yield "comments", _iter_entities(db, comments.order_by(models.Comment.id), _export_comment)
+
+    assignments = db.query(models.TaskAssignment).filter(models.TaskAssignment.assignee_id == user_id)
+    if since:
+        assignments = assignments.filter(models.TaskAssignment.assigned_at > since)
+    yield "assignments", _iter_entities(db, assignments.order_by(models.TaskAssignment.id), _export_assignment)
+
+    owned_lists = db.query(models.SharedList).filter(models.SharedList.owner_id == user_id)
+    if since:
+        owned_lists = owned_lists.filter(models.SharedList.updated_at > since)
+    yield "owned_shared_lists", _iter_entities(db, owned_lists.order_by(models.SharedList.id), _export_owned_list)
+
+    yield "member_shared_lists", _iter_member_lists(db, user_id)
+
+    # 已删除的数据以墓碑形式导出
+    if include_deleted:
+        yield "deleted", _iter_tombstones(db, user_id)
+
+def _json_default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"无法编码为JSON的类型: {type(value).__name__}")
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=_json_default, separators=(",", ":"))
+
+def _header(user_id: int, username: str) -> dict:
+    return {
+        "export_timestamp": datetime.utcnow(),
+        "user_id": user_id,
+        "user_username": username,
+    }
+
+def iter_export_json(
+    user_id: int,
+    username: str,
+    since: Optional[datetime] = None,
+    include_deleted: bool = False
+) -> Iterator[str]:
+    """
+    逐段输出与原导出接口结构相同的 JSON 文档：
+    {"export_timestamp", "user_id", "user_username", "data": {"todos": [...], ...}}
+    """
+    # 响应流结束前请求的数据库会话可能已关闭，流式读取使用独立会话
+    db = SessionLocal()
+    try:
+        header = _dumps(_header(user_id, username))
+        yield header[:-1] + ',"data":{'
+        for section_index, (section, records) in enumerate(
+            iter_export_sections(db, user_id, since, include_deleted)
+        ):
+            buffer = [("," if section_index else "") + _dumps(section) + ":["]
+            for index, record in enumerate(records):
+                buffer.append(("," if index else "") + _dumps(record))
+                if len(buffer) >= EXPORT_BATCH_SIZE:
+                    yield "".join(buffer)
+                    buffer = []
+            buffer.append("]")
+            yield "".join(buffer)
+        yield "}}"
+    finally:
+        db.close()
+
+def iter_export_ndjson(
+    user_id: int,
+    username: str,
+    since: Optional[datetime] = None,
+    include_deleted: bool = False,
+    header: Optional[dict] = None
+) -> Iterator[str]:
+    """
+    以 NDJSON 逐行输出：第一行为导出信息（type=export，可用 header 追加字段），
+    之后每行一条数据（type 为数据类型，data 为内容），最后一行为各类型数量（type=end）
+    """
+    db = SessionLocal()
+    try:
+        yield _dumps({"type": "export", **_header(user_id, username), **(header or {})}) + "\n"
+        counts: Dict[str, int] = {}
+        for section, records in iter_export_sections(db, user_id, since, include_deleted):
+            record_type = RECORD_TYPES[section]
+            counts[section] = 0
+            buffer = []
+            for record in records:
+                buffer.append(_dumps({"type": record_type, "data": record}) + "\n")
+                counts[section] += 1
+                if len(buffer) >= EXPORT_BATCH_SIZE:
+                    yield "".join(buffer)
+                    buffer = []
+            if buffer:
+                yield "".join(buffer)
+        yield _dumps({"type": "end", "counts": counts}) + "\n"
+    finally:
+        db.close()
+
+def build_export(
+    db: Session,
+    user_id: int,
+    username: str,
+    since: Optional[datetime] = None,
+    include_deleted: bool = False
+) -> dict:
+    """构建完整的导出字典（MessagePack 响应需要整体编码时使用）"""
+    return {
+        **_header(user_id, username),
+        "data": {
+            section: list(records)
+            for section, records in iter_export_sections(db, user_id, since, include_deleted)
+        }
+    }
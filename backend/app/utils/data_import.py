@@ -0,0 +1,497 @@
+"""
+用户数据导入
+上传内容边解析边分块写入暂存表，整理父子关系并预先计算子树汇总后，
+在一个短事务中用 INSERT ... SELECT 把数据换入正式表，父任务ID按暂存表集合式重映射
+"""
+
+import json
+import uuid
+import zlib
+from collections import namedtuple
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+from app.crud import changes as changes_crud
+from app.crud import manifest as manifest_crud
+from app.crud import todo as todo_crud
+from app.crud.rollup import compute_rollups
+from app.models import models
+from app.utils.fractional_index import keys_after
+from app.utils.sync_codec import parse_datetime
+from app.utils.timestamp_service import hlc_clock
+
+# 每次写入暂存表的行数
+IMPORT_CHUNK_SIZE = 1000
+
+# 文档中的数据键 -> NDJSON 记录类型（与导出格式一致）
+DOCUMENT_KEYS = {"todos": "todo", "comments": "comment", "assignments": "assignment"}
+
+STAGING_MODELS = {
+    "todo": models.ImportStagingTodo,
+    "comment": models.ImportStagingComment,
+    "assignment": models.ImportStagingAssignment,
+}
+
+# 导入时写入、带字段级版本的任务字段
+IMPORTED_FIELDS = ("title", "description", "priority", "category", "due_date", "completed")
+
+_TreeRow = namedtuple("_TreeRow", "id parent_id completed due_date")
+
+class ImportDataError(ValueError):
+    """上传数据格式错误，此时正式数据尚未被修改"""
+
+def iter_document_records(document: Any) -> Iterator[Tuple[str, Any]]:
+    """JSON / MessagePack 文档：{"todos": [...], ...}，或导出接口的完整文档（数据在 data 中）"""
+    if not isinstance(document, dict):
+        raise ImportDataError("导入数据必须是对象")
+    if isinstance(document.get("data"), dict):
+        document = document["data"]
+    for key, record_type in DOCUMENT_KEYS.items():
+        records = document.get(key) or []
+        if not isinstance(records, list):
+            raise ImportDataError(f"{key} 必须是数组")
+        for record in records:
+            yield record_type, record
+
+def _parse_line(line: bytes, line_no: int) -> Optional[Tuple[str, Any]]:
+    if not line.strip():
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise ImportDataError(f"第 {line_no} 行不是有效的JSON")
+    record_type = record.get("type") if isinstance(record, dict) else None
+    # 导出信息、统计行以及共享清单等不导入的类型直接跳过
+    if record_type not in STAGING_MODELS:
+        return None
+    return record_type, record.get("data")
+
+async def iter_ndjson_records(chunks: AsyncIterator[bytes], gzipped: bool = False) -> AsyncIterator[Tuple[str, Any]]:
+    """逐行解析 NDJSON 请求体，每行为 {"type": ..., "data": ...}；gzipped 时边接收边解压"""
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16) if gzipped else None
+    buffer = b""
+    line_no = 0
+    try:
+        async for chunk in chunks:
+            if decompressor:
+                chunk = decompressor.decompress(chunk)
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line_no += 1
+                record = _parse_line(line, line_no)
+                if record:
+                    yield record
+        if decompressor:
+            buffer += decompressor.flush()
+    except zlib.error:
+        raise ImportDataError("gzip 数据无效")
+
+    record = _parse_line(buffer, line_no + 1)
+    if record:
+        yield record
+
+def _optional_int(value: Any) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError("布尔值不是整数")
+    return int(value)
+
+def _naive_utc(value: Any) -> Optional[datetime]:
+    parsed = parse_datetime(value)
+    if parsed is not None and parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _break_cycles(nodes: Dict[int, _TreeRow]) -> Dict[int, _TreeRow]:
+    """从根任务出发无法到达的任务都在环上，按ID顺序逐个断开为根任务"""
+    children: Dict[Optional[int], List[int]] = {}
+    for node in nodes.values():
+        children.setdefault(node.parent_id, []).append(node.id)
+
+    reached = set()
+
+    def visit(root_id: int):
+        stack = [root_id]
+        while stack:
+            node_id = stack.pop()
+            if node_id in reached:
+                continue
+            reached.add(node_id)
+            stack.extend(children.get(node_id, []))
+
+    for node in nodes.values():
+        if node.parent_id is None:
+            visit(node.id)
+    for node_id in sorted(nodes):
+        if node_id not in reached:
+            nodes[node_id] = nodes[node_id]._replace(parent_id=None)
+            visit(node_id)
+    return nodes
+
+class StagedImport:
+    """
+    一次导入的暂存数据：add 校验并分块写入暂存表，prepare 整理树形结构，
+    swap 在一个事务中换入正式表，discard 清理暂存行
+    """
+
+    def __init__(self, db: Session, user_id: int):
+        self.db = db
+        self.user_id = user_id
+        self.import_id = uuid.uuid4().hex
+        self.counts = {"todos": 0, "comments": 0, "assignments": 0}
+        self._buffers: Dict[str, List[dict]] = {record_type: [] for record_type in STAGING_MODELS}
+
+    def add(self, record_type: str, data: Any):
+        if not isinstance(data, dict):
+            raise ImportDataError(f"{record_type} 数据必须是对象")
+        if record_type == "todo":
+            row = self._todo_row(data)
+        elif record_type == "comment":
+            row = self._comment_row(data)
+        else:
+            row = self._assignment_row(data)
+
+        buffer = self._buffers[record_type]
+        buffer.append(row)
+        if len(buffer) >= IMPORT_CHUNK_SIZE:
+            self._flush(record_type)
+
+    def add_all(self, records: Iterable[Tuple[str, Any]]):
+        """逐条暂存 (记录类型, 数据)，写入数据库的部分较慢，在异步接口中放到线程里调用"""
+        for record_type, data in records:
+            self.add(record_type, data)
+
+    def finish(self, clear_existing: bool = False) -> Dict[str, int]:
+        """整理暂存数据并换入正式表，返回各类型实际导入的数量"""
+        self.prepare()
+        return self.swap(clear_existing)
+
+    def flush(self):
+        for record_type in STAGING_MODELS:
+            self._flush(record_type)
+
+    def _flush(self, record_type: str):
+        rows, self._buffers[record_type] = self._buffers[record_type], []
+        if not rows:
+            return
+        # 每块单独提交，解析上传内容期间不持有正式表的写锁
+        try:
+            self.db.execute(insert(STAGING_MODELS[record_type]), rows)
+            self.db.commit()
+        except IntegrityError:
+            self.db.rollback()
+            raise ImportDataError("导入数据中存在重复的任务ID")
+
+    def _todo_row(self, data: dict) -> dict:
+        position = self.counts["todos"] + 1
+        title = data.get("title")
+        if not isinstance(title, str) or not title.strip() or len(title) > 200:
+            raise ImportDataError(f"第 {position} 个任务的标题无效")
+        try:
+            row = {
+                "import_id": self.import_id,
+                "row_no": self.counts["todos"],
+                "source_id": _optional_int(data.get("id")),
+                "source_parent_id": _optional_int(data.get("parent_id")),
+                "title": title,
+                "description": data.get("description"),
+                "priority": models.PriorityEnum(data.get("priority") or models.PriorityEnum.MEDIUM.value),
+                "category": data.get("category") or "默认",
+                "due_date": _naive_utc(data.get("due_date")),
+                "completed": bool(data.get("completed", False)),
+                "version": _optional_int(data.get("version")) or 1,
+            }
+        except (TypeError, ValueError):
+            raise ImportDataError(f"第 {position} 个任务的字段格式无效")
+        self.counts["todos"] += 1
+        return row
+
+    def _comment_row(self, data: dict) -> dict:
+        position = self.counts["comments"] + 1
+        content = data.get("content")
+        try:
+            todo_id = _optional_int(data.get("todo_id"))
+        except (TypeError, ValueError):
+            todo_id = None
+        if todo_id is None or not isinstance(content, str) or not content:
+            raise ImportDataError(f"第 {position} 条评论缺少任务ID或内容")
+        self.counts["comments"] += 1
+        return {"import_id": self.import_id, "source_todo_id": todo_id, "content": content}
+
+    def _assignment_row(self, data: dict) -> dict:
+        position = self.counts["assignments"] + 1
+        try:
+            todo_id = _optional_int(data.get("todo_id"))
+            assigner_id = _optional_int(data.get("assigner_id")) or self.user_id
+            status = models.AssignmentStatusEnum(data.get("status") or models.AssignmentStatusEnum.ASSIGNED.value)
+        except (TypeError, ValueError):
+            raise ImportDataError(f"第 {position} 个任务分配的字段格式无效")
+        if todo_id is None:
+            raise ImportDataError(f"第 {position} 个任务分配缺少任务ID")
+        self.counts["assignments"] += 1
+        return {
+            "import_id": self.import_id,
+            "source_todo_id": todo_id,
+            "assigner_id": assigner_id,
+            "status": status,
+        }
+
+    def prepare(self):
+        """
+        父任务不在本次导入中或成环的任务置为根任务，并按暂存的树形结构算好子树汇总，
+        换入时不再需要逐个调整祖先
+        """
+        self.flush()
+        staging = models.ImportStagingTodo
+        rows = self.db.query(
+            staging.id, staging.row_no, staging.source_id, staging.source_parent_id, staging.completed, staging.due_date
+        ).filter(staging.import_id == self.import_id).order_by(staging.row_no).all()
+
+        by_source = {row.source_id: row.id for row in rows if row.source_id is not None}
+        nodes = _break_cycles({
+            row.id: _TreeRow(row.id, by_source.get(row.source_parent_id), row.completed, row.due_date)
+            for row in rows
+        })
+        source_ids = {row.id: row.source_id for row in rows}
+        rollups = compute_rollups(nodes.values())
+
+        # 同一父任务下的子任务按上传顺序生成排序键，根任务的排序键在换入时生成
+        siblings: Dict[int, List[int]] = {}
+        for row in rows:
+            parent_id = nodes[row.id].parent_id
+            if parent_id is not None:
+                siblings.setdefault(parent_id, []).append(row.id)
+        positions = {
+            row_id: position
+            for row_ids in siblings.values()
+            for row_id, position in zip(row_ids, keys_after(None, len(row_ids)))
+        }
+
+        updates = []
+        for row in rows:
+            count, completed, _, earliest = rollups[row.id]
+            updates.append({
+                "id": row.id,
+                "source_parent_id": source_ids.get(nodes[row.id].parent_id),
+                "position": positions.get(row.id),
+                "descendant_count": count,
+                "completed_descendant_count": completed,
+                "earliest_descendant_due_date": earliest,
+            })
+        for start in range(0, len(updates), IMPORT_CHUNK_SIZE):
+            self.db.execute(update(staging), updates[start:start + IMPORT_CHUNK_SIZE])
+        self.db.commit()
+
+    def swap(self, clear_existing: bool = False) -> Dict[str, int]:
+        """在一个事务中（可选地清空现有数据并）换入暂存数据，返回各类型实际导入的数量"""
+        db = self.db
+        now = datetime.utcnow()
+        if clear_existing:
+            self._clear_existing()
+
+        todo_count = self.counts["todos"]
+        if todo_count:
+            self._position_roots()
+            self._swap_todos(now)
+        comment_count = self._swap_comments(now)
+        assignment_count = self._swap_assignments(now)
+
+        db.commit()
+        return {"todos": todo_count, "comments": comment_count, "assignments": assignment_count}
+
+    def _clear_existing(self):
+        """删除用户现有的任务、评论等（批量删除不经过会话钩子，需显式记录墓碑）"""
+        db = self.db
+        cleared = [
+            (entity_type, entity_id, self.user_id, changes_crud.DELETE)
+            for entity_type, model, owner_column in (
+                ("comment", models.Comment, models.Comment.user_id),
+                ("todo", models.Todo, models.Todo.user_id),
+            )
+            for (entity_id,) in db.query(model.id).filter(owner_column == self.user_id)
+        ]
+        # 分配对分配人同样可见，墓碑也要写入分配人的变更日志，与导入时一致
+        cleared += [
+            ("assignment", assignment_id, user_id, changes_crud.DELETE)
+            for assignment_id, assigner_id in db.query(
+                models.TaskAssignment.id, models.TaskAssignment.assigner_id
+            ).filter(models.TaskAssignment.assignee_id == self.user_id)
+            for user_id in dict.fromkeys((self.user_id, assigner_id))
+        ]
+
+        db.query(models.Comment).filter(models.Comment.user_id == self.user_id).delete(synchronize_session=False)
+        db.query(models.TaskAssignment).filter(
+            models.TaskAssignment.assignee_id == self.user_id
+        ).delete(synchronize_session=False)
+        db.query(models.Todo).filter(models.Todo.user_id == self.user_id).delete(synchronize_session=False)
+
+        changes_crud.record_changes(db, cleared)
+
+    def _position_roots(self):
+        """根任务接在用户现有根任务之后，在换入事务中生成，不会与期间新追加的任务重复"""
+        db = self.db
+        staging = models.ImportStagingTodo
+        root_ids = [
+            row_id for (row_id,) in db.query(staging.id).filter(
+                staging.import_id == self.import_id,
+                staging.source_parent_id.is_(None)
+            ).order_by(staging.row_no)
+        ]
+        last_position = todo_crud.get_siblings_query(db, self.user_id, None).with_entities(
+            func.max(models.Todo.position)
+        ).scalar()
+        db.execute(update(staging), [
+            {"id": row_id, "position": position}
+            for row_id, position in zip(root_ids, keys_after(last_position, len(root_ids)))
+        ])
+
+    def _swap_todos(self, now: datetime):
+        db = self.db
+        staging = models.ImportStagingTodo
+        todo = models.Todo
+        todo_count = self.counts["todos"]
+
+        # 按暂存序号分配连续的变更序号，写入任务的 change_seq 后也用作回填新ID的关联键
+        base = changes_crud.next_change_seq(db, self.user_id, todo_count) - todo_count
+        seq = staging.row_no + (base + 1)
+        in_import = staging.import_id == self.import_id
+        # 导入的字段都记一个字段版本，之后离线修改这些字段时照常做并发检测
+        version = hlc_clock.now()
+        field_versions = json.dumps({field: version for field in IMPORTED_FIELDS}, sort_keys=True)
+
+        db.execute(insert(todo).from_select(
+            [
+                todo.user_id, todo.title, todo.description, todo.priority, todo.category,
+                todo.due_date, todo.completed, todo.version,
+                todo.descendant_count, todo.completed_descendant_count,
+                todo.descendant_hours_spent, todo.earliest_descendant_due_date,
+                todo.position, todo.field_versions,
+                todo.conflict_status, todo.change_seq, todo.created_at, todo.updated_at,
+            ],
+            select(
+                literal(self.user_id), staging.title, staging.description, staging.priority, staging.category,
+                staging.due_date, staging.completed, staging.version,
+                staging.descendant_count, staging.completed_descendant_count,
+                literal(0), staging.earliest_descendant_due_date,
+                staging.position, literal(field_versions),
+                literal("resolved"), seq, literal(now), literal(now),
+            ).where(in_import).order_by(staging.row_no)
+        ))
+
+        db.execute(
+            update(staging).where(in_import).values(
+                new_id=select(todo.id).where(
+                    todo.user_id == self.user_id,
+                    todo.change_seq == seq
+                ).scalar_subquery()
+            ).execution_options(synchronize_session=False)
+        )
+
+        # 集合式重映射父任务：子任务暂存行的 source_parent_id 对应父任务暂存行的新ID
+        child = aliased(staging)
+        parent = aliased(staging)
+        db.execute(
+            update(todo).where(
+                todo.id.in_(select(staging.new_id).where(in_import, staging.source_parent_id.isnot(None)))
+            ).values(
+                parent_id=select(parent.new_id).where(
+                    child.import_id == self.import_id,
+                    child.new_id == todo.id,
+                    parent.import_id == self.import_id,
+                    parent.source_id == child.source_parent_id
+                ).scalar_subquery()
+            ).execution_options(synchronize_session=False)
+        )
+
+        db.execute(insert(models.Change).from_select(
+            [
+                models.Change.seq, models.Change.user_id, models.Change.entity_type,
+                models.Change.entity_id, models.Change.operation, models.Change.created_at,
+            ],
+            select(
+                seq, literal(self.user_id), literal("todo"),
+                staging.new_id, literal(changes_crud.UPSERT), literal(now),
+            ).where(in_import)
+        ))
+        manifest_crud.apply_changes(db, [(self.user_id, "todo", base + todo_count, todo_count)])
+
+    def _resolved_todo_id(self, source_todo_id):
+        """
+        评论和分配引用的任务：优先取本次导入的任务，
+        否则取用户已有的同ID任务，都没有时为空（该行跳过）
+        """
+        staged = aliased(models.ImportStagingTodo)
+        existing = aliased(models.Todo)
+        todo_id = func.coalesce(staged.new_id, existing.id)
+        joins = (
+            (staged, and_(staged.import_id == self.import_id, staged.source_id == source_todo_id)),
+            (existing, and_(existing.id == source_todo_id, existing.user_id == self.user_id)),
+        )
+        return todo_id, joins
+
+    def _swap_comments(self, now: datetime) -> int:
+        staging = models.ImportStagingComment
+        comment = models.Comment
+        todo_id, joins = self._resolved_todo_id(staging.source_todo_id)
+
+        query = select(todo_id, literal(self.user_id), staging.content, literal(now), literal(now)).select_from(staging)
+        for target, condition in joins:
+            query = query.outerjoin(target, condition)
+        query = query.where(staging.import_id == self.import_id, todo_id.isnot(None)).order_by(staging.id)
+
+        comment_ids = self.db.execute(
+            insert(comment).from_select(
+                [comment.todo_id, comment.user_id, comment.content, comment.created_at, comment.updated_at],
+                query
+            ).returning(comment.id)
+        ).scalars().all()
+
+        # 导入的评论都在用户自己的任务上，只对该用户可见
+        changes_crud.record_changes(self.db, [
+            ("comment", comment_id, self.user_id, changes_crud.UPSERT) for comment_id in comment_ids
+        ], created=True)
+        return len(comment_ids)
+
+    def _swap_assignments(self, now: datetime) -> int:
+        staging = models.ImportStagingAssignment
+        assignment = models.TaskAssignment
+        todo_id, joins = self._resolved_todo_id(staging.source_todo_id)
+
+        query = select(
+            todo_id, staging.assigner_id, literal(self.user_id), staging.status, literal(now)
+        ).select_from(staging)
+        for target, condition in joins:
+            query = query.outerjoin(target, condition)
+        query = query.where(
+            staging.import_id == self.import_id,
+            todo_id.isnot(None),
+            staging.assigner_id.in_(select(models.User.id))
+        ).order_by(staging.id)
+
+        rows = self.db.execute(
+            insert(assignment).from_select(
+                [assignment.todo_id, assignment.assigner_id, assignment.assignee_id, assignment.status, assignment.assigned_at],
+                query
+            ).returning(assignment.id, assignment.assigner_id)
+        ).all()
+
+        # 分配对任务所有者（即导入用户）和分配者可见
+        changes_crud.record_changes(self.db, [
+            ("assignment", assignment_id, user_id, changes_crud.UPSERT)
+            for assignment_id, assigner_id in rows
+            for user_id in dict.fromkeys((self.user_id, assigner_id))
+        ], created=True)
+        return len(rows)
+
+    def discard(self):
+        """清理本次导入的暂存行"""
+        self.db.rollback()
+        for model in STAGING_MODELS.values():
+            self.db.query(model).filter(model.import_id == self.import_id).delete(synchronize_session=False)
+        self.db.commit()
@@ -0,0 +1,166 @@
+"""
+数据导出快照
+在独立进程中把用户数据以 gzip 压缩的 NDJSON 写入文件，按用户最新变更序号复用，
+下载时支持 HTTP Range，中断的下载可以从已接收的位置继续
+"""
+
+import gzip
+import multiprocessing
+import os
+import re
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from typing import Iterator, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.crud import export_snapshot as export_snapshot_crud
+from app.models.models import ExportSnapshot
+from app.utils.data_export import iter_export_ndjson
+
+SNAPSHOT_MEDIA_TYPE = "application/gzip"
+READ_CHUNK_SIZE = 64 * 1024
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def snapshot_path(user_id: int, change_seq: int) -> str:
+    return os.path.join(settings.EXPORT_SNAPSHOT_DIR, f"user-{user_id}-{change_seq}.ndjson.gz")
+
+def snapshot_etag(snapshot: ExportSnapshot) -> str:
+    return f'"{snapshot.user_id}-{snapshot.change_seq}"'
+
+def write_snapshot(user_id: int, username: str, change_seq: int, path: str) -> int:
+    """在子进程中执行：写入临时文件后原子替换，返回文件大小"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with gzip.open(temp_path, "wt", encoding="utf-8", compresslevel=6) as output:
+            for chunk in iter_export_ndjson(user_id, username, include_deleted=True, header={"change_seq": change_seq}):
+                output.write(chunk)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return os.path.getsize(path)
+
+class SnapshotExporter:
+    """快照生成进程池，压缩和序列化不占用接口进程的事件循环与 GIL"""
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers if workers is not None else settings.EXPORT_SNAPSHOT_WORKERS
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def submit(self, snapshot: ExportSnapshot, username: str):
+        """提交生成任务，完成后在回调线程中更新快照记录"""
+        if self._executor is None:
+            # spawn 启动的子进程重新创建数据库连接，不继承父进程的连接和线程
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        path = snapshot_path(snapshot.user_id, snapshot.change_seq)
+        future = self._executor.submit(write_snapshot, snapshot.user_id, username, snapshot.change_seq, path)
+        future.add_done_callback(partial(self._finish, snapshot.id, snapshot.user_id, snapshot.change_seq, path))
+
+    def shutdown(self):
+        """停止进程池，未开始的任务标记为失败，下次请求时重新生成"""
+        executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _finish(snapshot_id: int, user_id: int, change_seq: int, path: str, future: Future):
+        db = SessionLocal()
+        try:
+            if future.cancelled():
+                export_snapshot_crud.fail_snapshot(db, snapshot_id, "服务停止，快照未生成")
+                return
+            error = future.exception()
+            if error is not None:
+                print(f"导出快照 {snapshot_id} 生成失败: {error}")
+                export_snapshot_crud.fail_snapshot(db, snapshot_id, str(error))
+                return
+            export_snapshot_crud.complete_snapshot(db, snapshot_id, path, future.result())
+            # 新快照可用后清理该用户的旧快照
+            for old_path in export_snapshot_crud.remove_older_snapshots(db, user_id, change_seq):
+                if old_path != path and os.path.exists(old_path):
+                    os.remove(old_path)
+        except Exception as e:
+            print(f"更新导出快照 {snapshot_id} 状态失败: {e}")
+        finally:
+            db.close()
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单个 bytes 区间，返回闭区间 (start, end)；
+    没有 Range 头或为多区间时返回 None（返回整个文件），区间无法满足时抛出 ValueError
+    """
+    if not header:
+        return None
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # bytes=-N 表示最后 N 个字节
+        length = int(end)
+        if length == 0:
+            raise ValueError("区间为空")
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("区间超出文件范围")
+    return start, end
+
+def _iter_file(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as source:
+        source.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = source.read(min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def snapshot_response(request: Request, snapshot: ExportSnapshot) -> Response:
+    """按 Range / If-Range 返回快照文件的全部或部分内容"""
+    size = os.path.getsize(snapshot.file_path)
+    etag = snapshot_etag(snapshot)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="{os.path.basename(snapshot.file_path)}"',
+    }
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    # If-Range 与当前快照不一致时说明客户端已接收的部分属于旧快照，返回整个文件
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(
+        _iter_file(snapshot.file_path, start, end - start + 1),
+        status_code=status_code,
+        media_type=SNAPSHOT_MEDIA_TYPE,
+        headers=headers
+    )
+
+snapshot_exporter = SnapshotExporter()
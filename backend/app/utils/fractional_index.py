@@ -0,0 +1,146 @@
+"""
+分数索引（字典序排序键）
+为同级任务生成可以插入到任意两个键之间的字符串排序键，
+移动一个任务只需改写该任务自身的 position，不需要重排兄弟节点
+
+键由“整数部分 + 小数部分”组成：
+- 整数部分首字母表示位数（a-z 为正数 2-27 位，A-Z 为负数），追加/前插时只递增/递减整数，键长按对数增长
+- 小数部分用于在两个相邻键之间插入，不以最小数字结尾
+"""
+
+from typing import List, Optional
+
+# 按ASCII顺序排列的62进制数字，保证字符串比较与数值比较一致
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+_INDEX = {ch: i for i, ch in enumerate(DIGITS)}
+
+# 最小的整数部分，无法再递减
+_SMALLEST_INTEGER = "A" + DIGITS[0] * 26
+_FIRST_KEY = "a" + DIGITS[0]
+
+def _midpoint(a: str, b: Optional[str]) -> str:
+    """返回严格位于小数部分 a 与 b 之间的最短小数，b 为 None 表示上界为1"""
+    if b is not None:
+        # 跳过公共前缀（a 较短时视为补最小数字）
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else DIGITS[0]) == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+
+    digit_a = _INDEX[a[0]] if a else 0
+    digit_b = _INDEX[b[0]] if b is not None else len(DIGITS)
+
+    if digit_b - digit_a > 1:
+        return DIGITS[(digit_a + digit_b) // 2]
+
+    # 首位相邻
+    if b is not None and len(b) > 1:
+        return b[0]
+    return DIGITS[digit_a] + _midpoint(a[1:], None)
+
+def _integer_length(head: str) -> int:
+    if "a" <= head <= "z":
+        return ord(head) - ord("a") + 2
+    if "A" <= head <= "Z":
+        return ord("Z") - ord(head) + 2
+    raise ValueError(f"无效的排序键首字符: {head}")
+
+def _split(key: str):
+    integer = key[:_integer_length(key[0])]
+    return integer, key[len(integer):]
+
+def _increment_integer(integer: str) -> Optional[str]:
+    head, digits = integer[0], list(integer[1:])
+    for i in reversed(range(len(digits))):
+        value = _INDEX[digits[i]] + 1
+        if value < len(DIGITS):
+            digits[i] = DIGITS[value]
+            return head + "".join(digits)
+        digits[i] = DIGITS[0]
+
+    # 进位到首字母
+    if head == "Z":
+        return "a" + DIGITS[0]
+    if head == "z":
+        return None
+    new_head = chr(ord(head) + 1)
+    if new_head > "a":
+        digits.append(DIGITS[0])
+    else:
+        digits.pop()
+    return new_head + "".join(digits)
+
+def _decrement_integer(integer: str) -> Optional[str]:
+    head, digits = integer[0], list(integer[1:])
+    for i in reversed(range(len(digits))):
+        value = _INDEX[digits[i]] - 1
+        if value >= 0:
+            digits[i] = DIGITS[value]
+            return head + "".join(digits)
+        digits[i] = DIGITS[-1]
+
+    # 借位到首字母
+    if head == "a":
+        return "Z" + DIGITS[-1]
+    if head == "A":
+        return None
+    new_head = chr(ord(head) - 1)
+    if new_head < "Z":
+        digits.append(DIGITS[-1])
+    else:
+        digits.pop()
+    return new_head + "".join(digits)
+
+def validate_key(key: str) -> bool:
+    """检查键是否为合法的排序键"""
+    if not key or key == _SMALLEST_INTEGER or any(ch not in _INDEX for ch in key):
+        return False
+    try:
+        integer, fraction = _split(key)
+    except ValueError:
+        return False
+    return len(integer) == _integer_length(key[0]) and not fraction.endswith(DIGITS[0])
+
+def key_between(a: Optional[str], b: Optional[str]) -> str:
+    """
+    生成严格位于 a 与 b 之间的键
+    a 为 None 表示插到最前，b 为 None 表示追加到最后
+    """
+    if a is not None and b is not None and a >= b:
+        raise ValueError(f"排序键顺序错误: {a} >= {b}")
+
+    if a is None:
+        if b is None:
+            return _FIRST_KEY
+        integer_b, fraction_b = _split(b)
+        if integer_b == _SMALLEST_INTEGER:
+            return integer_b + _midpoint("", fraction_b)
+        if integer_b < b:
+            return integer_b
+        result = _decrement_integer(integer_b)
+        if result is None:
+            raise ValueError("排序键已无法继续前插")
+        return result
+
+    if b is None:
+        integer_a, fraction_a = _split(a)
+        result = _increment_integer(integer_a)
+        return integer_a + _midpoint(fraction_a, None) if result is None else result
+
+    integer_a, fraction_a = _split(a)
+    integer_b, fraction_b = _split(b)
+    if integer_a == integer_b:
+        return integer_a + _midpoint(fraction_a, fraction_b)
+    result = _increment_integer(integer_a)
+    if result is not None and result < b:
+        return result
+    return integer_a + _midpoint(fraction_a, None)
+
+def keys_after(a: Optional[str], count: int) -> List[str]:
+    """在 a 之后连续生成 count 个递增的键（用于批量追加和回填）"""
+    keys = []
+    for _ in range(count):
+        a = key_between(a, None)
+        keys.append(a)
+    return keys
@@ -4,11 +4,14 @@
 """
 
 import asyncio
+import time
 from typing import List, Dict, Optional, Callable
 from datetime import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import logging
 
+from app.utils.merkle import build_buckets, root_hash
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -29,11 +32,39 @@ class FullSyncProgress:
     total_pages: int = 0
     percentage: float = 0.0
     is_background: bool = True
+    entity_pages: Dict[str, int] = field(default_factory=dict)  # 各实体已写入的页数（多个实体并发同步）
+
+class TokenBucket:
+    """令牌桶限流：平均每秒 rate 个请求，最多允许 capacity 个请求突发"""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self, tokens: float = 1.0):
+        """取得令牌，不足时等待补充；等待者按到达顺序依次获得"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
 
 class FullDataSyncService:
     """全量数据同步服务"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        max_concurrency: int = 3,
+        background_rate: float = 10.0,
+        background_burst: float = 2.0
+    ):
         self.entities = [
             SyncEntity("todos", "/api/todos", "todos", 50),
             SyncEntity("comments", "/api/comments", "comments", 100),
@@ -57,6 +88,13 @@ class FullDataSyncService:
         
         self.is_syncing = False
         self.background_sync_task = None
+        
+        # 同时拉取的实体类型数量上限
+        self.max_concurrency = max_concurrency
+        # 后台同步时所有请求共享的限流（每秒请求数和突发数），前台同步不限流
+        self.background_rate = background_rate
+        self.background_burst = background_burst
+        self.rate_limiter: Optional[TokenBucket] = None
     
     def add_callback(self, event_type: str, callback: Callable):
         """添加事件回调"""
@@ -84,6 +122,7 @@ class FullDataSyncService:
         
         self.is_syncing = True
         self.progress.is_background = background
+        self.rate_limiter = TokenBucket(self.background_rate, self.background_burst) if background else None
         
         try:
             if not incremental_only:
@@ -110,36 +149,54 @@ class FullDataSyncService:
             logger.info(f"已清空本地 {entity.entity_type} 数据")
     
     async def _execute_sync(self, api_client, local_storage):
-        """执行同步逻辑"""
-        for i, entity in enumerate(self.entities):
-            if not self.is_syncing:  # 允许中断
-                break
-            
-            self.progress.current_entity = entity.entity_type
-            self.progress.current_page = 0
-            self.progress.total_pages = 0
-            
-            self._notify_entity_start(entity.entity_type)
-            
-            try:
-                await self._sync_entity(entity, api_client, local_storage)
-                self.progress.completed_entities = i + 1
-                self.progress.percentage = (i + 1) / len(self.entities) * 100
+        """执行同步逻辑：各实体类型互不依赖，在并发上限内同时拉取"""
+        self.progress.completed_entities = 0
+        self.progress.percentage = 0.0
+        self.progress.entity_pages = {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def sync_one(entity: SyncEntity):
+            async with semaphore:
+                if not self.is_syncing:  # 允许中断
+                    return
+                
+                self.progress.current_entity = entity.entity_type
+                self._notify_entity_start(entity.entity_type)
+                
+                try:
+                    await self._sync_entity(entity, api_client, local_storage)
+                except Exception as e:
+                    logger.error(f"同步实体 {entity.entity_type} 失败: {e}")
+                    # 继续同步其他实体
+                    return
+                
+                self.progress.completed_entities += 1
+                self.progress.percentage = self.progress.completed_entities / len(self.entities) * 100
                 
                 self._notify_entity_complete(entity.entity_type)
                 self._notify_progress()
-                
-            except Exception as e:
-                logger.error(f"同步实体 {entity.entity_type} 失败: {e}")
-                # 继续同步其他实体
-                continue
+        
+        await asyncio.gather(*(sync_one(entity) for entity in self.entities))
     
     async def _sync_entity(self, entity: SyncEntity, api_client, local_storage):
-        """同步单个实体"""
-        all_data = []
+        """
+        同步单个实体，每页到达即写入本地存储。
+        本地存储提供 appendItems 时逐页追加，不在内存中累积全部数据；
+        否则只能整体写入，仍在最后一次 setItem
+        """
+        append = getattr(local_storage, "appendItems", None)
+        pending = []
+        total = 0
         page = 1
         
-        while True:
+        if append:
+            # 逐页追加前先清掉旧数据，避免与上一次同步的结果重复
+            await local_storage.removeItem(entity.local_store_key)
+        
+        while self.is_syncing:
+            if self.rate_limiter:
+                await self.rate_limiter.acquire()
+            
             # 分页获取数据
             response = await api_client.get(
                 f"{entity.endpoint}?page={page}&size={entity.batch_size}"
@@ -154,11 +211,17 @@ class FullDataSyncService:
             if not items:
                 break
             
-            all_data.extend(items)
+            if append:
+                await append(entity.local_store_key, items)
+            else:
+                pending.extend(items)
+            total += len(items)
             
             # 更新进度
+            self.progress.current_entity = entity.entity_type
             self.progress.current_page = page
-            self.progress.total_pages = data.get('total_pages', page)
+            self.progress.total_pages = data.get('total_pages', page) if isinstance(data, dict) else page
+            self.progress.entity_pages[entity.entity_type] = page
             self._notify_progress()
             
             # 如果是最后一页，跳出循环
@@ -166,14 +229,36 @@ class FullDataSyncService:
                 break
                 
             page += 1
-            
-            # 后台同步时添加延迟，避免影响其他操作
-            if self.progress.is_background:
-                await asyncio.sleep(0.1)  # 100ms延迟
         
-        # 保存到本地存储
-        await local_storage.setItem(entity.local_store_key, all_data)
-        logger.info(f"已同步 {len(all_data)} 条 {entity.entity_type} 数据")
+        if not append:
+            await local_storage.setItem(entity.local_store_key, pending)
+        logger.info(f"已同步 {total} 条 {entity.entity_type} 数据")
+    
+    async def verify_local_cache(self, api_client, local_storage) -> List[dict]:
+        """
+        用任务哈希树校验本地任务缓存，返回与服务端不一致的桶，为空表示缓存与服务端一致。
+        只上传本地算出的根哈希和各桶哈希，缓存未变化时请求和响应都只有几KB
+        """
+        entity = next(entity for entity in self.entities if entity.entity_type == "todos")
+        todos = await local_storage.getItem(entity.local_store_key) or []
+        buckets = {
+            bucket: bucket_hash
+            for bucket, (bucket_hash, _) in build_buckets(
+                (todo["id"], todo.get("change_seq")) for todo in todos
+            ).items()
+        }
+        
+        response = await api_client.post("/api/full-sync/merkle/diff", json={
+            "root": root_hash(buckets),
+            "buckets": buckets
+        })
+        if response.status_code != 200:
+            raise Exception(f"校验本地缓存失败: {response.status_code}")
+        
+        differing = response.json().get("buckets", [])
+        if differing:
+            logger.info(f"本地任务缓存有 {len(differing)} 个桶与服务端不一致")
+        return differing
     
     def cancel_sync(self):
         """取消同步"""
@@ -236,15 +321,19 @@ class IncrementalSyncScheduler:
         self.full_sync_service = full_sync_service
         self.last_sync_time = None
         self.sync_interval = 300  # 5分钟检查一次
+        self.manifest_endpoint = "/api/full-sync/manifest"
+        self.last_manifest_digest: Optional[str] = None  # 上次同步完成时服务端清单的摘要
+        self._pending_manifest_digest: Optional[str] = None
     
     async def schedule_incremental_sync(self, api_client, local_storage):
         """调度增量同步"""
         while True:
             try:
                 # 检查是否需要同步
-                if await self._should_sync():
+                if await self._should_sync(api_client):
                     # 执行增量同步而不是全量同步
                     await self._perform_incremental_sync(api_client, local_storage)
+                    self.last_manifest_digest = self._pending_manifest_digest
                 
                 await asyncio.sleep(self.sync_interval)
                 
@@ -252,8 +341,24 @@ class IncrementalSyncScheduler:
                 logger.error(f"增量同步调度失败: {e}")
                 await asyncio.sleep(60)  # 出错后等待1分钟再重试
     
-    async def _should_sync(self) -> bool:
-        """判断是否需要同步"""
+    async def _should_sync(self, api_client=None) -> bool:
+        """
+        判断是否需要同步：先读取服务端同步清单，摘要与上次同步时相同说明没有任何变化，
+        跳过本次同步；清单不可用时退回按时间间隔判断
+        """
+        if api_client is not None:
+            try:
+                headers = {"If-None-Match": f'"{self.last_manifest_digest}"'} if self.last_manifest_digest else None
+                response = await api_client.get(self.manifest_endpoint, headers=headers)
+                if response.status_code == 304:
+                    return False
+                if response.status_code == 200:
+                    self._pending_manifest_digest = response.json().get("digest")
+                    return self._pending_manifest_digest != self.last_manifest_digest
+            except Exception as e:
+                logger.warning(f"获取同步清单失败，按时间间隔判断: {e}")
+        
+        self._pending_manifest_digest = None
         if not self.last_sync_time:
             return True
         
@@ -314,16 +419,19 @@ async def demo_full_sync():
             await asyncio.sleep(0.1)  # 模拟网络延迟
             return type('Response', (), {
                 'status_code': 200,
-                'json': lambda: {
+                'json': staticmethod(lambda: {
                     'items': [{'id': i, 'title': f'Item {i}'} for i in range(10)],
                     'total_pages': 1
-                }
+                })
             })()
     
     class MockLocalStorage:
         async def setItem(self, key, value):
             print(f"  保存 {len(value)} 条 {key} 数据到本地")
         
+        async def appendItems(self, key, items):
+            print(f"  追加 {len(items)} 条 {key} 数据到本地")
+        
         async def removeItem(self, key):
             print(f"  清空本地 {key} 数据")
     
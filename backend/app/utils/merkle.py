@@ -0,0 +1,46 @@
+"""
+任务缓存校验用的哈希树
+用户的任务按ID的散列值分到固定数量的桶中，每个叶子为 (id, change_seq)，
+桶哈希由桶内叶子算出，根哈希由全部桶哈希算出。
+change_seq 由变更捕获在任务的每次写入（包括批量语句和导入）时更新，任何修改都会改变叶子。
+算法不依赖数据库，服务端与客户端共用，客户端据此计算本地缓存的桶哈希后与服务端比对
+"""
+
+import hashlib
+from typing import Dict, Iterable, List, Tuple
+
+# 桶的数量（2 的幂），修改后已保存的桶哈希全部失效
+FANOUT = 128
+
+# 乘法散列：ID 乘以黄金分割常数后取低32位的最高 log2(FANOUT) 位作为桶编号，
+# 不同用户的ID交错分配时，每个用户的任务仍均匀分布在全部桶中
+HASH_MULTIPLIER = 2654435761
+HASH_SHIFT = 32 - (FANOUT.bit_length() - 1)
+
+def bucket_of(entity_id: int) -> int:
+    return (entity_id * HASH_MULTIPLIER % 2 ** 32) >> HASH_SHIFT
+
+def bucket_expression(id_column):
+    """与 bucket_of 相同的SQL表达式，用于在数据库中按桶筛选"""
+    return id_column * HASH_MULTIPLIER % 2 ** 32 // 2 ** HASH_SHIFT
+
+def bucket_hash(leaves: Iterable[Tuple[int, int]]) -> str:
+    """桶内叶子按ID排序后逐行拼接 "id:change_seq"（没有序号的旧数据记为0），取 sha256 的前16位"""
+    content = "\n".join(f"{entity_id}:{change_seq or 0}" for entity_id, change_seq in sorted(leaves))
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+def root_hash(buckets: Dict[int, str]) -> str:
+    """非空桶按编号排序后逐行拼接 "bucket:hash"，取 sha256 的前32位"""
+    content = "\n".join(f"{bucket}:{buckets[bucket]}" for bucket in sorted(buckets))
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+def build_buckets(leaves: Iterable[Tuple[int, int]]) -> Dict[int, Tuple[str, int]]:
+    """由全部叶子计算 {桶编号: (桶哈希, 叶子数)}，空桶不出现在结果中"""
+    grouped: Dict[int, List[Tuple[int, int]]] = {}
+    for entity_id, change_seq in leaves:
+        grouped.setdefault(bucket_of(entity_id), []).append((entity_id, change_seq))
+    return {bucket: (bucket_hash(items), len(items)) for bucket, items in grouped.items()}
+
+def diff_buckets(server: Dict[int, str], client: Dict[int, str]) -> List[int]:
+    """两侧哈希不同的桶，包括只有一侧存在的桶"""
+    return sorted(bucket for bucket in set(server) | set(client) if server.get(bucket) != client.get(bucket))
@@ -5,6 +5,7 @@
 
 import asyncio
 import math
+import time
 from typing import List, Dict, Callable, Optional
 from datetime import datetime
 from dataclasses import dataclass
@@ -28,17 +29,81 @@ class SyncProgress:
     percentage: float
     estimated_time: Optional[float] = None
     speed: Optional[float] = None  # items/second
+    batch_size: Optional[int] = None  # 控制器当前选择的批次大小
+    concurrency: Optional[int] = None  # 控制器当前选择的并发数
+    batch_latency: Optional[float] = None  # 最近一批的耗时（秒）
+
+@dataclass
+class SyncCheckpoint:
+    """检查点：从头开始连续处理完成的最后一批"""
+    batch_id: int = 0
+    completed_items: int = 0
+    last_item_id: Optional[int] = None  # 该批最后一项的ID（项目按ID升序排列）
+
+@dataclass
+class AdaptiveBatchController:
+    """
+    AIMD 控制器：按每批耗时和错误率调整批次大小与并发数。
+    批次在目标耗时内完成且错误率不超限时加法增大，否则乘法减小并短暂退避，
+    快的数据库逐步放开吞吐，慢的数据库迅速降载。
+    并发数只用于逐项处理（process_item_func）；整批处理时批次依次执行，只有批次大小生效
+    """
+    batch_size: int = 50
+    concurrency: int = 10
+    min_batch_size: int = 10
+    max_batch_size: int = 1000
+    min_concurrency: int = 1
+    max_concurrency: int = 32
+    target_latency: float = 0.5  # 每批目标耗时（秒）
+    max_error_rate: float = 0.05
+    batch_size_step: int = 10  # 加法增量
+    decrease_factor: float = 0.5  # 乘法减小系数
+    backoff: float = 0.0  # 下一批开始前的等待（秒），只在减小后非零
+    
+    def __post_init__(self):
+        self.batch_size = self._clamp(self.batch_size, self.min_batch_size, self.max_batch_size)
+        self.concurrency = self._clamp(self.concurrency, self.min_concurrency, self.max_concurrency)
+    
+    def record(self, latency: float, items: int, errors: int):
+        """记录一批的结果并调整下一批的参数"""
+        error_rate = errors / items if items else 0.0
+        if error_rate > self.max_error_rate or latency > self.target_latency:
+            self.batch_size = self._clamp(
+                int(self.batch_size * self.decrease_factor), self.min_batch_size, self.max_batch_size
+            )
+            self.concurrency = self._clamp(
+                int(self.concurrency * self.decrease_factor), self.min_concurrency, self.max_concurrency
+            )
+            # 过载时让数据库喘口气，等待时间不超过目标耗时
+            self.backoff = min(latency, self.target_latency)
+        else:
+            self.batch_size = self._clamp(
+                self.batch_size + self.batch_size_step, self.min_batch_size, self.max_batch_size
+            )
+            self.concurrency = self._clamp(
+                self.concurrency + 1, self.min_concurrency, self.max_concurrency
+            )
+            self.backoff = 0.0
+    
+    @staticmethod
+    def _clamp(value: int, lower: int, upper: int) -> int:
+        return max(lower, min(upper, value))
 
 class ProgressiveSyncService:
     """渐进式同步服务"""
     
-    def __init__(self, batch_size: int = 50):
-        self.batch_size = batch_size
+    def __init__(self, batch_size: int = 50, controller: Optional[AdaptiveBatchController] = None):
+        self.controller = controller or AdaptiveBatchController(batch_size=batch_size)
         self.progress_callbacks: List[Callable] = []
         self.completion_callbacks: List[Callable] = []
         self.error_callbacks: List[Callable] = []
         self.is_syncing = False
         self.current_progress = None
+        self.checkpoint: Optional[SyncCheckpoint] = None
+    
+    @property
+    def batch_size(self) -> int:
+        return self.controller.batch_size
     
     def add_progress_listener(self, callback: Callable):
         """添加进度监听器"""
@@ -55,59 +120,104 @@ class ProgressiveSyncService:
     async def sync_large_dataset(
         self, 
         data_items: List[Dict], 
-        process_item_func: Callable,
-        delay_between_batches: float = 0.1
+        process_item_func: Optional[Callable] = None,
+        delay_between_batches: float = 0.0,
+        process_batch_func: Optional[Callable] = None,
+        resume_from: Optional[SyncCheckpoint] = None
     ):
-        """同步大数据集"""
+        """
+        同步大数据集，批次大小和批内并发数由控制器按每批耗时和错误率自适应调整
+        process_item_func 逐项处理（批内最多 concurrency 项同时进行）；
+        提供 process_batch_func 时改为每批调用一次（传入整批项目），批次按顺序依次执行，不使用并发数。
+        process_batch_func 可以返回本批中失败或冲突的项目数，与批次异常一起计入控制器的错误率
+        delay_between_batches 为批次间的固定最小间隔，默认不等待，过载时由控制器退避
+        resume_from 为上次中断时的检查点，data_items 只需包含检查点之后剩余的项目，
+        批次号和已完成数量从检查点继续累计
+        """
         if self.is_syncing:
             raise RuntimeError("同步已在进行中")
+        if process_item_func is None and process_batch_func is None:
+            raise ValueError("需要提供 process_item_func 或 process_batch_func")
         
         self.is_syncing = True
         start_time = datetime.now()
+        controller = self.controller
+        # 整批处理时批次依次执行（同一任务的操作必须按顺序应用），并发数固定为1
+        concurrency = (lambda: 1) if process_batch_func is not None else (lambda: controller.concurrency)
+        
+        resume_from = resume_from or SyncCheckpoint()
+        self.checkpoint = resume_from
+        # 检查点只在从头开始连续成功的批次之后推进，中间有批次失败时停在失败之前
+        contiguous = True
         
         try:
-            # 计算批次信息
             total_items = len(data_items)
-            total_batches = math.ceil(total_items / self.batch_size)
             
             # 初始化进度
             self.current_progress = SyncProgress(
-                total_items=total_items,
-                completed_items=0,
-                current_batch=0,
-                total_batches=total_batches,
-                percentage=0.0
+                total_items=resume_from.completed_items + total_items,
+                completed_items=resume_from.completed_items,
+                current_batch=resume_from.batch_id,
+                total_batches=resume_from.batch_id + math.ceil(total_items / controller.batch_size),
+                percentage=0.0,
+                batch_size=controller.batch_size,
+                concurrency=concurrency()
             )
             
             self._notify_progress()
             
-            # 分批处理
-            for batch_index in range(total_batches):
+            # 分批处理，每批的大小由控制器决定
+            start_idx = 0
+            batch_index = resume_from.batch_id
+            while start_idx < total_items:
                 if not self.is_syncing:  # 允许中断
                     break
                 
-                # 计算当前批次
-                start_idx = batch_index * self.batch_size
-                end_idx = min(start_idx + self.batch_size, total_items)
+                end_idx = min(start_idx + controller.batch_size, total_items)
                 batch_items = data_items[start_idx:end_idx]
+                start_idx = end_idx
+                batch_index += 1
                 
                 batch = SyncBatch(
-                    batch_id=batch_index + 1,
+                    batch_id=batch_index,
                     items=batch_items,
                     total_items=len(batch_items),
                     status="processing"
                 )
                 
                 # 更新进度
-                self.current_progress.current_batch = batch_index + 1
+                self.current_progress.current_batch = batch_index
                 self._notify_progress()
                 
                 # 处理当前批次
+                batch_start = time.perf_counter()
+                failed_items = 0  # 已处理但结果为失败或冲突的项目
                 try:
-                    await self._process_batch(batch, process_item_func)
-                    
+                    if process_batch_func is not None:
+                        failed_items = await process_batch_func(batch.items) or 0
+                        batch.processed = len(batch.items)
+                    else:
+                        await self._process_batch(batch, process_item_func, controller.concurrency)
+                    batch.status = "completed"
+                except Exception as e:
+                    batch.status = "failed"
+                    self._notify_error(f"批次 {batch.batch_id} 处理失败: {str(e)}")
+                    # 继续处理下一个批次而不是中断整个同步
+                
+                latency = time.perf_counter() - batch_start
+                controller.record(latency, batch.total_items, batch.total_items - batch.processed + failed_items)
+                
+                if batch.status == "completed":
                     # 更新总体进度
                     self.current_progress.completed_items += len(batch_items)
+                    # 逐项处理时批内有项目失败，检查点同样不能越过该批
+                    contiguous = contiguous and batch.processed == batch.total_items
+                    if contiguous:
+                        self.checkpoint = SyncCheckpoint(
+                            batch_id=batch_index,
+                            completed_items=self.checkpoint.completed_items + len(batch_items),
+                            last_item_id=batch_items[-1].get("id")
+                        )
                     self.current_progress.percentage = (
                         self.current_progress.completed_items / self.current_progress.total_items
                     ) * 100
@@ -115,23 +225,26 @@ class ProgressiveSyncService:
                     # 计算速度和预计剩余时间
                     elapsed_time = (datetime.now() - start_time).total_seconds()
                     if elapsed_time > 0:
-                        speed = self.current_progress.completed_items / elapsed_time
+                        speed = (self.current_progress.completed_items - resume_from.completed_items) / elapsed_time
                         self.current_progress.speed = speed
                         remaining_items = self.current_progress.total_items - self.current_progress.completed_items
                         self.current_progress.estimated_time = remaining_items / speed if speed > 0 else None
-                    
-                    batch.status = "completed"
-                    self._notify_progress()
-                    
-                    # 批次间短暂延迟，避免UI阻塞
-                    if batch_index < total_batches - 1:  # 不是最后一个批次
-                        await asyncio.sleep(delay_between_batches)
-                        
-                except Exception as e:
-                    batch.status = "failed"
-                    self._notify_error(f"批次 {batch.batch_id} 处理失败: {str(e)}")
-                    # 继续处理下一个批次而不是中断整个同步
-                    continue
+                else:
+                    contiguous = False
+                
+                self.current_progress.batch_latency = latency
+                self.current_progress.batch_size = controller.batch_size
+                self.current_progress.concurrency = concurrency()
+                self.current_progress.total_batches = batch_index + math.ceil(
+                    (total_items - start_idx) / controller.batch_size
+                )
+                self._notify_progress()
+                
+                # 批次间等待：过载退避或调用方指定的最小间隔
+                if start_idx < total_items:
+                    delay = max(controller.backoff, delay_between_batches)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
             
             # 同步完成
             self.is_syncing = False
@@ -144,9 +257,9 @@ class ProgressiveSyncService:
             self.is_syncing = False
             self._notify_error(f"同步过程中发生错误: {str(e)}")
     
-    async def _process_batch(self, batch: SyncBatch, process_item_func: Callable):
-        """处理单个批次"""
-        semaphore = asyncio.Semaphore(10)  # 限制并发数
+    async def _process_batch(self, batch: SyncBatch, process_item_func: Callable, concurrency: int):
+        """处理单个批次，批内最多 concurrency 项同时进行"""
+        semaphore = asyncio.Semaphore(concurrency)  # 限制并发数
         
         async def process_single_item(item):
             async with semaphore:
@@ -194,58 +307,6 @@ class ProgressiveSyncService:
             except Exception as e:
                 print(f"错误回调错误: {e}")
 
-class BatchUpdateManager:
-    """批量更新管理器"""
-    
-    def __init__(self):
-        self.pending_updates = []
-        self.is_processing = False
-        self.update_interval = 100  # 毫秒
-        self.max_batch_size = 100
-    
-    def queue_update(self, update_data: Dict):
-        """排队更新"""
-        self.pending_updates.append(update_data)
-        
-        # 如果不是正在处理且队列达到阈值，则开始处理
-        if not self.is_processing and len(self.pending_updates) >= self.max_batch_size:
-            asyncio.create_task(self._process_updates())
-    
-    async def _process_updates(self):
-        """处理排队的更新"""
-        if self.is_processing:
-            return
-            
-        self.is_processing = True
-        
-        try:
-            while self.pending_updates:
-                # 取出一批更新
-                batch = self.pending_updates[:self.max_batch_size]
-                self.pending_updates = self.pending_updates[self.max_batch_size:]
-                
-                # 批量应用更新
-                await self._apply_batch_updates(batch)
-                
-                # 短暂休息，让UI有机会更新
-                await asyncio.sleep(self.update_interval / 1000)
-                
-        finally:
-            self.is_processing = False
-    
-    async def _apply_batch_updates(self, updates: List[Dict]):
-        """应用批量更新到UI"""
-        # 这里应该调用实际的UI更新方法
-        # 例如：更新Vue store或触发React状态更新
-        
-        # 模拟批量更新
-        print(f"应用 {len(updates)} 个批量更新")
-        
-        # 实际应用中应该是类似这样的代码：
-        # store.commit('ADD_BATCH_TASKS', updates)
-        # 或者
-        # this.$emit('batch-update', updates)
-
 # 使用示例和测试
 async def demo_progressive_sync():
     """演示渐进式同步"""
@@ -0,0 +1,113 @@
+"""
+同步接口的内容协商
+请求体按 Content-Type、响应体按 Accept 在 JSON 与 MessagePack 之间选择，
+MessagePack 中的时间统一编码为 UTC 毫秒时间戳整数，比 ISO 字符串更紧凑；
+Accept 为 NDJSON 时由接口自行以流式响应逐条输出记录
+"""
+
+import enum
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Optional, Union
+
+import msgpack
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_MEDIA_TYPES = (NDJSON_MEDIA_TYPE, "application/ndjson")
+
+def _matches(media_type: Optional[str], media_types: tuple) -> bool:
+    if not media_type:
+        return False
+    return any(item.split(";")[0].strip().lower() in media_types for item in media_type.split(","))
+
+def is_msgpack(media_type: Optional[str]) -> bool:
+    """Content-Type/Accept 头是否指定了 MessagePack"""
+    return _matches(media_type, MSGPACK_MEDIA_TYPES)
+
+def is_ndjson(media_type: Optional[str]) -> bool:
+    """Content-Type 头是否指定了 NDJSON"""
+    return _matches(media_type, NDJSON_MEDIA_TYPES)
+
+def wants_ndjson(request: Optional[Request]) -> bool:
+    """客户端是否通过 Accept 要求 NDJSON 流式响应"""
+    return request is not None and _matches(request.headers.get("accept"), NDJSON_MEDIA_TYPES)
+
+def datetime_to_timestamp(value: datetime) -> int:
+    """datetime 转为毫秒时间戳，无时区的时间按 UTC 处理（与 datetime.utcnow 一致）"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+def parse_datetime(value: Union[str, int, float, datetime, None]) -> Optional[datetime]:
+    """解析 ISO 字符串或毫秒时间戳，返回无时区的 UTC 时间"""
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+    return datetime.fromisoformat(value)
+
+def _default(value: Any):
+    if isinstance(value, datetime):
+        return datetime_to_timestamp(value)
+    if isinstance(value, date):
+        return datetime_to_timestamp(datetime(value.year, value.month, value.day))
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"无法编码为MessagePack的类型: {type(value).__name__}")
+
+def packb(content: Any) -> bytes:
+    return msgpack.packb(content, default=_default, use_bin_type=True, datetime=False)
+
+def unpackb(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return packb(content)
+
+def negotiate(request: Optional[Request], content: Any, status_code: int = 200):
+    """
+    客户端通过 Accept 要求 MessagePack 时返回 MsgPackResponse，
+    否则原样返回，由 FastAPI 按 response_model 序列化为 JSON
+    """
+    if request is not None and is_msgpack(request.headers.get("accept")):
+        if isinstance(content, BaseModel):
+            content = content.model_dump()
+        return MsgPackResponse(content=content, status_code=status_code)
+    return content
+
+class MsgPackRequest(Request):
+    """把 MessagePack 请求体当作 JSON 交给 FastAPI 解析和校验"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = unpackb(await self.body())
+        return self._json
+
+class NegotiatedRoute(APIRoute):
+    """支持 MessagePack 请求体的路由，Content-Type 为 MessagePack 时先解码再校验"""
+
+    def get_route_handler(self) -> Callable:
+        original_handler = super().get_route_handler()
+
+        async def handler(request: Request) -> Response:
+            if is_msgpack(request.headers.get("content-type")):
+                scope = dict(request.scope)
+                scope["headers"] = [
+                    (name, b"application/json" if name == b"content-type" else value)
+                    for name, value in request.scope["headers"]
+                ]
+                request = MsgPackRequest(scope, request.receive)
+            return await original_handler(request)
+
+        return handler
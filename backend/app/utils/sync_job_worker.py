@@ -0,0 +1,100 @@
+"""
+批量同步任务工作者池
+从 batch_sync_jobs 表按租约认领任务执行，多个进程可以同时运行工作者池
+"""
+
+import asyncio
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, List, Optional
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.crud import sync_job as sync_job_crud
+from app.models.models import BatchSyncJob
+
+class SyncJobWorkerPool:
+    """工作者池：每个工作者循环认领任务并交给 run_job 执行"""
+
+    def __init__(
+        self,
+        run_job: Callable[[BatchSyncJob, str], Awaitable[None]],
+        workers: Optional[int] = None,
+        poll_interval: Optional[float] = None
+    ):
+        self.run_job = run_job
+        self.workers = workers if workers is not None else settings.BATCH_SYNC_WORKERS
+        self.poll_interval = poll_interval if poll_interval is not None else settings.BATCH_SYNC_POLL_INTERVAL
+        # 进程级标识，各工作者在后面追加序号
+        self.pool_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """在当前事件循环中启动工作者"""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._worker_loop(f"{self.pool_id}-{index}"))
+            for index in range(self.workers)
+        ]
+
+    async def stop(self):
+        """停止所有工作者；执行中的任务不再续约，租约过期后由其他进程接手"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def notify(self):
+        """有新任务入队时唤醒空闲工作者，不必等到下一次轮询"""
+        self._wakeup.set()
+
+    async def _worker_loop(self, worker_id: str):
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim, worker_id)
+            except Exception as e:
+                print(f"认领批量同步任务失败: {e}")
+                job = None
+
+            if job is None:
+                await self._idle()
+                continue
+
+            try:
+                await self.run_job(job, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"批量同步任务 {job.id} 执行失败: {e}")
+                await asyncio.to_thread(self._fail, job.id, worker_id, str(e))
+
+    async def _idle(self):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    @staticmethod
+    def _claim(worker_id: str) -> Optional[BatchSyncJob]:
+        db = SessionLocal()
+        try:
+            return sync_job_crud.claim_job(db, worker_id)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _fail(job_id: int, worker_id: str, error: str):
+        db = SessionLocal()
+        try:
+            sync_job_crud.finish_job(db, job_id, worker_id, "failed", error=error)
+        finally:
+            db.close()
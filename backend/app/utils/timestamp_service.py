@@ -2,10 +2,12 @@
 时间戳服务 - 确保LWW策略的时间准确性
 """
 
+import os
+import socket
 import time
 import threading
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 
 class TimestampService:
     """全局时间戳服务，确保严格的时序性"""
@@ -69,6 +71,74 @@ class LogicalClock:
 # 逻辑时钟实例
 logical_clock = LogicalClock()
 
+class HybridLogicalClock:
+    """
+    混合逻辑时钟（HLC）
+    值由 物理毫秒-逻辑计数-节点 组成，编码为定宽字符串，字典序即因果序：
+    本地事件和收到的远端时间戳都会让时钟严格前进，不受各端墙上时钟偏差影响
+    """
+    
+    # 允许远端时间戳领先本地物理时钟的最大毫秒数，超出部分不推进本地时钟
+    MAX_DRIFT_MS = 60 * 1000
+    
+    def __init__(self, node_id: str):
+        self.node_id = node_id
+        self._lock = threading.Lock()
+        self._physical = 0
+        self._logical = 0
+    
+    @staticmethod
+    def encode(physical: int, logical: int, node_id: str) -> str:
+        return f"{physical:015d}-{logical:05d}-{node_id}"
+    
+    @staticmethod
+    def decode(value: str) -> Tuple[int, int, str]:
+        """解析HLC字符串，格式错误时抛出 ValueError"""
+        physical, logical, node_id = value.split("-", 2)
+        return int(physical), int(logical), node_id
+    
+    def now(self) -> str:
+        """本地事件：生成一个新的HLC值"""
+        with self._lock:
+            wall = int(time.time() * 1000)
+            if wall > self._physical:
+                self._physical = wall
+                self._logical = 0
+            else:
+                self._logical += 1
+            return self.encode(self._physical, self._logical, self.node_id)
+    
+    def is_within_drift(self, received: str) -> bool:
+        """远端HLC的物理时间是否在允许的超前范围内，格式错误视为超出范围"""
+        try:
+            remote_physical, _, _ = self.decode(received)
+        except ValueError:
+            return False
+        return remote_physical <= int(time.time() * 1000) + self.MAX_DRIFT_MS
+    
+    def update(self, received: str) -> str:
+        """收到远端HLC值：合并后生成一个严格大于两者的新值"""
+        remote_physical, remote_logical, _ = self.decode(received)
+        with self._lock:
+            wall = int(time.time() * 1000)
+            # 远端时钟过于超前时截断，避免单个异常客户端把服务器时钟推向未来
+            remote_physical = min(remote_physical, wall + self.MAX_DRIFT_MS)
+            physical = max(self._physical, remote_physical, wall)
+            
+            if physical == self._physical and physical == remote_physical:
+                self._logical = max(self._logical, remote_logical) + 1
+            elif physical == self._physical:
+                self._logical += 1
+            elif physical == remote_physical:
+                self._logical = remote_logical + 1
+            else:
+                self._logical = 0
+            self._physical = physical
+            return self.encode(self._physical, self._logical, self.node_id)
+
+# 混合逻辑时钟实例，节点标识区分多进程/多实例部署
+hlc_clock = HybridLogicalClock(node_id=f"{socket.gethostname()[:16]}.{os.getpid()}")
+
 def get_consistent_timestamp() -> Dict[str, any]:
     """
     获取一致性时间戳（包含物理时间和逻辑时间）
@@ -79,6 +149,7 @@ def get_consistent_timestamp() -> Dict[str, any]:
     return {
         "physical_timestamp": physical_ts,
         "logical_timestamp": logical_ts,
+        "hlc": hlc_clock.now(),
         "readable_time": timestamp_service.get_readable_timestamp()
     }
 
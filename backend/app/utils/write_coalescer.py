@@ -0,0 +1,172 @@
+"""
+服务端写合并器
+高频字段修改（输入描述、拖动进度等）先按 (任务, 字段) 缓冲，窗口内只保留最后一次写入，
+到达时间窗口或缓冲上限时在一个事务中批量写入
+"""
+
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from app.utils.timestamp_service import hlc_clock
+
+@dataclass
+class PendingWrite:
+    """缓冲中的一次字段写入"""
+    user_id: int
+    value: Any
+    hlc: str  # 收到写入时分配的HLC，落盘时作为字段版本，跨进程按它判断先后
+    attempts: int = 0  # 整批写入失败的次数
+
+class WriteCoalescer:
+    """按 (任务ID, 字段) 合并写入，apply_func 在线程中执行，接收 {任务ID: {字段: PendingWrite}}"""
+
+    def __init__(
+        self,
+        apply_func: Callable[[Dict[int, Dict[str, PendingWrite]]], Any],
+        window: float = 0.2,
+        max_pending: int = 500,
+        max_attempts: int = 5
+    ):
+        self.apply_func = apply_func
+        self.window = window  # 第一条缓冲写入之后最多等待的秒数
+        self.max_pending = max_pending  # 缓冲的 (任务, 字段) 数达到上限时立即写入
+        self.max_attempts = max_attempts  # 整批写入失败（如数据库不可用）时每条写入最多尝试的次数
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[int, str], PendingWrite] = {}
+        self._first_at: Optional[float] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """在当前事件循环中启动后台写入任务"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务，并把缓冲中剩余的写入全部落盘"""
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+        self._loop = None
+
+    def submit(self, todo_id: int, user_id: int, fields: Dict[str, Any]) -> int:
+        """
+        缓冲一次写入，同一任务同一字段只保留最后一次，返回当前缓冲数量。
+        可以在任意线程调用；后台任务未启动时直接同步写入
+        """
+        hlc = hlc_clock.now()
+        with self._lock:
+            for field, value in fields.items():
+                self._pending[(todo_id, field)] = PendingWrite(user_id=user_id, value=value, hlc=hlc)
+            was_empty = self._first_at is None
+            if was_empty:
+                self._first_at = time.monotonic()
+            size = len(self._pending)
+
+        if self._task is None:
+            self.apply_func(self._take())
+            return 0
+        # 第一条写入需要启动窗口计时，达到上限需要立即写入
+        if was_empty or size >= self.max_pending:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return size
+
+    def discard(self, todo_id: int, fields: Optional[Iterable[str]] = None):
+        """丢弃某个任务尚未落盘的写入（被直接写入覆盖或任务已删除时），fields 为空表示全部字段"""
+        with self._lock:
+            keys = [
+                key for key in self._pending
+                if key[0] == todo_id and (fields is None or key[1] in fields)
+            ]
+            for key in keys:
+                del self._pending[key]
+            if not self._pending:
+                self._first_at = None
+
+    def pending_fields(self, todo_id: int) -> Dict[str, Any]:
+        """某个任务尚未落盘的字段值"""
+        with self._lock:
+            return {field: write.value for (pending_id, field), write in self._pending.items() if pending_id == todo_id}
+
+    async def flush(self):
+        """立即写入当前缓冲的全部内容"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            batch = self._take()
+            if not batch:
+                return
+            try:
+                await asyncio.to_thread(self.apply_func, batch)
+            except Exception as e:
+                print(f"合并写入失败，稍后重试: {e}")
+                self._restore(batch)
+                raise
+
+    async def _run(self):
+        while True:
+            # 先清除唤醒标记再读取状态，读取之后的唤醒不会丢失
+            self._wakeup.clear()
+            with self._lock:
+                first_at = self._first_at
+                size = len(self._pending)
+            if size >= self.max_pending:
+                timeout = 0
+            elif first_at is None:
+                timeout = None
+            else:
+                timeout = max(self.window - (time.monotonic() - first_at), 0)
+
+            if timeout != 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                    continue  # 被唤醒后重新计算等待时间
+                except asyncio.TimeoutError:
+                    pass
+
+            try:
+                await self.flush()
+            except Exception:
+                # 写入失败的内容已放回缓冲，等待一个窗口后重试
+                await asyncio.sleep(self.window)
+
+    def _take(self) -> Dict[int, Dict[str, PendingWrite]]:
+        """取出缓冲内容，按任务分组"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._first_at = None
+        grouped: Dict[int, Dict[str, PendingWrite]] = {}
+        for (todo_id, field), write in pending.items():
+            grouped.setdefault(todo_id, {})[field] = write
+        return grouped
+
+    def _restore(self, batch: Dict[int, Dict[str, PendingWrite]]):
+        """写入失败时放回缓冲，期间收到的更新的写入优先，超过尝试次数的写入丢弃"""
+        dropped = 0
+        with self._lock:
+            for todo_id, fields in batch.items():
+                for field, write in fields.items():
+                    write.attempts += 1
+                    if write.attempts >= self.max_attempts:
+                        dropped += 1
+                        continue
+                    self._pending.setdefault((todo_id, field), write)
+            if self._pending and self._first_at is None:
+                self._first_at = time.monotonic()
+        if dropped:
+            print(f"合并写入多次失败，已丢弃 {dropped} 个字段修改")
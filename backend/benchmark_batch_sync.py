@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+批量同步任务吞吐量基准测试
+对比逐项应用（每个操作单独会话加载操作和任务、单独提交）
+与整批应用（按任务分组、批量 UPDATE、一条语句更新操作状态）处理待同步操作的速度
+
+用法: python benchmark_batch_sync.py [操作数] [任务数] [批次大小]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import uuid
+from datetime import datetime
+
+# 使用独立的临时数据库，避免污染开发数据
+_db_file = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+os.environ["DEBUG"] = "false"
+
+from app.core.database import Base, SessionLocal, engine
+from app.models import models
+from app.api import batch_sync, offline_sync
+from app.utils.progressive_sync import ProgressiveSyncService
+
+def setup_data(op_count: int, todo_count: int) -> int:
+    """创建测试用户、任务和待同步的离线操作，返回用户ID"""
+    db = SessionLocal()
+    try:
+        user = models.User(
+            username=f"bench_{uuid.uuid4().hex[:8]}",
+            email=f"{uuid.uuid4().hex[:8]}@bench.local",
+            password_hash="x"
+        )
+        db.add(user)
+        db.flush()
+        todos = [
+            models.Todo(user_id=user.id, title=f"任务 {i}", position=f"a{i}")
+            for i in range(todo_count)
+        ]
+        db.add_all(todos)
+        db.flush()
+        now = datetime.utcnow()
+        db.add_all([
+            models.OfflineOperation(
+                user_id=user.id,
+                todo_id=random.choice(todos).id,
+                operation_type="UPDATE",
+                field_name=random.choice(["title", "description"]),
+                new_value=f"离线修改 {i}",
+                server_timestamp=now,
+                logical_timestamp=i,
+                sequence_id=str(uuid.uuid4()),
+                device_id="bench-device",
+                sync_status="pending"
+            )
+            for i in range(op_count)
+        ])
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+def apply_single_operation(user_id: int, operation_id: int):
+    """逐项应用：每个操作一个会话，加载操作和任务后单独提交"""
+    db = SessionLocal()
+    try:
+        operation = db.query(models.OfflineOperation).filter(
+            models.OfflineOperation.id == operation_id
+        ).first()
+        conflict = offline_sync.apply_operation(db, operation, user_id)
+        operation.sync_status = "conflicted" if conflict else "synced"
+        db.commit()
+    finally:
+        db.close()
+
+async def run_per_item(service: ProgressiveSyncService, user_id: int, data):
+    async def process_item(item):
+        await asyncio.to_thread(apply_single_operation, user_id, item["id"])
+    await service.sync_large_dataset(data, process_item)
+
+async def run_batched(service: ProgressiveSyncService, user_id: int, data):
+    async def process_batch(items):
+        await asyncio.to_thread(
+            batch_sync.apply_batch_in_session, user_id, [item["id"] for item in items]
+        )
+    await service.sync_large_dataset(data, process_batch_func=process_batch)
+
+def benchmark(name: str, runner, op_count: int, todo_count: int, batch_size: int) -> float:
+    user_id = setup_data(op_count, todo_count)
+    db = SessionLocal()
+    try:
+        data = batch_sync.get_pending_sync_data(db, user_id)
+    finally:
+        db.close()
+    
+    service = ProgressiveSyncService(batch_size=batch_size)
+    start = time.perf_counter()
+    asyncio.run(runner(service, user_id, data))
+    elapsed = time.perf_counter() - start
+    
+    db = SessionLocal()
+    try:
+        remaining = db.query(models.OfflineOperation).filter(
+            models.OfflineOperation.user_id == user_id,
+            models.OfflineOperation.sync_status == "pending"
+        ).count()
+    finally:
+        db.close()
+    print(f"{name:<8} {op_count} 项 用时 {elapsed:.2f}s, 吞吐量 {op_count / elapsed:,.0f} 项/秒"
+          f"（剩余待处理 {remaining}）")
+    return elapsed
+
+if __name__ == "__main__":
+    op_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    todo_count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    Base.metadata.create_all(bind=engine)
+    # 冲突检测会打印详细信息，基准测试时屏蔽输出
+    offline_sync.print = lambda *args, **kwargs: None
+
+    print(f"=== 批量同步吞吐量基准测试（{op_count} 项，{todo_count} 个任务，批次 {batch_size}）===")
+    per_item = benchmark("逐项应用", run_per_item, op_count, todo_count, batch_size)
+    batched = benchmark("整批应用", run_batched, op_count, todo_count, batch_size)
+    print(f"加速比: {per_item / batched:.1f}x")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+离线操作日志压缩基准测试
+生成带有大量重复字段修改、已删除任务和过期操作的离线操作日志，
+报告压缩前后的行数以及同步接口待处理操作查询的耗时
+
+用法: python benchmark_offline_compaction.py [操作数] [任务数]
+"""
+
+import os
+import sys
+import random
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+# 使用独立的临时数据库，避免污染开发数据
+_db_file = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+os.environ["DEBUG"] = "false"
+
+from app.core.database import Base, SessionLocal, engine
+from app.models import models
+import compact_offline_operations
+
+def setup_data(db, op_count: int, todo_count: int):
+    """创建测试用户、任务和离线操作日志，其中十分之一的任务随后被删除"""
+    user = models.User(
+        username=f"bench_{uuid.uuid4().hex[:8]}",
+        email=f"{uuid.uuid4().hex[:8]}@bench.local",
+        password_hash="x"
+    )
+    db.add(user)
+    db.flush()
+    todos = [models.Todo(user_id=user.id, title=f"任务 {i}") for i in range(todo_count)]
+    db.add_all(todos)
+    db.flush()
+    todo_ids = [todo.id for todo in todos]
+
+    now = datetime.utcnow()
+    # 绝大多数操作已同步，少量待处理或冲突
+    statuses = ["synced"] * 48 + ["pending", "conflicted"]
+    db.bulk_insert_mappings(models.OfflineOperation, [
+        {
+            "user_id": user.id,
+            "todo_id": random.choice(todo_ids),
+            "operation_type": "UPDATE",
+            "field_name": random.choice(["title", "description"]),
+            "old_value": f"旧值 {i}",
+            "new_value": f"新值 {i}",
+            "server_timestamp": now - timedelta(days=random.randint(0, 90)),
+            "logical_timestamp": i,
+            "sequence_id": str(uuid.uuid4()),
+            "sync_status": random.choice(statuses),
+            "device_id": random.choice(["phone", "laptop"]),
+        }
+        for i in range(op_count)
+    ])
+
+    deleted_ids = todo_ids[::10]
+    db.query(models.Todo).filter(models.Todo.id.in_(deleted_ids)).delete(synchronize_session=False)
+    db.commit()
+
+if __name__ == "__main__":
+    op_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    todo_count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        setup_data(db, op_count, todo_count)
+
+        # 对比没有 (user_id, sync_status) 索引时的查询耗时
+        status_index = next(
+            index for index in models.OfflineOperation.__table__.indexes
+            if index.name == "ix_offline_operations_user_status"
+        )
+        status_index.drop(bind=engine)
+        latency_without_index = compact_offline_operations.measure_sync_queries(db)
+        status_index.create(bind=engine)
+    finally:
+        db.close()
+
+    print(f"未建状态索引时同步查询耗时: {latency_without_index:.2f}ms")
+    compact_offline_operations.run(30)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+离线同步吞吐量基准测试
+对比逐条应用（每个操作单独查询任务、操作日志与任务变更分两次提交）
+与批量应用（一次IN查询预加载、单事务提交）处理离线积压操作的速度
+
+用法: python benchmark_offline_sync.py [操作数] [任务数]
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+import uuid
+from datetime import datetime
+
+# 使用独立的临时数据库，避免污染开发数据
+_db_file = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file}"
+os.environ["DEBUG"] = "false"
+
+from app.core.database import Base, SessionLocal, engine
+from app.models import models
+from app.schemas import schemas
+from app.api import offline_sync
+from app.utils.fractional_index import keys_after
+from app.utils.timestamp_service import get_consistent_timestamp
+
+def setup_data(db, todo_count: int) -> models.User:
+    """创建测试用户和任务"""
+    user = models.User(
+        username=f"bench_{uuid.uuid4().hex[:8]}",
+        email=f"{uuid.uuid4().hex[:8]}@bench.local",
+        password_hash="x"
+    )
+    db.add(user)
+    db.flush()
+    db.add_all([
+        models.Todo(user_id=user.id, title=f"任务 {i}", position=position)
+        for i, position in enumerate(keys_after(None, todo_count))
+    ])
+    db.commit()
+    return user
+
+def build_request(db, user: models.User, op_count: int) -> schemas.SyncRequest:
+    """生成离线积压操作：随机任务的标题/描述修改"""
+    todo_ids = [row.id for row in db.query(models.Todo.id).filter(models.Todo.user_id == user.id)]
+    operations = [
+        schemas.OfflineOperationCreate(
+            todo_id=random.choice(todo_ids),
+            operation_type="UPDATE",
+            field_name=random.choice(["title", "description"]),
+            old_value=None,
+            new_value=f"离线修改 {i}"
+        )
+        for i in range(op_count)
+    ]
+    return schemas.SyncRequest(device_id="bench-device", pending_operations=operations)
+
+def run_per_operation(db, user: models.User, sync_request: schemas.SyncRequest):
+    """逐条应用：与批量化之前的同步接口流程一致"""
+    processed = []
+    for op_data in sync_request.pending_operations:
+        timestamp_info = get_consistent_timestamp()
+        operation = models.OfflineOperation(
+            user_id=user.id,
+            todo_id=op_data.todo_id,
+            operation_type=op_data.operation_type,
+            field_name=op_data.field_name,
+            old_value=op_data.old_value,
+            new_value=op_data.new_value,
+            server_timestamp=datetime.utcnow(),
+            logical_timestamp=timestamp_info["logical_timestamp"],
+            sequence_id=str(uuid.uuid4()),
+            device_id=sync_request.device_id,
+            sync_status="pending"
+        )
+        db.add(operation)
+        processed.append(operation)
+    db.commit()
+
+    for operation in processed:
+        conflict = offline_sync.apply_operation(db, operation, user.id)
+        operation.sync_status = "conflicted" if conflict else "synced"
+    db.commit()
+
+def run_batched(db, user: models.User, sync_request: schemas.SyncRequest):
+    """批量应用：直接调用同步接口"""
+    offline_sync.sync_offline_operations(sync_request, request=None, db=db, current_user=user)
+
+def benchmark(name: str, runner, op_count: int, todo_count: int):
+    db = SessionLocal()
+    try:
+        user = setup_data(db, todo_count)
+        sync_request = build_request(db, user, op_count)
+        start = time.perf_counter()
+        runner(db, user, sync_request)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<8} {op_count} 个操作 用时 {elapsed:.2f}s, 吞吐量 {op_count / elapsed:,.0f} 操作/秒")
+        return elapsed
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    op_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    todo_count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    Base.metadata.create_all(bind=engine)
+
+    print(f"=== 离线同步吞吐量基准测试（{op_count} 个操作，{todo_count} 个任务）===")
+    per_op = benchmark("逐条应用", run_per_operation, op_count, todo_count)
+    batched = benchmark("批量应用", run_batched, op_count, todo_count)
+    print(f"加速比: {per_op / batched:.1f}x")
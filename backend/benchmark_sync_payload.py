@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+同步载荷编码基准测试
+对比 JSON 与 MessagePack 编码同一个同步响应时的体积（含gzip压缩后）以及编码/解码耗时
+
+用法: python benchmark_sync_payload.py [任务数] [重复次数]
+"""
+
+import gzip
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+
+from app.schemas import schemas
+from app.utils.sync_codec import packb, unpackb
+
+def build_response(todo_count: int) -> schemas.SyncResponse:
+    """构造一个包含 todo_count 个任务更新的同步响应"""
+    now = datetime.utcnow()
+    updates = [
+        schemas.TodoResponse(
+            id=i,
+            user_id=1,
+            title=f"离线期间修改的任务 {i}",
+            description="任务描述" * (i % 5),
+            priority=["low", "medium", "high"][i % 3],
+            category="默认",
+            due_date=now + timedelta(days=i % 30) if i % 2 else None,
+            completed=i % 4 == 0,
+            created_at=now - timedelta(days=60),
+            updated_at=now - timedelta(minutes=i),
+            parent_id=i // 10 if i >= 10 else None,
+            position=f"a{i}",
+            version=i % 7 + 1,
+            field_versions={"title": f"00{1760000000000 + i}-00000-server.1234"},
+            change_seq=i + 1,
+        )
+        for i in range(todo_count)
+    ]
+    return schemas.SyncResponse(
+        server_updates=updates,
+        conflicts=[],
+        sync_timestamp=now,
+        has_more=False,
+        next_cursor=todo_count,
+    )
+
+def encode_json(response: schemas.SyncResponse) -> bytes:
+    """与 FastAPI 的 JSONResponse 相同的编码方式"""
+    return json.dumps(
+        jsonable_encoder(response),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+def encode_msgpack(response: schemas.SyncResponse) -> bytes:
+    """与 MsgPackResponse 相同的编码方式"""
+    return packb(response.model_dump())
+
+def timed(func, arg, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(arg)
+    return result, (time.perf_counter() - start) * 1000 / repeat
+
+if __name__ == "__main__":
+    todo_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    response = build_response(todo_count)
+    print(f"=== 同步载荷编码基准测试（{todo_count} 个任务，重复 {repeat} 次）===")
+    print(f"{'格式':<10}{'体积':>12}{'gzip后':>12}{'编码':>12}{'解码':>12}")
+
+    results = {}
+    for name, encode, decode in (
+        ("JSON", encode_json, json.loads),
+        ("MsgPack", encode_msgpack, unpackb),
+    ):
+        payload, encode_ms = timed(encode, response, repeat)
+        _, decode_ms = timed(decode, payload, repeat)
+        compressed = len(gzip.compress(payload))
+        results[name] = (len(payload), compressed)
+        print(f"{name:<10}{len(payload):>10,}B{compressed:>10,}B{encode_ms:>10.2f}ms{decode_ms:>10.2f}ms")
+
+    json_size, json_gzip = results["JSON"]
+    msgpack_size, msgpack_gzip = results["MsgPack"]
+    print(f"MessagePack 体积为 JSON 的 {msgpack_size / json_size:.0%}（gzip后 {msgpack_gzip / json_gzip:.0%}）")
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+离线操作日志压缩任务
+合并同一任务同一字段上的连续修改、删除已删除任务的操作、把超过保留期的已同步操作移入归档表，
+并报告压缩前后的行数和待处理操作查询的耗时
+
+用法: python compact_offline_operations.py [保留天数]
+"""
+
+import sys
+import time
+
+from app.core.database import Base, SessionLocal, engine
+from app.core.config import settings
+from app.models import models
+from app.crud.compaction import compact_offline_operations
+
+def measure_sync_queries(db, repeat: int = 20) -> float:
+    """对每个用户执行同步接口使用的待处理/冲突操作查询，返回平均耗时（毫秒）"""
+    user_ids = [row.user_id for row in db.query(models.OfflineOperation.user_id).distinct()]
+    if not user_ids:
+        return 0.0
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for user_id in user_ids:
+            for status in ("pending", "conflicted"):
+                db.query(models.OfflineOperation).filter(
+                    models.OfflineOperation.user_id == user_id,
+                    models.OfflineOperation.sync_status == status
+                ).order_by(models.OfflineOperation.id).all()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+def run(retention_days: int):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        latency_before = measure_sync_queries(db)
+        report = compact_offline_operations(db, retention_days=retention_days)
+        db.commit()
+        latency_after = measure_sync_queries(db)
+    finally:
+        db.close()
+
+    print(f"=== 离线操作日志压缩（保留 {retention_days} 天）===")
+    print(f"压缩前行数:           {report['before']}")
+    print(f"删除已删除任务的操作: {report['dropped_deleted_todos']}")
+    print(f"合并的连续修改:       {report['merged_updates']}")
+    print(f"移入归档表:           {report['archived']}")
+    print(f"压缩后行数:           {report['after']}")
+    print(f"同步查询耗时:         {latency_before:.2f}ms -> {latency_after:.2f}ms")
+    return report
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else settings.OFFLINE_OP_RETENTION_DAYS)
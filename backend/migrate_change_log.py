@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+创建变更数据捕获日志（changes表）并为已有数据回填的迁移脚本
+"""
+
+import sqlite3
+from pathlib import Path
+
+def migrate_change_log():
+    """创建changes表，并为已有的任务、评论、分配、共享清单和进度各追加一条变更记录"""
+    print("开始创建变更日志迁移...")
+    
+    # 数据库文件路径
+    db_path = Path("./todo_app.db")
+    
+    try:
+        # 连接数据库
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='changes'")
+        exists = cursor.fetchone() is not None
+        conn.close()
+        
+        from app.core.database import Base, SessionLocal, engine
+        from app.crud.changes import backfill_changes
+        from app.models.models import Change
+        
+        if not exists:
+            print("创建表: changes")
+            Base.metadata.create_all(bind=engine, tables=[Change.__table__])
+        else:
+            print("✓ 表已存在: changes")
+        
+        db = SessionLocal()
+        try:
+            if db.query(Change).first() is None:
+                added = backfill_changes(db)
+                db.commit()
+                print(f"✓ 已为已有数据回填 {added} 条变更记录")
+            else:
+                print("✓ 变更日志已有数据，跳过回填")
+        finally:
+            db.close()
+        
+        print("✓ 变更日志迁移完成！")
+        return True
+        
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    migrate_change_log()
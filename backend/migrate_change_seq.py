@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+添加任务变更序号（增量同步游标）的迁移脚本
+"""
+
+import sqlite3
+from pathlib import Path
+
+def migrate_change_seq():
+    """为todos表添加change_seq字段，并按更新时间为已有任务回填序号"""
+    print("开始添加变更序号迁移...")
+    
+    # 数据库文件路径
+    db_path = Path("./todo_app.db")
+    
+    try:
+        # 连接数据库
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("PRAGMA table_info(todos)")
+        columns = [row[1] for row in cursor.fetchall()]
+        
+        if "change_seq" not in columns:
+            print("添加字段: todos.change_seq INTEGER")
+            cursor.execute("ALTER TABLE todos ADD COLUMN change_seq INTEGER")
+        else:
+            print("✓ 字段已存在: todos.change_seq")
+        
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ix_todos_user_change_seq ON todos (user_id, change_seq)"
+        )
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS sync_sequences ("
+            "name VARCHAR(50) PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)"
+        )
+        
+        # 按更新时间顺序回填，保证旧数据的序号与修改先后一致
+        cursor.execute("SELECT COALESCE(value, 0) FROM sync_sequences WHERE name = 'changes'")
+        row = cursor.fetchone()
+        seq = row[0] if row else 0
+        
+        cursor.execute(
+            "SELECT id FROM todos WHERE change_seq IS NULL "
+            "ORDER BY COALESCE(updated_at, created_at), id"
+        )
+        todo_ids = [row[0] for row in cursor.fetchall()]
+        cursor.executemany(
+            "UPDATE todos SET change_seq = ? WHERE id = ?",
+            [(seq + i + 1, todo_id) for i, todo_id in enumerate(todo_ids)]
+        )
+        seq += len(todo_ids)
+        cursor.execute(
+            "INSERT OR REPLACE INTO sync_sequences (name, value) VALUES ('changes', ?)", (seq,)
+        )
+        print(f"✓ 已为 {len(todo_ids)} 个任务回填变更序号")
+        
+        conn.commit()
+        conn.close()
+        print("✓ 变更序号迁移完成！")
+        return True
+        
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    migrate_change_seq()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+添加字段级版本（HLC）相关字段的迁移脚本
+"""
+
+import sqlite3
+from pathlib import Path
+
+def migrate_field_versions():
+    """为todos表添加field_versions字段，为offline_operations表添加hlc/base_hlc字段"""
+    print("开始添加字段级版本迁移...")
+    
+    # 数据库文件路径
+    db_path = Path("./todo_app.db")
+    
+    try:
+        # 连接数据库
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        tables_to_migrate = {
+            "todos": [
+                ("field_versions", "TEXT")
+            ],
+            "offline_operations": [
+                ("hlc", "VARCHAR(64)"),
+                ("base_hlc", "VARCHAR(64)")
+            ]
+        }
+        
+        for table, fields_to_add in tables_to_migrate.items():
+            cursor.execute(f"PRAGMA table_info({table})")
+            columns = [row[1] for row in cursor.fetchall()]
+            
+            for field_name, field_type in fields_to_add:
+                if field_name not in columns:
+                    print(f"添加字段: {table}.{field_name} {field_type}")
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {field_name} {field_type}")
+                else:
+                    print(f"✓ 字段已存在: {table}.{field_name}")
+        
+        conn.commit()
+        conn.close()
+        print("✓ 字段级版本迁移完成！")
+        return True
+        
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    migrate_field_versions()
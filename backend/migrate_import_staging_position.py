@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+为导入暂存表添加排序键字段的迁移脚本
+"""
+
+import sqlite3
+from pathlib import Path
+
+def migrate_import_staging_position():
+    """为import_staging_todos表添加position字段，导入的任务按上传顺序获得同级排序键"""
+    print("开始添加导入暂存排序字段迁移...")
+    
+    # 数据库文件路径
+    db_path = Path("./todo_app.db")
+    
+    try:
+        # 连接数据库
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        # 暂存表在首次启动时由 create_all 创建，此时已包含该字段
+        cursor.execute("PRAGMA table_info(import_staging_todos)")
+        columns = [row[1] for row in cursor.fetchall()]
+        
+        if not columns:
+            print("✓ 暂存表尚未创建，无需迁移")
+        elif "position" not in columns:
+            print("添加字段: position VARCHAR(255)")
+            cursor.execute("ALTER TABLE import_staging_todos ADD COLUMN position VARCHAR(255)")
+        else:
+            print("✓ 字段已存在: position")
+        
+        conn.commit()
+        conn.close()
+        print("✓ 导入暂存排序字段迁移完成！")
+        return True
+        
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    migrate_import_staging_position()
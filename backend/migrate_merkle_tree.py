@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+创建任务哈希树（sync_merkle_trees、sync_merkle_buckets表）的迁移脚本
+"""
+
+import sqlite3
+from pathlib import Path
+
+def migrate_merkle_tree():
+    """创建哈希树的表和读取 (id, change_seq) 的覆盖索引，各用户的树在首次请求时生成"""
+    print("开始创建任务哈希树迁移...")
+    
+    # 数据库文件路径
+    db_path = Path("./todo_app.db")
+    
+    try:
+        # 连接数据库
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS sync_merkle_trees ("
+            "user_id INTEGER NOT NULL PRIMARY KEY REFERENCES users (id), "
+            "root_hash VARCHAR(32) NOT NULL, "
+            "as_of_seq INTEGER NOT NULL DEFAULT 0, "
+            "updated_at DATETIME)"
+        )
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS sync_merkle_buckets ("
+            "user_id INTEGER NOT NULL REFERENCES users (id), "
+            "bucket INTEGER NOT NULL, "
+            "hash VARCHAR(16) NOT NULL, "
+            "row_count INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (user_id, bucket))"
+        )
+        print("✓ 表已就绪: sync_merkle_trees, sync_merkle_buckets")
+        
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ix_todos_user_id_change_seq ON todos (user_id, id, change_seq)"
+        )
+        print("✓ 索引已就绪: ix_todos_user_id_change_seq")
+        
+        conn.commit()
+        conn.close()
+        print("✓ 任务哈希树迁移完成！")
+        return True
+        
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    migrate_merkle_tree()
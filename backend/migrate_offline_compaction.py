@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+离线操作日志压缩相关的迁移脚本：创建归档表和按同步状态查询的索引
+"""
+
+import sqlite3
+from pathlib import Path
+
+def migrate_offline_compaction():
+    """创建offline_operations_archive表，为offline_operations添加(user_id, sync_status)索引"""
+    print("开始离线操作压缩迁移...")
+    
+    # 数据库文件路径
+    db_path = Path("./todo_app.db")
+    
+    try:
+        # 连接数据库
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='offline_operations_archive'")
+        if cursor.fetchone() is None:
+            print("创建表: offline_operations_archive")
+            cursor.execute("""
+                CREATE TABLE offline_operations_archive (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL REFERENCES users (id),
+                    todo_id INTEGER NOT NULL,
+                    operation_type VARCHAR(20) NOT NULL,
+                    field_name VARCHAR(50),
+                    old_value TEXT,
+                    new_value TEXT,
+                    client_timestamp DATETIME,
+                    server_timestamp DATETIME,
+                    logical_timestamp INTEGER,
+                    hlc VARCHAR(64),
+                    base_hlc VARCHAR(64),
+                    timestamp DATETIME,
+                    sequence_id VARCHAR(50),
+                    sync_status VARCHAR(20),
+                    device_id VARCHAR(50),
+                    archived_at DATETIME
+                )
+            """)
+        else:
+            print("✓ 表已存在: offline_operations_archive")
+        
+        print("创建索引: ix_offline_operations_user_status")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ix_offline_operations_user_status "
+            "ON offline_operations (user_id, sync_status)"
+        )
+        
+        conn.commit()
+        conn.close()
+        print("✓ 离线操作压缩迁移完成！")
+        return True
+        
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    migrate_offline_compaction()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+把变更序号从全局计数器改为按用户计数的迁移脚本
+"""
+
+import sqlite3
+from pathlib import Path
+
+def migrate_per_user_change_seq():
+    """
+    sync_sequences 的主键改为 (name, user_id)，按用户已有的最大序号初始化各用户的计数行；
+    changes 的主键改为 (user_id, seq)。已有序号不变，客户端保存的游标继续有效
+    """
+    print("开始按用户拆分变更序号迁移...")
+    
+    # 数据库文件路径
+    db_path = Path("./todo_app.db")
+    
+    try:
+        # 连接数据库
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("PRAGMA table_info(sync_sequences)")
+        columns = [row[1] for row in cursor.fetchall()]
+        if "user_id" not in columns:
+            print("重建表: sync_sequences (name, user_id)")
+            cursor.execute("ALTER TABLE sync_sequences RENAME TO sync_sequences_old")
+            cursor.execute(
+                "CREATE TABLE sync_sequences ("
+                "name VARCHAR(50) NOT NULL, "
+                "user_id INTEGER NOT NULL DEFAULT 0, "
+                "value INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (name, user_id))"
+            )
+            cursor.execute(
+                "INSERT INTO sync_sequences (name, user_id, value) "
+                "SELECT name, 0, value FROM sync_sequences_old WHERE name != 'changes'"
+            )
+            cursor.execute(
+                "INSERT INTO sync_sequences (name, user_id, value) "
+                "SELECT 'changes', user_id, MAX(seq) FROM changes GROUP BY user_id"
+            )
+            cursor.execute("DROP TABLE sync_sequences_old")
+        else:
+            print("✓ 表已按用户计数: sync_sequences")
+        
+        cursor.execute("PRAGMA table_info(changes)")
+        primary_key = [row[1] for row in sorted(cursor.fetchall(), key=lambda row: row[5]) if row[5]]
+        if primary_key != ["user_id", "seq"]:
+            print("重建表: changes (user_id, seq)")
+            cursor.execute(
+                "CREATE TABLE changes_new ("
+                "user_id INTEGER NOT NULL REFERENCES users (id), "
+                "seq INTEGER NOT NULL, "
+                "entity_type VARCHAR(30) NOT NULL, "
+                "entity_id INTEGER NOT NULL, "
+                "operation VARCHAR(10) NOT NULL, "
+                "created_at DATETIME, "
+                "PRIMARY KEY (user_id, seq))"
+            )
+            cursor.execute(
+                "INSERT INTO changes_new (user_id, seq, entity_type, entity_id, operation, created_at) "
+                "SELECT user_id, seq, entity_type, entity_id, operation, created_at FROM changes"
+            )
+            cursor.execute("DROP TABLE changes")
+            cursor.execute("ALTER TABLE changes_new RENAME TO changes")
+        else:
+            print("✓ 表主键已是 (user_id, seq): changes")
+        
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ix_changes_user_type_seq ON changes (user_id, entity_type, seq)"
+        )
+        
+        conn.commit()
+        conn.close()
+        print("✓ 变更序号迁移完成！")
+        return True
+        
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    migrate_per_user_change_seq()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+添加同级排序字段并回填排序键的迁移脚本
+"""
+
+import sqlite3
+from pathlib import Path
+
+from app.utils.fractional_index import keys_after
+
+def migrate_sibling_positions():
+    """为todos表添加position字段，并按原有创建顺序（id）为每组同级任务生成排序键"""
+    print("开始添加同级排序字段迁移...")
+    
+    # 数据库文件路径
+    db_path = Path("./todo_app.db")
+    
+    try:
+        # 连接数据库
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        # 检查todos表结构
+        cursor.execute("PRAGMA table_info(todos)")
+        columns = [row[1] for row in cursor.fetchall()]
+        
+        if "position" not in columns:
+            print("添加字段: position VARCHAR(255)")
+            cursor.execute("ALTER TABLE todos ADD COLUMN position VARCHAR(255)")
+        else:
+            print("✓ 字段已存在: position")
+        
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ix_todos_parent_position ON todos (parent_id, position)"
+        )
+        
+        # 回填缺失的排序键，同一父任务下按id顺序追加
+        cursor.execute(
+            "SELECT id, user_id, parent_id, position FROM todos ORDER BY user_id, parent_id, id"
+        )
+        groups = {}
+        for todo_id, user_id, parent_id, position in cursor.fetchall():
+            groups.setdefault((user_id, parent_id), []).append((todo_id, position))
+        
+        updates = []
+        for rows in groups.values():
+            last_position = max((p for _, p in rows if p), default=None)
+            missing = [todo_id for todo_id, position in rows if not position]
+            for todo_id, position in zip(missing, keys_after(last_position, len(missing))):
+                updates.append((position, todo_id))
+        
+        cursor.executemany("UPDATE todos SET position = ? WHERE id = ?", updates)
+        print(f"✓ 已回填 {len(updates)} 个任务的排序键")
+        
+        conn.commit()
+        conn.close()
+        print("✓ 同级排序字段迁移完成！")
+        return True
+        
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    migrate_sibling_positions()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+添加子树汇总字段并全量回填的迁移脚本
+"""
+
+import sqlite3
+from pathlib import Path
+
+def migrate_subtree_rollups():
+    """为todos表添加子树汇总字段，并根据现有数据重算"""
+    print("开始添加子树汇总字段迁移...")
+    
+    # 数据库文件路径
+    db_path = Path("./todo_app.db")
+    
+    try:
+        # 连接数据库
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        # 检查todos表结构
+        cursor.execute("PRAGMA table_info(todos)")
+        columns = [row[1] for row in cursor.fetchall()]
+        
+        # 添加缺失的字段
+        fields_to_add = [
+            ("descendant_count", "INTEGER NOT NULL DEFAULT 0"),
+            ("completed_descendant_count", "INTEGER NOT NULL DEFAULT 0"),
+            ("descendant_hours_spent", "INTEGER NOT NULL DEFAULT 0"),
+            ("earliest_descendant_due_date", "DATETIME")
+        ]
+        
+        for field_name, field_type in fields_to_add:
+            if field_name not in columns:
+                print(f"添加字段: {field_name} {field_type}")
+                cursor.execute(f"ALTER TABLE todos ADD COLUMN {field_name} {field_type}")
+            else:
+                print(f"✓ 字段已存在: {field_name}")
+        
+        conn.commit()
+        conn.close()
+        
+        # 根据现有任务树和进度记录回填汇总值
+        from app.core.database import SessionLocal
+        from app.crud.rollup import rebuild_rollups
+        
+        db = SessionLocal()
+        try:
+            updated = rebuild_rollups(db)
+            db.commit()
+            print(f"✓ 已重算 {updated} 个任务的子树汇总")
+        finally:
+            db.close()
+        
+        print("✓ 子树汇总字段迁移完成！")
+        return True
+        
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    migrate_subtree_rollups()
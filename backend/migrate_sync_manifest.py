@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+创建同步清单（sync_manifests表）并由变更日志计算初始内容的迁移脚本
+"""
+
+import sqlite3
+from pathlib import Path
+
+def migrate_sync_manifest():
+    """创建sync_manifests表，按变更日志重算每个用户各类数据的条数和最新序号"""
+    print("开始创建同步清单迁移...")
+    
+    # 数据库文件路径
+    db_path = Path("./todo_app.db")
+    
+    try:
+        # 连接数据库
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='sync_manifests'")
+        exists = cursor.fetchone() is not None
+        conn.close()
+        
+        from app.core.database import Base, SessionLocal, engine
+        from app.crud.manifest import rebuild_manifests
+        from app.models.models import SyncManifest
+        
+        if not exists:
+            print("创建表: sync_manifests")
+            Base.metadata.create_all(bind=engine, tables=[SyncManifest.__table__])
+        else:
+            print("✓ 表已存在: sync_manifests")
+        
+        db = SessionLocal()
+        try:
+            rebuilt = rebuild_manifests(db)
+            db.commit()
+            print(f"✓ 已由变更日志重算 {rebuilt} 行同步清单")
+        finally:
+            db.close()
+        
+        print("✓ 同步清单迁移完成！")
+        return True
+        
+    except Exception as e:
+        print(f"迁移失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    migrate_sync_manifest()